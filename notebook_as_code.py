@@ -3,7 +3,7 @@ from dotenv import load_dotenv
 import article_relevance as ar
 import csv
 import re
-import pandas as pd
+import numpy as np
 import json
 from collections import Counter
 
@@ -20,7 +20,7 @@ with open('data/raw/labelled_data.csv') as file:
 all_doi = set([i.get('doi') for i in db_data] + [i.get('doi') for i in label_data])
 doi_set = ar.clean_dois(all_doi)
 
-check = ar.register_dois(all_doi)
+check = ar.register_dois_bulk(all_doi)
 
 new_dois = ['10.1590/s0102-69922012000200010', '10.1090/S0002-9939-2012-11404-2', '10.1063/1.4742131', '10.1007/s13355-012-0130-x']
 
@@ -42,14 +42,8 @@ neotoma_labels = [{'doi': i.get('doi'), 'label': 'In Neotoma', 'person': '0000-0
 all_labels = ar.add_paper_labels(neotoma_labels, project = 'Neotoma Relevance', create = True)
 
 # Now need to load in the labelled data and do the train/test split
-data_model = ar.get_model_data(project = "Neotoma Relevance", model = "allenai/specter2_base")
-
-data_model = [i for i in data_model if i.get('label') is not None]
-data_model = [dict(item, **{'target': int(bool(re.search(pattern='Not', string=item['label'])))}) for item in data_model]
-data_embedding = [i['embeddings'] for i in data_model]
-data_input = pd.DataFrame(data_embedding, columns = [f'embedding_{str(i)}' for i in range(len(data_model[0]['embeddings']))])
-data_input = data_input.assign(doi = [i['doi'] for i in data_model])
-data_input = data_input.assign(target = [i['target'] for i in data_model])
+data_model = ar.load_model_dataset(project = "Neotoma Relevance", model = "allenai/specter2_base").labelled()
+target = np.array([int(bool(re.search(pattern='Not', string=i))) for i in data_model.labels])
 
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression 
@@ -58,11 +52,12 @@ from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import BernoulliNB
 from sklearn.ensemble import RandomForestClassifier
 
-X_train, X_test, y_train, y_test = train_test_split(data_input.copy(),
-                                                    data_input['target'],
-                                                    test_size=0.2,
-                                                    random_state=42,
-                                                    stratify=data_input['target'])
+train_idx, test_idx = train_test_split(np.arange(len(data_model)),
+                                       test_size=0.2,
+                                       random_state=42,
+                                       stratify=target)
+X_train, X_test = data_model.take(train_idx), data_model.take(test_idx)
+y_train, y_test = target[train_idx], target[test_idx]
 
 classifiers = [
     (LogisticRegression(max_iter=1000), {
@@ -90,32 +85,29 @@ resultsDict = ar.relevancePredictTrain(x_train = X_train, y_train = y_train, cla
 with open('results.json', 'w', encoding='UTF-8') as f:
     json.dump(resultsDict['report'], f, indent=4, sort_keys=True, default=str)
 
-results = ar.relevancePredict(data_input, model = 'data/models/decisiontreeclassifier_2024-09-22_22-30-35.joblib')
+results = ar.relevancePredict(data_model, model = 'data/models/decisiontreeclassifier_2024-09-22_22-30-35.joblib')
 
 # Get new papers:
 with open('./data/raw/newdois.csv', 'r') as file:
     new_dois = file.read().splitlines()
 
 clean = ar.clean_dois(new_dois)
-check = ar.register_dois(clean['clean'])
-
-processed_data = ar.data_preprocessing(model_name = 'allenai/specter2_base')
-
-embeddings = ar.add_embeddings(processed_data, text_col = 'text', model_name = 'allenai/specter2_base')
+check = ar.register_dois_bulk(clean['clean'])
 
-new_data_model = ar.get_model_data(project = None, model = "allenai/specter2_base")
+# Fetch, clean, embed and register the new papers as one pipelined run.
+pipeline_counts = ar.run_embedding_pipeline(model_name = 'allenai/specter2_base')
 
-data_embedding = [i['embeddings'] for i in new_data_model]
-data_input = pd.DataFrame(data_embedding, columns = [f'embedding_{str(i)}' for i in range(len(new_data_model[0]['embeddings']))])
-data_input = data_input.assign(doi = [i['doi'] for i in new_data_model])
+new_data_model = ar.load_model_dataset(project = None, model = "allenai/specter2_base")
 
-models = [i for i in os.listdir('./data/models/') if re.match(r'^.*joblib$', i)]
+models = [os.path.join('./data/models/', i) for i in os.listdir('./data/models/') if re.match(r'^.*joblib$', i)]
 
-results = []
-for i in models:
-    results.append(ar.relevancePredict(data_input, model = i))
+# Per-model predictions are kept in a local ledger, so only new papers and changed embeddings are scored.
+new_predictions = ar.incremental_predict(new_data_model, models = models)
+ar.predToPQ(new_predictions, AWS = False, parquetPath = 'data')
 
-goodpapers = results[0].loc[results[0]['prediction'] == 1]['doi'].tolist()
-pubs = [ar.get_publication_metadata(i) for i in goodpapers]
+# Average the models' probabilities for each newly scored paper.
+mean_proba = new_predictions.groupby('doi')['predict_proba'].mean()
+goodpapers = mean_proba[mean_proba >= 0.5].index.tolist()
+pubs = ar.run_sync(ar.get_publication_metadata_async(goodpapers, concurrency = 16))
 
 counts = Counter([i[0].get('containertitle') for i in pubs])
\ No newline at end of file
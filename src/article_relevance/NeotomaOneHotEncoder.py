@@ -1,56 +1,63 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.base import BaseEstimator, TransformerMixin
 
 class NeotomaOneHotEncoder(BaseEstimator, TransformerMixin):
-    def __init__(self, min_count=3):
+    """_One-hot encode columns holding lists of values (e.g., article subjects)._
+
+    Args:
+        min_count (_int_): _Values appearing fewer than `min_count` times in `fit` are ignored._
+        sparse_output (_bool_): _Return a `scipy.sparse` CSR matrix from `transform`, otherwise a DataFrame of 0/1 integers._
+
+    >>> X = pd.DataFrame({'subject': [['ecology', 'pollen'], ['pollen'], [], ['math', 'pollen']]})
+    >>> encoder = NeotomaOneHotEncoder(min_count = 1, sparse_output = False).fit(X)
+    >>> encoder.transform(X)
+       pollen  ecology  math
+    0       1        1     0
+    1       1        0     0
+    2       0        0     0
+    3       1        0     1
+    >>> NeotomaOneHotEncoder(min_count = 2).fit_transform(X).toarray().tolist()
+    [[1], [1], [0], [1]]
+    """
+    def __init__(self, min_count=3, sparse_output=True):
         self.min_count = min_count
+        self.sparse_output = sparse_output
         self.categories = {}
         self.removed_rows = []
 
     def fit(self, X, y=None):
         # Consider subjects which apperance > min_count
+        self.categories = {}
         for col in X.columns:
-            value_counts = X[col].apply(pd.Series).stack().value_counts()
+            value_counts = X[col].explode().value_counts()
+            # 'None' marks an empty subject list and is never encoded.
+            value_counts = value_counts[value_counts.index != 'None']
             self.categories[col] = value_counts[value_counts >= self.min_count].index.tolist()
         return self
 
-    def transform(self, X):
-        transformed_dfs = []
-        for col in self.categories:
-            categories = self.categories.get(col, [])
-            # Ensure that all categories from the fit phase are present in the transform phase
-            for category in self.categories[col]:
-                if category not in X[col].apply(pd.Series).stack().unique():
-                    X[category] = 0
-
-            # Handling empty lists
-            X.loc[:, col] = X[col].apply(lambda x: ['None'] if len(x) == 0 else x)
-
-            # Leave the categories that exist and convert them to a stack
-            transformed_df = pd.get_dummies(X[col].apply(pd.Series).stack())
-            # If there is a category (say 'math') that has created a new column in 
-            # self.encoder but that 'math' does not exist in the new df, build it and
-            # encode with 0s
-            for category in categories:
-                if category not in transformed_df.columns:
-                    transformed_df[category] = 0
+    def get_feature_names_out(self, input_features=None):
+        return np.array([category for col in self.categories for category in self.categories[col]], dtype=object)
 
-            transformed_df = transformed_df.groupby(level=0).max().fillna(0)
-
-            # Change T/F to 0/1
-            transformed_df = transformed_df.astype(int)
-            transformed_df = transformed_df[categories]
-            transformed_dfs.append(transformed_df)
-
-            # Keep track of removed rows for debugging
-            removed_indices = set(X.index) - set(transformed_df.index)
-            self.removed_rows.extend(list(removed_indices))
-        
-        result = pd.concat(transformed_dfs, axis=1)
-        
-        # Drop column where there were no subjects from a query
-        if 'None' in result.columns:
-            result = result.drop(columns=['None'])
-        
-        return result
\ No newline at end of file
+    def transform(self, X):
+        n_rows = X.shape[0]
+        blocks = []
+        for col, categories in self.categories.items():
+            # One element per row/value pair, indexed by row position. Empty lists become NaN.
+            exploded = X[col].reset_index(drop=True).explode()
+            codes = pd.Categorical(exploded.to_numpy(), categories=categories).codes
+            known = codes >= 0
+            block = sparse.csr_matrix((np.ones(known.sum(), dtype=np.int8),
+                                       (exploded.index.to_numpy()[known], codes[known])),
+                                      shape=(n_rows, len(categories)))
+            # Repeated values within a row are summed by csr_matrix, reset them to 1.
+            block.data[:] = 1
+            blocks.append(block)
+
+        result = sparse.hstack(blocks, format='csr', dtype=np.int8) if blocks else sparse.csr_matrix((n_rows, 0), dtype=np.int8)
+        if self.sparse_output:
+            return result
+        return pd.DataFrame(result.toarray().astype(int),
+                            index=X.index,
+                            columns=self.get_feature_names_out())
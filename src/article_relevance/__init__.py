@@ -1,17 +1,35 @@
 #from .logs import get_logger
 from .loadPQ import loadPQ
-from .gddQuery import gddQuery
+from .gddQuery import gddQuery, iter_gdd_pages
+from .seen_index import SeenIDIndex
 from .rec_print import rel_print
-from .data_preprocessing import data_preprocessing
+from .data_preprocessing import data_preprocessing, iter_preprocessed
+from .language_id import detect_languages, LanguageCache
 from .add_embeddings import add_embeddings
+from .embedding_pipeline import run_embedding_pipeline
+from .embedding_job import EmbeddingJob
+from .embedding_workers import EmbeddingWorkerPool, get_worker_pool, shutdown_worker_pools
+from .embedding_engine import embed_articles, embed_texts
+from .model_registry import get_embedding_model, get_classifier, warm_up
 from .relevancePredict import relevancePredict
+from .batch_scoring import score_embeddings
+from .ensemble_predict import ensemble_predict, fit_stacker
+from .prediction_ledger import PredictionLedger, incremental_predict
 from .relevancePredictTrain import relevancePredictTrain
 from .predToPQ import predToPQ
+from .prediction_dataset import PredictionDataset
 from .NeotomaOneHotEncoder import NeotomaOneHotEncoder
 from .clean_dois import clean_dois
 from .clean_orcids import clean_orcids
 from .add_labels import add_paper_labels
 from .api_calls import get_pub_for_embedding, get_publication_metadata
 from .register_apis import register_label, register_embedding, register_project, register_dois, register_person, register_paper_label
-from .check_apis import project_exists, label_exists, paper_label_exists, embedding_exists, person_exists
-from .get_model_data import get_model_data
+from .register_apis import register_dois_bulk, register_paper_labels_bulk, register_embeddings_bulk
+from .check_apis import project_exists, label_exists, paper_label_exists, embedding_exists, person_exists, embeddings_exist
+from .get_model_data import get_model_data, iter_model_data, load_model_dataset
+from .model_dataset import ModelDataset
+from .embedding_store import EmbeddingStore
+from .ann_index import ArticleIndex, load_index, similar_articles
+from .api_client import NeotomaClient, get_client, configure_client
+from .embedding_codec import encode_embedding, decode_embedding, decode_embeddings
+from .async_apis import gather_bounded, run_sync, run_concurrently, get_publication_metadata_async, projects_exist_async, labels_exist_async, people_exist_async, embeddings_exist_async, paper_labels_exist_async, register_dois_async, register_paper_labels_async, register_embeddings_async
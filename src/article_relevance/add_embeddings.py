@@ -1,18 +1,30 @@
 """_Generate a dictionary of embeddings for analysis._
 """
+import time
 from datetime import datetime
-from itertools import chain
-from transformers import AutoTokenizer
-from adapters import AutoAdapterModel
-from .check_apis import embedding_exists
-from .register_apis import register_embedding
+from .check_apis import embeddings_exist
+from .register_apis import register_embeddings_bulk
+from .embedding_engine import embed_articles
+from .model_registry import get_embedding_model, get_tokenizer
+from .embedding_job import EmbeddingJob
+from .embedding_workers import get_worker_pool
 
 def add_embeddings(article_metadata:list,
                    text_col:str,
                    model_name:str = 'allenai/specter2_base',
                    adapter_name:str = 'allenai/specter2_classification',
                    check:bool = True,
-                   register:bool = True):
+                   register:bool = True,
+                   batch_size:int = 32,
+                   device:str = 'cpu',
+                   api_batch_size:int = 100,
+                   encoding:str = 'float32',
+                   store = None,
+                   index = None,
+                   checkpoint_dir:str = None,
+                   shard_size:int = 1024,
+                   workers:int = 1,
+                   threads:int = None):
     """
     Add sentence embeddings to the dataframe using the allenai/specter2 model. 
     Args:
@@ -22,8 +34,21 @@ def add_embeddings(article_metadata:list,
         adapter_name (str): Adapter name on hugging face model hub.
         check (bool): Should we check to see whether an embedding for this paper & embedding currently exists in the database?
         register (bool): Should we add the embedded data to the database?
+        batch_size (int): The number of articles passed through the model at once. Articles are sorted by token length and each batch is padded to its longest member.
+        device (str): The torch device used for the model. The tokenizer and model are loaded once per process and reused between calls.
+        api_batch_size (int): The number of DOIs sent in each request when checking for and registering embeddings.
+        encoding (str): Embeddings are sent to the database as base64 `float32` or `float16` buffers.
+        store (EmbeddingStore): An optional local embedding store that new embeddings are appended to.
+        index (ArticleIndex): An optional nearest-neighbour index that new embeddings are added to.
+        checkpoint_dir (str): Run as a resumable `EmbeddingJob` checkpointed in this directory. Re-running with the same directory after a failure skips articles already embedded.
+            The embeddings are read back from the job's shards to build the returned list; call `EmbeddingJob.run()` directly to get counts without holding every embedding in memory.
+        shard_size (int): With `checkpoint_dir`, the number of articles embedded and checkpointed together.
+        workers (int): The number of CPU worker processes that embed batches in parallel, each holding its own copy of the model. 1 embeds in this process.
+        threads (int): Torch threads per worker process. Defaults to the number of CPUs divided by `workers`.
     Returns:
-        list A list of embeddings for each item in article_embedding with a list of embeddings, the article doi, the date and the embedding model used.
+        list A list of embeddings for each item in article_embedding with a float32 array of embeddings, the article doi, the date and the embedding model used.
+            New embeddings are returned as 1-D `np.float32` arrays (earlier versions returned Python lists of floats); use `.tolist()` where a JSON-serializable list is needed.
+            Papers that already have an embedding in the database are returned as the record the API sent.
     
     # Generate embedding on a record that does not currently exist in the database.
     # Setting `check` and `register` to `False` to support testing. 
@@ -64,41 +89,59 @@ def add_embeddings(article_metadata:list,
     if not all(test_fields):
         raise ValueError("Your article_metadata object is not consistent, either an element is missing the `doi` key, or missing the `text_col` field.")
     
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoAdapterModel.from_pretrained(model_name)
-    # load the adapter(s) as per allenai/specter2 requirement.
-    model.load_adapter(adapter_name,
-                       source="hf",
-                       load_as="classification",
-                       set_active=True,
-                       device_map='gpu')
-    embedding_object = []
+    if workers > 1:
+        if device != 'cpu':
+            raise ValueError("Embedding with several worker processes is only supported on the cpu device.")
+        # The workers hold the model, this process only needs the tokenizer.
+        pool = get_worker_pool(model_name, adapter_name, workers = workers, threads = threads)
+        tokenizer, model = get_tokenizer(model_name), None
+    else:
+        pool = None
+        tokenizer, model = get_embedding_model(model_name, adapter_name, device)
+    if checkpoint_dir is not None:
+        job = EmbeddingJob(checkpoint_dir, model_name = model_name, adapter_name = adapter_name)
+        print(f'Building embeddings for {len(article_metadata)} objects in {checkpoint_dir}.')
+        return job.run(article_metadata, text_col, tokenizer = tokenizer, model = model,
+                       check = check, register = register, batch_size = batch_size, shard_size = shard_size,
+                       pool = pool, api_batch_size = api_batch_size, encoding = encoding, store = store, index = index,
+                       return_embeddings = True)
+    embedding_object = [None] * len(article_metadata)
+    to_embed = []
     print(f'Building embeddings for {len(article_metadata)} objects.')
-    for i in article_metadata:
-        if check:
-            check_embedding = embedding_exists(doi = i.get('doi'), model = model_name)
-        else:
-            check_embedding = None
-
+    if check:
+        existing = embeddings_exist([i.get('doi') for i in article_metadata], model = model_name, batch_size = api_batch_size)
+    else:
+        existing = {}
+    for idx, i in enumerate(article_metadata):
+        check_embedding = existing.get(i.get('doi'))
         if check_embedding is not None:
             print(f"{model_name} embeddings already exist for {i.get('doi')}.")
-            embedding_object.append(check_embedding)
+            embedding_object[idx] = check_embedding
         else:
-            tokens = tokenizer(i.get(text_col),
-                                padding='max_length',
-                                truncation=True,
-                                max_length=512,
-                                return_tensors='pt',
-                                return_token_type_ids=False)
-            output = model(**tokens)
-            embeddings_array = list(chain.from_iterable(output.last_hidden_state[:, 0, :].detach().numpy()))
-            embeddings_dict = {'embeddings': [j.item() for j in embeddings_array],
-                            'doi': i.get('doi'),
-                            'date': datetime.now(),
-                            'model': model_name}
-            embedding_object.append(embeddings_dict)
-            if register:
-                register_embedding(embeddings_dict)    
-    assert (len(embedding_object) != len(article_metadata),
-        f"The submitted object and returned object are not of the same length.")
+            to_embed.append(idx)
+
+    start = time.perf_counter()
+    embeddings, dois = embed_articles([article_metadata[j] for j in to_embed],
+                                      text_col = text_col,
+                                      tokenizer = tokenizer,
+                                      model = model,
+                                      batch_size = batch_size,
+                                      pool = pool)
+    seconds = time.perf_counter() - start
+    if len(dois) > 0:
+        print(f'Embedded {len(dois)} objects in {seconds:.1f}s ({len(dois) / seconds:.1f} per second, {workers} worker(s)).')
+    for idx, doi, vector in zip(to_embed, dois, embeddings):
+        embeddings_dict = {'embeddings': vector,
+                           'doi': doi,
+                           'date': datetime.now(),
+                           'model': model_name}
+        embedding_object[idx] = embeddings_dict
+    if store is not None:
+        store.add(dois, embeddings)
+    if index is not None:
+        index.add(dois, embeddings)
+    if register:
+        register_embeddings_bulk([embedding_object[j] for j in to_embed], batch_size = api_batch_size, encoding = encoding)
+    assert len(embedding_object) == len(article_metadata), \
+        "The submitted object and returned object are not of the same length."
     return embedding_object
@@ -1,22 +1,23 @@
 from datetime import datetime
-from .check_apis import paper_label_exists, project_exists, label_exists, person_exists
-from .register_apis import register_paper_label, register_person, register_label
+from .check_apis import project_exists, label_exists, person_exists
+from .register_apis import register_paper_labels_bulk, register_person, register_label
 
 def add_paper_labels(labellist: list,
                      project: str,
-                     create: bool = False):
+                     create: bool = False,
+                     batch_size: int = 500):
     """_Add label data for DOIs in the set of metadata. Allows the user to pass in a `source`._
 
     Args:
         labellist (list): _A list of dict objects containing the keys `label`, `person` and `doi`._
         project (str): _A valid project name in the database, registered with the `register_project()` function.
         create (bool, optional): _If no label data exists, should it be created in the cloud?_. Defaults to False.
+        batch_size (int, optional): _The number of paper labels sent to the API in each request_. Defaults to 500.
 
     Returns:
-        _dict_: _A list of dict objects returned from `register_paper_label()`._
+        _list_: _A list of dict objects, one per label, with the keys `doi`, `status` and `message`._
     """
     valid_project = project_exists(project)
-    registry = []
     # Check that the project exists:
     if valid_project is None:
         raise ValueError(f'The project {project} is not registered in the database. Use `register_project()` to add the project before adding labels.')
@@ -34,12 +35,6 @@ def add_paper_labels(labellist: list,
             raise ValueError(f"The label {i} doesn't exist for project {project}. To add this label set `create` to True.")
         elif valid_label is None and create is True:
             new_person = register_person(i)
-    # Label papers:
-    for i in labellist:
-        paper_in = paper_label_exists(doi = i.get('doi'), label = i.get('label'), project = project, person = i.get('person'))
-        if paper_in is None:
-            labeledpaper = register_paper_label(i.get('doi'), i.get('label'), project, i.get('person'))
-            if labeledpaper is not None:
-                break
-            registry.append(labeledpaper)
+    # Label papers, existing labels are reported as `present` by the API:
+    registry = register_paper_labels_bulk(labellist, project, batch_size = batch_size)
     return registry
@@ -0,0 +1,258 @@
+"""_An approximate nearest-neighbour index over article embeddings._
+
+The index is an inverted file (IVF) over cosine similarity, written in NumPy.
+Embeddings are L2-normalized and clustered with spherical k-means; each article
+is filed under its nearest centroid. A query is compared with the centroids and
+then only with the articles in the `n_probe` closest lists, so a search touches
+a few thousand vectors rather than the whole corpus.
+
+Until the index holds `min_train` articles every search is exact (brute force).
+Articles added after training are filed into the existing lists and kept in a
+small unpacked tail that is searched exhaustively, so inserts are cheap. The
+lists are repacked once the tail grows past a tenth of the index.
+"""
+import os
+import numpy as np
+from .model_dataset import RowBuffer
+from .model_registry import registry
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype = np.float32)
+    norms = np.linalg.norm(vectors, axis = -1, keepdims = True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _assign(vectors, centroids, chunk_size: int = 8192):
+    """_The index of the most similar centroid for each (normalized) vector._"""
+    result = np.empty(vectors.shape[0], dtype = np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        result[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis = 1)
+    return result
+
+
+def _kmeans(vectors, n_lists: int, n_iter: int = 10, seed: int = 0):
+    """_Spherical k-means: unit-length centroids that maximize cosine similarity with their members._"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace = False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind = 'stable')
+        ordered = assignments[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        sums = np.add.reduceat(vectors[order], starts, axis = 0)
+        filled = ordered[starts]
+        # Reseed empty lists with random articles.
+        empty = np.setdiff1d(np.arange(n_lists), filled)
+        centroids[filled] = _normalize(sums)
+        if len(empty) > 0:
+            centroids[empty] = vectors[rng.choice(vectors.shape[0], len(empty), replace = False)]
+    return centroids
+
+
+class ArticleIndex:
+    """_A cosine-similarity IVF index mapping DOIs to embeddings._
+
+    Args:
+        dim (_int_): _The embedding length (768 for SPECTER2)._
+        n_lists (_int_): _The number of inverted lists. By default about `4 * sqrt(n)`, re-chosen as the index grows._
+        n_probe (_int_): _The number of lists searched for each query. Larger values trade speed for recall._
+        min_train (_int_): _The index is trained once it holds this many articles; smaller indexes are searched exactly._
+        train_size (_int_): _The number of articles sampled per list when training the centroids._
+
+    >>> index = ArticleIndex(dim = 2)
+    >>> index.add(['10.1/a', '10.1/b', '10.1/c'], np.array([[1, 0], [0.9, 0.1], [0, 1]]))
+    >>> [doi for doi, similarity in index.search([1, 0], k = 2)]
+    ['10.1/a', '10.1/b']
+    """
+    def __init__(self, dim: int = 768, n_lists: int = None, n_probe: int = 8,
+                 min_train: int = 4096, train_size: int = 40):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train = min_train
+        self.train_size = train_size
+        self.dois = []
+        self.rows = {}
+        self.centroids = None
+        self.trained_size = 0
+        self._vectors = RowBuffer(dim)
+        self._active = np.zeros(0, dtype = bool)
+        self._assignments = np.zeros(0, dtype = np.int64)
+        self._order = np.zeros(0, dtype = np.int64)
+        self._offsets = np.zeros(1, dtype = np.int64)
+        self._packed = np.zeros((0, dim), dtype = np.float32)
+        self._packed_rows = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, doi):
+        return doi in self.rows
+
+    @property
+    def vectors(self):
+        """_The normalized embeddings, one row per insert (superseded rows included)._"""
+        return self._vectors.array()
+
+    def vector(self, doi: str):
+        """_The normalized embedding stored for a DOI._"""
+        if doi not in self.rows:
+            raise ValueError(f"{doi} is not in the index.")
+        return self.vectors[self.rows[doi]]
+
+    def add(self, dois: list, embeddings):
+        """_Add (or replace) the embeddings for `dois`._"""
+        embeddings = _normalize(embeddings).reshape(-1, self.dim)
+        if embeddings.shape[0] != len(dois):
+            raise ValueError(f"Expected {len(dois)} embeddings, not {embeddings.shape[0]}.")
+        first_row = self._vectors.n
+        self._vectors.reserve(len(dois))[:] = embeddings
+        self._active = np.concatenate([self._active, np.ones(len(dois), dtype = bool)])
+        for offset, doi in enumerate(dois):
+            if doi in self.rows:
+                self._active[self.rows[doi]] = False
+            self.rows[doi] = first_row + offset
+            self.dois.append(doi)
+        if self.centroids is None:
+            self._assignments = np.concatenate([self._assignments, np.full(len(dois), -1, dtype = np.int64)])
+            if len(self) >= self.min_train:
+                self.train()
+        else:
+            self._assignments = np.concatenate([self._assignments, _assign(embeddings, self.centroids)])
+            if self.n_lists is None and len(self) >= 4 * self.trained_size:
+                # The corpus has outgrown the automatically chosen number of lists.
+                self.train()
+        return None
+
+    def train(self, n_iter: int = 10, seed: int = 0):
+        """_Cluster the stored embeddings and file every article under its nearest centroid._"""
+        active = np.flatnonzero(self._active)
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(len(active))))
+        n_lists = min(n_lists, len(active))
+        if n_lists == 0:
+            return self
+        rng = np.random.default_rng(seed)
+        sample = active
+        if len(active) > self.train_size * n_lists:
+            sample = rng.choice(active, self.train_size * n_lists, replace = False)
+        self.centroids = _kmeans(self.vectors[sample], n_lists, n_iter = n_iter, seed = seed)
+        self._assignments = _assign(self.vectors, self.centroids)
+        self.trained_size = len(active)
+        self._pack()
+        return self
+
+    def _pack(self):
+        """_Lay the vectors out contiguously by list, so each probed list is a slice._"""
+        n_rows = self._vectors.n
+        active = np.flatnonzero(self._active[:n_rows])
+        order = active[np.argsort(self._assignments[active], kind = 'stable')]
+        counts = np.bincount(self._assignments[order], minlength = self.centroids.shape[0])
+        self._order = order
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._packed = self.vectors[order]
+        self._packed_rows = n_rows
+
+    def search(self, vector, k: int = 10):
+        """_The `k` most similar articles to `vector`, as a list of (doi, cosine similarity) tuples._"""
+        query = _normalize(vector).reshape(self.dim)
+        n_rows = self._vectors.n
+        if self.centroids is None:
+            candidates = np.flatnonzero(self._active[:n_rows])
+            scores = self.vectors[candidates] @ query
+        else:
+            if n_rows - self._packed_rows > max(1024, n_rows // 10):
+                self._pack()
+            n_probe = min(self.n_probe, self.centroids.shape[0])
+            closeness = self.centroids @ query
+            probes = np.argpartition(-closeness, n_probe - 1)[:n_probe]
+            blocks = [(self._order[self._offsets[i]:self._offsets[i + 1]],
+                       self._packed[self._offsets[i]:self._offsets[i + 1]] @ query) for i in probes]
+            # Articles added since the last pack are searched exhaustively.
+            tail = np.arange(self._packed_rows, n_rows)
+            blocks.append((tail, self.vectors[self._packed_rows:n_rows] @ query))
+            candidates = np.concatenate([i[0] for i in blocks])
+            scores = np.concatenate([i[1] for i in blocks])
+            # Drop rows replaced since the last pack.
+            keep = self._active[candidates]
+            candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        ranked = np.argsort(-scores, kind = 'stable')
+        return [(self.dois[candidates[i]], float(scores[i])) for i in ranked]
+
+    def save(self, path: str):
+        """_Write the index to a `.npz` file, replacing it atomically._"""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f,
+                     vectors = self.vectors,
+                     dois = np.array(self.dois, dtype = str),
+                     active = self._active,
+                     assignments = self._assignments,
+                     centroids = self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype = np.float32),
+                     settings = np.array([self.n_lists or 0, self.n_probe, self.min_train, self.train_size, self.trained_size]))
+        os.replace(tmp_file, path)
+        return None
+
+    @classmethod
+    def load(cls, path: str):
+        """_Read an index written by `save()`._"""
+        with np.load(path, allow_pickle = False) as stored:
+            n_lists, n_probe, min_train, train_size, trained_size = stored['settings'].tolist()
+            index = cls(dim = stored['vectors'].shape[1], n_lists = n_lists or None,
+                        n_probe = n_probe, min_train = min_train, train_size = train_size)
+            vectors = stored['vectors']
+            index._vectors = RowBuffer(index.dim, capacity = vectors.shape[0])
+            index._vectors.reserve(vectors.shape[0])[:] = vectors
+            index.dois = stored['dois'].tolist()
+            index._active = stored['active']
+            index._assignments = stored['assignments']
+            if stored['centroids'].shape[0] > 0:
+                index.centroids = stored['centroids']
+            index.trained_size = trained_size
+        index.rows = {index.dois[i]: i for i in np.flatnonzero(index._active)}
+        if index.centroids is not None:
+            index._pack()
+        return index
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        """_Build an index from every embedding in an `EmbeddingStore`._"""
+        data = store.dataset()
+        index = cls(dim = store.dim, **kwargs)
+        index.add(data.dois.tolist(), data.embeddings)
+        return index
+
+
+def load_index(path: str = 'data/index/specter2_base.npz'):
+    """_Return a (cached) index read from `path`. The file modification time is part of the key, so a re-saved index is reloaded._"""
+    path = os.path.abspath(path)
+    return registry.get(('ann_index', path, os.path.getmtime(path)),
+                        lambda: ArticleIndex.load(path))
+
+
+def similar_articles(doi: str, k: int = 10, index: ArticleIndex = None, path: str = 'data/index/specter2_base.npz'):
+    """_Find the stored articles most similar to a DOI._
+
+    Args:
+        doi (_str_): _A DOI that is in the index._
+        k (_int_): _The number of neighbours to return._
+        index (_ArticleIndex_): _The index to search. Loaded from `path` (once per process) if not given._
+        path (_str_): _The location of an index written with `ArticleIndex.save()`._
+
+    Returns:
+        _list_: _Dicts with the `doi` and cosine `similarity` of each neighbour, most similar first._
+
+    >>> index = ArticleIndex(dim = 2)
+    >>> index.add(['10.1/a', '10.1/b', '10.1/c'], np.array([[1, 0], [0.6, 0.8], [0, 1]]))
+    >>> similar_articles('10.1/a', k = 1, index = index)
+    [{'doi': '10.1/b', 'similarity': 0.6000000238418579}]
+    """
+    if index is None:
+        index = load_index(path)
+    neighbours = index.search(index.vector(doi), k = k + 1)
+    return [{'doi': i, 'similarity': j} for i, j in neighbours if i != doi][:k]
@@ -0,0 +1,120 @@
+"""_A shared, connection-pooled client for the Neotoma relevance API._
+
+All API calls in the package go through a single `requests.Session`, so
+connections are kept alive and reused between calls. Connection errors are
+retried with exponential backoff and jitter for every request. Read timeouts
+and 5xx responses are only retried for idempotent methods (e.g., GET), since
+a POST that timed out may already have been committed by the API.
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Timeouts (in seconds) for endpoints that are slower than a single record lookup.
+ENDPOINT_TIMEOUTS = {
+    '/v0.1/doi': 30,
+    '/v0.1/doi/embeddingtext': 60,
+    '/v0.1/doi/embeddings': 30,
+    '/v0.1/doi/labels': 30,
+    '/v0.1/modeldata': 120
+}
+
+
+class NeotomaClient:
+    """_A connection-pooled HTTP client with retries for the Neotoma relevance API._
+
+    Args:
+        api_home (_str_): _The API host (e.g., `localhost:3000`). Defaults to the `API_HOME` environment variable._
+        pool_size (_int_): _The maximum number of pooled connections kept open to the API._
+        retries (_int_): _The number of retries for connection errors, and for read timeouts and
+            5xx responses to idempotent requests. POST requests are only retried on connection errors._
+        backoff_factor (_float_): _Retries wait `backoff_factor * 2 ** (retry - 1)` seconds._
+        backoff_jitter (_float_): _A random wait of up to `backoff_jitter` seconds added to each backoff._
+        timeout (_float_): _The default timeout, in seconds, for endpoints not listed in `timeouts`._
+        timeouts (_dict_): _Per-endpoint timeouts, added to (or replacing) `ENDPOINT_TIMEOUTS`._
+
+    >>> client = NeotomaClient(api_home = 'localhost:3000', timeouts = {'/v0.1/people': 5})
+    >>> client.url('/v0.1/people'), client.timeout_for('/v0.1/people'), client.timeout_for('/v0.1/modeldata')
+    ('http://localhost:3000/v0.1/people', 5, 120)
+    """
+    def __init__(self,
+                 api_home: str = None,
+                 pool_size: int = 32,
+                 retries: int = 5,
+                 backoff_factor: float = 0.5,
+                 backoff_jitter: float = 0.5,
+                 timeout: float = 10,
+                 timeouts: dict = None):
+        self.api_home = api_home
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        retry = Retry(total = retries,
+                      backoff_factor = backoff_factor,
+                      backoff_jitter = backoff_jitter,
+                      status_forcelist = (500, 502, 503, 504),
+                      # The default `allowed_methods` leaves out POST, so an insert is only re-sent when
+                      # the connection failed before the request reached the API.
+                      raise_on_status = False)
+        adapter = HTTPAdapter(pool_connections = pool_size,
+                              pool_maxsize = pool_size,
+                              max_retries = retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, endpoint: str):
+        """_The full URL for an API endpoint._"""
+        api_home = self.api_home or os.environ['API_HOME']
+        if not api_home.startswith(('http://', 'https://')):
+            api_home = 'http://' + api_home
+        return api_home + endpoint
+
+    def timeout_for(self, endpoint: str):
+        """_The timeout, in seconds, used for an API endpoint._"""
+        return self.timeouts.get(endpoint, self.timeout)
+
+    def get(self, endpoint: str, params: dict = None, timeout: float = None):
+        """_Send a GET request to an API endpoint, returning the `requests.Response`._"""
+        return self.session.get(self.url(endpoint),
+                                params = params,
+                                timeout = timeout or self.timeout_for(endpoint))
+
+    def post(self, endpoint: str, data: dict = None, timeout: float = None):
+        """_Send a POST request to an API endpoint, returning the `requests.Response`._"""
+        return self.session.post(self.url(endpoint),
+                                 data = data,
+                                 timeout = timeout or self.timeout_for(endpoint))
+
+    def close(self):
+        """_Close all pooled connections._"""
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """_Return the shared API client, creating it with default settings on first use._"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = NeotomaClient()
+        return _client
+
+
+def configure_client(**kwargs):
+    """_Replace the shared API client with one created from `kwargs` (see `NeotomaClient`)._
+
+    Returns:
+        _NeotomaClient_: _The new shared client._
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = NeotomaClient(**kwargs)
+        return _client
@@ -0,0 +1,133 @@
+"""_Concurrent, asyncio-based variants of the Neotoma relevance API calls._
+
+Each call still goes through the shared pooled client (see `api_client`), but
+independent calls are run concurrently, with at most `concurrency` requests in
+flight at once. Keep `concurrency` at or below the client `pool_size` so that
+connections are reused rather than opened and discarded.
+
+>>> run_concurrently(round, [{'number': 2.4}, {'number': 2.6}], concurrency = 2)
+[2, 3]
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .api_calls import get_publication_metadata
+from .check_apis import project_exists, label_exists, paper_label_exists, embedding_exists, person_exists
+from .register_apis import register_embedding, register_dois, register_paper_label
+
+
+async def gather_bounded(func, calls: list, concurrency: int = 16):
+    """_Run `func` once for each set of keyword arguments in `calls`, at most `concurrency` at a time._
+
+    Args:
+        func (_callable_): _A blocking function, e.g., `get_publication_metadata`._
+        calls (_list[dict]_): _The keyword arguments for each call._
+        concurrency (_int_): _The maximum number of calls running at once._
+
+    Returns:
+        _list_: _The return value of each call, in the order of `calls`._
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be a positive integer.")
+    loop = asyncio.get_running_loop()
+    # The pool size bounds the calls in flight; calls beyond it queue in the executor.
+    executor = ThreadPoolExecutor(max_workers = concurrency)
+    try:
+        return await asyncio.gather(*[loop.run_in_executor(executor, partial(func, **i)) for i in calls])
+    finally:
+        # Every call has finished (or failed) here, so don't block the event loop joining the threads.
+        executor.shutdown(wait = False, cancel_futures = True)
+
+
+def run_sync(coroutine):
+    """_Run a coroutine to completion from synchronous code, including from within a running event loop (e.g., Jupyter)._"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = {}
+    def runner():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target = runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def run_concurrently(func, calls: list, concurrency: int = 16):
+    """_Synchronous wrapper for `gather_bounded()`._"""
+    return run_sync(gather_bounded(func, calls, concurrency))
+
+
+async def get_publication_metadata_async(dois: list, concurrency: int = 16):
+    """_Fetch publication metadata for many DOIs. Returns a list in the order of `dois`._"""
+    return await gather_bounded(get_publication_metadata, [{'doi': i} for i in dois], concurrency)
+
+
+async def projects_exist_async(projects: list, concurrency: int = 16):
+    """_Check that each project exists. Returns a list in the order of `projects`._"""
+    return await gather_bounded(project_exists, [{'project': i} for i in projects], concurrency)
+
+
+async def labels_exist_async(labels: list, project: str, concurrency: int = 16):
+    """_Check that each label exists for a project. Returns a list in the order of `labels`._"""
+    return await gather_bounded(label_exists, [{'label': i, 'project': project} for i in labels], concurrency)
+
+
+async def people_exist_async(orcids: list, concurrency: int = 16):
+    """_Check that each person exists. Returns a list in the order of `orcids`._"""
+    return await gather_bounded(person_exists, [{'orcid': i} for i in orcids], concurrency)
+
+
+async def paper_labels_exist_async(labellist: list, project: str, concurrency: int = 16):
+    """_Check each paper label (dicts with the keys `doi`, `label` and `person`). Returns a list in the order of `labellist`._"""
+    calls = [{'doi': i.get('doi'), 'label': i.get('label'), 'project': project, 'person': i.get('person')} for i in labellist]
+    return await gather_bounded(paper_label_exists, calls, concurrency)
+
+
+async def embeddings_exist_async(dois: list, model: str, concurrency: int = 16):
+    """_Check for existing embeddings. Returns a dict keyed by DOI, as for `embeddings_exist()`._"""
+    found = await gather_bounded(embedding_exists, [{'doi': i, 'model': model} for i in dois], concurrency)
+    return dict(zip(dois, found))
+
+
+async def register_paper_labels_async(labellist: list, project: str, concurrency: int = 16):
+    """_Label many papers (dicts with the keys `doi`, `label` and `person`). Returns a list in the order of `labellist`._"""
+    calls = [{'doi': i.get('doi'), 'label': i.get('label'), 'project': project, 'orcid': i.get('person')} for i in labellist]
+    return await gather_bounded(register_paper_label, calls, concurrency)
+
+
+async def register_embeddings_async(embedding_dicts: list, concurrency: int = 16) -> None:
+    """_Register many embeddings, as returned by `add_embeddings()`, with one request per embedding.
+
+    Like `register_embedding()`, this only prints the outcome of each request; use
+    `register_embeddings_bulk()` for a per-embedding status._
+    """
+    await gather_bounded(register_embedding, [{'embedding_dict': i} for i in embedding_dicts], concurrency)
+    return None
+
+
+async def register_dois_async(dois: list, concurrency: int = 16):
+    """_Insert each unique DOI, with one request per DOI.
+
+    Returns:
+        _obj_: _An object with properties `submitted`, `rejected`, `inserted` and `present`, as for `register_dois()`._
+    """
+    outcomes = await gather_bounded(register_dois, [{'dois': [i], 'verbose': False} for i in set(dois)], concurrency)
+    combined = {'submitted': [], 'rejected': [], 'inserted': [], 'present': []}
+    for outcome in outcomes:
+        # register_dois() returns an empty list for invalid DOIs.
+        if isinstance(outcome, dict):
+            for key, value in combined.items():
+                value.extend(outcome.get(key))
+    return combined
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
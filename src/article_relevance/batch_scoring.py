@@ -0,0 +1,109 @@
+"""_Score an embedding matrix against one or more relevance models._
+"""
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+from .model_registry import get_classifier
+from .model_dataset import ModelDataset, model_input
+
+# Every prediction writer returns this schema, so files in the prediction dataset can be read together.
+PREDICTION_SCHEMA = pa.schema([('doi', pa.string()),
+                               ('predict_proba', pa.float32()),
+                               ('prediction', pa.int8()),
+                               ('model_metadata', pa.string()),
+                               ('prediction_date', pa.timestamp('us'))])
+
+
+def prediction_table(dois, predict_proba, prediction, model_metadata, prediction_date = None, columns: dict = None):
+    """_Build a table of predictions in `PREDICTION_SCHEMA`._
+
+    Args:
+        dois (_array-like_): _The DOI for each row._
+        predict_proba (_array-like_): _The probability of relevance for each row._
+        prediction (_array-like_): _The 0/1 (or boolean) prediction for each row._
+        model_metadata (_str_ or _array-like_): _The model name, for all rows or for each row._
+        prediction_date (_datetime_): _The prediction time. Defaults to now._
+        columns (_dict_): _Extra float32 columns (e.g., per-model probabilities), placed after `doi`._
+
+    Returns:
+        _pa.Table_: _The predictions._
+
+    >>> prediction_table(['a'], [0.9], [True], 'lr').schema.field('prediction').type
+    DataType(int8)
+    """
+    n_rows = len(dois)
+    if isinstance(model_metadata, str):
+        model_metadata = [model_metadata] * n_rows
+    extra = {name: pa.array(np.asarray(values, dtype = np.float32)) for name, values in (columns or {}).items()}
+    schema = PREDICTION_SCHEMA
+    for i, name in enumerate(extra):
+        schema = schema.insert(1 + i, pa.field(name, pa.float32()))
+    return pa.table(dict({'doi': pa.array(np.asarray(dois, dtype = object), type = pa.string())},
+                         **extra,
+                         predict_proba = pa.array(np.asarray(predict_proba, dtype = np.float32)),
+                         prediction = pa.array(np.asarray(prediction).astype(np.int8)),
+                         model_metadata = pa.array(model_metadata, type = pa.string()),
+                         prediction_date = pa.array(np.full(n_rows, np.datetime64(prediction_date or datetime.now(), 'us')))),
+                    schema = schema)
+
+
+def _load_models(models):
+    """_Resolve model paths (or fitted estimators) to (name, model) pairs._"""
+    if isinstance(models, str) or not isinstance(models, (list, tuple, dict)):
+        models = [models]
+    if isinstance(models, dict):
+        return [(name, get_classifier(i) if isinstance(i, str) else i) for name, i in models.items()]
+    return [(i, get_classifier(i)) if isinstance(i, str) else (type(i).__name__, i) for i in models]
+
+
+def score_embeddings(embeddings,
+                     dois: list,
+                     models,
+                     chunk_size: int = 4096,
+                     predictThld: float = 0.5):
+    """_Score an (n, dim) embedding matrix with each model in one pass over the rows._
+
+    The matrix is scored `chunk_size` rows at a time, so memory use is bounded by the chunk
+    rather than the corpus, and each chunk is shared by every model.
+
+    Args:
+        embeddings (_np.ndarray_): _A float32 matrix of shape (n, dim), e.g., `ModelDataset.embeddings`._
+        dois (_array-like_): _The DOI for each row._
+        models (_str_, _list_ or _dict_): _Paths to joblib models, fitted estimators, or a dict of `{name: model}`._
+        chunk_size (_int_): _The number of rows passed to `predict_proba` at once._
+        predictThld (_float_): _The probability at or above which a paper is predicted relevant._
+
+    Returns:
+        _pa.Table_: _One row per paper and model in `PREDICTION_SCHEMA`, grouped by model._
+
+    >>> from sklearn.linear_model import LogisticRegression
+    >>> X = np.array([[0.0, 1.0], [1.0, 0.0], [0.9, 0.2]], dtype = 'float32')
+    >>> model = LogisticRegression(C = 100).fit(X, [0, 1, 1])
+    >>> result = score_embeddings(X, ['a', 'b', 'c'], {'lr': model})
+    >>> result.column('prediction').to_pylist(), result.num_rows
+    ([0, 1, 1], 3)
+    """
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be a positive integer.")
+    dois = np.asarray(dois, dtype = object)
+    if embeddings.shape[0] != len(dois):
+        raise ValueError("embeddings and dois must have the same number of rows.")
+    loaded = _load_models(models)
+    n_rows = len(dois)
+    predict_proba = np.empty((len(loaded), n_rows), dtype = np.float32)
+    for start in range(0, n_rows, chunk_size):
+        chunk = ModelDataset(embeddings[start:start + chunk_size], dois[start:start + chunk_size])
+        frame = None
+        for i, (_, model_object) in enumerate(loaded):
+            if hasattr(model_object, 'feature_names_in_'):
+                # Build the DataFrame layout once per chunk for all models trained on DataFrames.
+                frame = model_input(model_object, chunk) if frame is None else frame
+                features = frame
+            else:
+                features = model_input(model_object, chunk)
+            predict_proba[i, start:start + chunk_size] = model_object.predict_proba(features)[:, 1]
+
+    return prediction_table(np.tile(dois, len(loaded)),
+                            predict_proba.ravel(),
+                            (predict_proba >= predictThld).ravel(),
+                            np.repeat(np.array([i[0] for i in loaded], dtype = object), n_rows))
@@ -0,0 +1,23 @@
+def chunked(items, size: int = 100):
+    """_Split a sequence into consecutive chunks of at most `size` elements._
+
+    Args:
+        items (_list_): _The sequence to split._
+        size (_int_): _The maximum chunk size._
+
+    Returns:
+        _list_: _A list of lists._
+
+    >>> chunked([1, 2, 3, 4, 5], 2)
+    [[1, 2], [3, 4], [5]]
+    >>> chunked([], 2)
+    []
+    """
+    if size < 1:
+        raise ValueError("The chunk size must be a positive integer.")
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
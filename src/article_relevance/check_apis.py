@@ -1,16 +1,15 @@
 from io import BytesIO
 import pandas as pd
 from .clean_dois import clean_dois
-import requests
+from .batching import chunked
+from .api_client import get_client
 from requests.exceptions import ReadTimeout
-import os
 import json
 
 def project_exists(project):
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/projects',
-                            params = {'project': project},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/projects',
+                                   params = {'project': project})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -26,9 +25,8 @@ def project_exists(project):
 
 def label_exists(label, project):
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/labels',
-                            params = {'label': label, 'project': project},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/labels',
+                                   params = {'label': label, 'project': project})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -44,9 +42,8 @@ def label_exists(label, project):
 
 def paper_label_exists(doi, label, project, person):
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/doi/labels',
-                            params = {'doi': doi, 'label': label, 'project': project, 'orcid': person},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/doi/labels',
+                                   params = {'doi': doi, 'label': label, 'project': project, 'orcid': person})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -62,9 +59,8 @@ def paper_label_exists(doi, label, project, person):
 
 def embedding_exists(doi:str, model:str):
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/doi/embeddings',
-                            params = {'doi': doi, 'model': model},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/doi/embeddings',
+                                   params = {'doi': doi, 'model': model})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -80,9 +76,8 @@ def embedding_exists(doi:str, model:str):
 
 def person_exists(orcid):
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/people',
-                            params = {'orcid': orcid},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/people',
+                                   params = {'orcid': orcid})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -96,3 +91,31 @@ def person_exists(orcid):
         print(f'General exception for ORCID {orcid}:')
         print(e)
 
+def embeddings_exist(dois:list, model:str, batch_size:int = 100):
+    """_Check for existing embeddings for many DOIs, using one request per batch._
+
+    Args:
+        dois (_list_): _A list of DOIs._
+        model (_str_): _The embedding model name._
+        batch_size (_int_): _The number of DOIs sent in each request._
+
+    Returns:
+        _dict_: _A dict keyed by DOI, with the embedding record for the DOI, or `None` if no embedding exists
+                 (or the batch could not be checked)._
+    """
+    found = {i: None for i in dois}
+    for batch in chunked(found.keys(), batch_size):
+        try:
+            outcome = get_client().get('/v0.1/doi/embeddings',
+                                       params = {'doi': batch, 'model': model})
+            if outcome.status_code == 200:
+                for i in json.loads(outcome.content).get('data') or []:
+                    if i.get('doi') in found:
+                        found[i.get('doi')] = i
+        except ReadTimeout as e:
+            print(f'Connection failed for a batch of {len(batch)} DOIs:')
+            print(e)
+        except Exception as e:
+            print(f'General exception for a batch of {len(batch)} DOIs:')
+            print(e)
+    return found
@@ -0,0 +1,83 @@
+"""_A local, on-disk cache of CrossRef responses._
+
+Responses are stored as zlib-compressed JSON in a sqlite database keyed by the
+normalized, lower-cased DOI (DOIs are case-insensitive). DOIs that CrossRef
+does not know (404) are cached as negative entries with a shorter lifetime.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import unicodedata
+
+
+class CrossRefCache:
+    """_A thread-safe sqlite cache of CrossRef responses._
+
+    Args:
+        path (_str_): _The sqlite database file. Parent directories are created if needed._
+        ttl (_float_): _Seconds before a cached record is considered stale._
+        negative_ttl (_float_): _Seconds before a cached 404 (DOI not found) is considered stale._
+
+    >>> cache = CrossRefCache(':memory:')
+    >>> cache.put('10.1000/ABC', {'status': 'ok', 'message': {'DOI': '10.1000/abc'}})
+    >>> cache.get('10.1000/abc ')
+    {'status': 'ok', 'message': {'DOI': '10.1000/abc'}}
+    >>> cache.get('10.1000/missing') is None
+    True
+    """
+    def __init__(self,
+                 path: str = 'data/cache/crossref.sqlite',
+                 ttl: float = 90 * 86400,
+                 negative_ttl: float = 7 * 86400):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS crossref (
+                                  doi TEXT PRIMARY KEY,
+                                  status INTEGER NOT NULL,
+                                  fetched_at REAL NOT NULL,
+                                  body BLOB NOT NULL)""")
+
+    @staticmethod
+    def key(doi: str):
+        """_The cache key for a DOI._"""
+        return unicodedata.normalize('NFKD', doi).strip().lower()
+
+    def get(self, doi: str):
+        """_Return the cached response for a DOI, or `None` if it is not cached or has expired._"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, fetched_at, body FROM crossref WHERE doi = ?",
+                                     (self.key(doi),)).fetchone()
+        if row is None:
+            return None
+        status, fetched_at, body = row
+        ttl = self.negative_ttl if status == 404 else self.ttl
+        if time.time() - fetched_at > ttl:
+            return None
+        return json.loads(zlib.decompress(body))
+
+    def put(self, doi: str, response_json: dict, status: int = 200):
+        """_Store a CrossRef response. Use `status = 404` for DOIs CrossRef does not know._"""
+        body = zlib.compress(json.dumps(response_json).encode('utf-8'))
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO crossref (doi, status, fetched_at, body) VALUES (?, ?, ?, ?)",
+                               (self.key(doi), status, time.time(), body))
+
+    def __contains__(self, doi):
+        return self.get(doi) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM crossref").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,39 +1,118 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from .enHelper import enHelper
-from transformers import AutoTokenizer
+from .language_id import LanguageCache, detect_languages
 from bs4 import BeautifulSoup
 import lxml
 from .api_calls import get_pub_for_embedding
+from .batching import chunked
+from .model_registry import get_tokenizer
 
 
 #logger = get_logger(__name__)
 
-def data_preprocessing(model_name: str = 'allenai/specter2_base'):
+def _needs_language(language, text: str, sep_token: str):
+    # Impute language only when there are > 5 characters for langdetect to impute accurately
+    return language is None and text != sep_token * 2 and len(text) > 5
+
+def clean_record(record: dict, sep_token: str = '[SEP]', impute_language: bool = True):
+    """_Build the text for one publication record: join, strip HTML and impute the language._
+
+    Args:
+        record (_dict_): _A record from `get_pub_for_embedding()` with `doi`, `title`, `subtitle`, `abstract` and `language`._
+        sep_token (_str_): _The tokenizer's separator token._
+        impute_language (_bool_): _Detect the language of records that have none._
+
+    Returns:
+        _dict_: _A dict with the keys `doi`, `text` and `language`._
+
+    >>> clean_record({'doi': '10.1/a', 'title': 'Pollen', 'abstract': '<jats:p>Lake &amp; bog cores</jats:p>', 'language': 'en'})
+    {'doi': '10.1/a', 'text': 'pollen[SEP][SEP]lake & bog cores', 'language': 'en'}
+    """
+    text = ((record.get('title') or '').lower() + sep_token +
+            (record.get('subtitle') or '').lower() + sep_token +
+            (record.get('abstract') or '').lower())
+    # Only markup or entities need the HTML parser.
+    if '<' in text or '&' in text:
+        text = BeautifulSoup(text, "lxml").text
+    language = record.get('language')
+    if impute_language and _needs_language(language, text, sep_token):
+        language = enHelper(text)
+    return {'doi': record.get('doi'),
+            'text': text,
+            'language': language}
+
+def _clean_chunk(records: list, sep_token: str, language_cache: str = None):
+    cleaned = [clean_record(i, sep_token, impute_language = False) for i in records]
+    missing = [i for i in cleaned if _needs_language(i.get('language'), i.get('text'), sep_token)]
+    if len(missing) > 0:
+        cache = LanguageCache(language_cache) if language_cache is not None else None
+        for record, language in zip(missing, detect_languages([i.get('text') for i in missing], cache = cache)):
+            record['language'] = language
+        if cache is not None:
+            cache.close()
+    return cleaned
+
+def iter_preprocessed(metadata: list, sep_token: str = '[SEP]', processes: int = 1, chunk_size: int = 256,
+                      language_cache: str = None):
+    """
+    Clean publication records in chunks across a process pool, yielding each chunk in order as it is ready.
+    Args:
+        metadata (list): Records from `get_pub_for_embedding()`.
+        sep_token (str): The tokenizer's separator token.
+        processes (int): The number of worker processes. The default, 1, cleans in this process; None uses
+            one worker per CPU. Workers are spawned, so a calling script must guard its entry point with
+            `if __name__ == '__main__':`, and each worker re-imports the package.
+        chunk_size (int): The number of records sent to a worker at once.
+        language_cache (str): The path of a `LanguageCache` used when imputing languages, or None for no cache.
+    Yields:
+        list: Lists of dictionaries with the keys `doi`, `text` and `language`.
+    """
+    chunks = chunked(metadata or [], chunk_size)
+    processes = min(processes or os.cpu_count() or 1, len(chunks))
+    if processes <= 1:
+        for chunk in chunks:
+            yield _clean_chunk(chunk, sep_token, language_cache)
+        return
+    # Spawn rather than fork, which is unsafe once the caller has started threads or loaded torch.
+    with ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn')) as executor:
+        # Keep a bounded window of chunks in flight, so results stream out without queueing everything.
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_clean_chunk, chunk, sep_token, language_cache))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def data_preprocessing(model_name: str = 'allenai/specter2_base',
+                       processes: int = 1,
+                       chunk_size: int = 256,
+                       metadata: list = None,
+                       language_cache: str = 'data/cache/languages.sqlite'):
     """
     Clean up title, subtitle, abstract, subject.
     Feature engineer for descriptive text column.
     Impute language.
     The outputted dataframe is ready to be used in model prediction.
     Args:
-        valid_data (pd DataFrame): Input data frame.
+        model_name (str): The embedding model; its tokenizer provides the separator token.
+        processes (int): The number of worker processes used to clean text. The default, 1, cleans in this
+            process. More than one spawns a process pool, so the calling script must guard its entry point
+            with `if __name__ == '__main__':`; None uses one worker per CPU.
+        chunk_size (int): The number of records sent to a worker at once.
+        metadata (list): Records to clean. By default the records still needing embeddings are fetched with `get_pub_for_embedding()`.
+        language_cache (str): The path of the persistent language cache, so texts seen before are not re-detected. None disables it.
     Returns:
-        list: A list of dictionaries with the keys `doi`, `text` and `language`. 
+        list: A list of dictionaries with the keys `doi`, `text` and `language`.
     """
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    metadata = get_pub_for_embedding(model = model_name)
-    # Join arrays:
-    text_batch = [{'doi': d.get('doi'),
-                   'text': (d.get('title') or '').lower() + tokenizer.sep_token +
-                  (d.get('subtitle') or '').lower() + tokenizer.sep_token +
-                  (d.get('abstract') or '').lower(),
-                  'language': d.get('language')} for d in metadata]
-    # Remove HTML tags from abstract
-    clean_text = [{'doi': i.get('doi'), 
-                   'text': BeautifulSoup(i.get('text'), "lxml").text,
-                   'language': i.get('language')} for i in text_batch]
-    
-    # Impute language only when there are > 5 characters for langdetect to impute accurately
-    for i in clean_text:
-        if (i.get('language') is None) & (i.get('text') != '[SEP][SEP]') & (len(str(i.get('text') or ''))) > 5:
-            i['language'] = enHelper(i.get('text'))
-
+    tokenizer = get_tokenizer(model_name)
+    if metadata is None:
+        metadata = get_pub_for_embedding(model = model_name)
+    clean_text = []
+    for chunk in iter_preprocessed(metadata, tokenizer.sep_token, processes = processes, chunk_size = chunk_size,
+                                   language_cache = language_cache):
+        clean_text.extend(chunk)
     return clean_text
@@ -0,0 +1,85 @@
+"""_Compact binary transport for embedding vectors._
+
+Embeddings are sent to and from the API as base64 encoded, little-endian
+float32 (or float16) buffers instead of JSON lists of floats. A 768 value
+float32 vector is 4 KB of base64 rather than ~15 KB of JSON text, and decoding
+uses `np.frombuffer` without creating a Python float per value.
+"""
+import base64
+import json
+import numpy as np
+
+ENCODINGS = {'float32': '<f4', 'float16': '<f2'}
+
+
+def encode_embedding(vector, encoding: str = 'float32'):
+    """_Encode a vector as a base64 string of little-endian floats._
+
+    Args:
+        vector (_array-like_): _A one-dimensional embedding vector._
+        encoding (_str_): _Either `float32` or `float16`._
+
+    Returns:
+        _str_: _The base64 encoded buffer._
+
+    >>> encode_embedding([1.0, -2.5])
+    'AACAPwAAIMA='
+    >>> encode_embedding([1.0, -2.5], encoding = 'float16')
+    'ADwAwQ=='
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"encoding must be one of {list(ENCODINGS.keys())}.")
+    return base64.b64encode(np.asarray(vector, dtype = ENCODINGS[encoding]).tobytes()).decode('ascii')
+
+
+def decode_embedding(value, encoding: str = 'float32'):
+    """_Decode a single embedding into a float32 array._
+
+    Accepts a base64 buffer from `encode_embedding()`, a JSON list as a string (the
+    original transport), or a list of numbers.
+
+    >>> decode_embedding('AACAPwAAIMA=').tolist()
+    [1.0, -2.5]
+    >>> decode_embedding('[1.0, -2.5]').tolist()
+    [1.0, -2.5]
+    """
+    if isinstance(value, str):
+        if value.lstrip().startswith('['):
+            return np.asarray(json.loads(value), dtype = np.float32)
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {list(ENCODINGS.keys())}.")
+        return np.frombuffer(base64.b64decode(value), dtype = ENCODINGS[encoding]).astype(np.float32, copy = False)
+    return np.asarray(value, dtype = np.float32)
+
+
+def decode_embeddings(values: list, encoding: str = 'float32', dim: int = None, out = None):
+    """_Decode many embeddings straight into one preallocated (n, dim) float32 matrix._
+
+    Args:
+        values (_list_): _Encoded embeddings, as accepted by `decode_embedding()`._
+        encoding (_str_): _Either `float32` or `float16`._
+        dim (_int_): _The embedding length. Inferred from the first value if not given._
+        out (_np.ndarray_): _An optional float32 array of shape (len(values), dim) to write into._
+
+    Returns:
+        _np.ndarray_: _A float32 matrix with one row per value._
+
+    >>> decode_embeddings(['AACAPwAAIMA=', '[0.5, 0.25]']).tolist()
+    [[1.0, -2.5], [0.5, 0.25]]
+    """
+    if out is None:
+        if dim is None:
+            dim = len(decode_embedding(values[0], encoding)) if len(values) > 0 else 0
+        out = np.empty((len(values), dim), dtype = np.float32)
+    for i, value in enumerate(values):
+        out[i] = decode_embedding(value, encoding)
+    return out
+
+
+def embedding_to_wire(embedding_dict: dict, encoding: str = 'float32'):
+    """_Return a copy of an embedding dict with its `embeddings` encoded for the API._"""
+    if isinstance(embedding_dict.get('embeddings'), str):
+        return embedding_dict
+    return dict(embedding_dict,
+                embeddings = encode_embedding(embedding_dict.get('embeddings'), encoding),
+                encoding = encoding)
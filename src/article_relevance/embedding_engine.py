@@ -0,0 +1,103 @@
+"""_Batched embedding of article text._
+
+Texts are tokenized once without padding, sorted by token length and grouped
+into batches so that each batch is only padded to its longest member. Short,
+title-only records no longer pay for a full 512 token forward pass.
+"""
+import numpy as np
+import torch
+
+
+def length_batches(lengths, batch_size: int = 32):
+    """_Group record indices into batches of similar token length._
+
+    Args:
+        lengths (_list_): _The token length of each record._
+        batch_size (_int_): _The maximum number of records in a batch._
+
+    Returns:
+        _list_: _A list of integer index arrays, shortest records first._
+
+    >>> [i.tolist() for i in length_batches([5, 1, 3, 2], batch_size = 2)]
+    [[1, 3], [2, 0]]
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer.")
+    order = np.argsort(np.asarray(lengths), kind='stable')
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def embed_batch(features: dict, tokenizer, model):
+    """_Pad one batch of tokenized texts to its longest member and return the `[CLS]` embeddings as float32._"""
+    features = tokenizer.pad(features,
+                             padding='longest',
+                             return_tensors='pt')
+    features = {key: value.to(model.device) for key, value in features.items()}
+    with torch.inference_mode():
+        output = model(**features)
+    return output.last_hidden_state[:, 0, :].float().cpu().numpy()
+
+
+def embed_texts(texts: list,
+                tokenizer,
+                model,
+                batch_size: int = 32,
+                max_length: int = 512):
+    """_Embed a list of texts using the `[CLS]` token of the final hidden layer._
+
+    Args:
+        texts (_list_): _A list of strings to embed._
+        tokenizer (_PreTrainedTokenizer_): _The tokenizer associated with `model`._
+        model (_PreTrainedModel_): _A loaded transformer model (e.g., SPECTER2 with an adapter)._
+        batch_size (_int_): _The number of texts passed through the model at once._
+        max_length (_int_): _The maximum token length, longer texts are truncated._
+
+    Returns:
+        _np.ndarray_: _A float32 array of shape (n, hidden_size), in the order of `texts`._
+    """
+    embeddings = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+    if len(texts) == 0:
+        return embeddings
+    encoded = tokenizer(list(texts),
+                        truncation=True,
+                        max_length=max_length,
+                        return_token_type_ids=False)
+    lengths = [len(i) for i in encoded['input_ids']]
+    for batch in length_batches(lengths, batch_size):
+        embeddings[batch] = embed_batch({key: [encoded[key][j] for j in batch] for key in encoded.keys()},
+                                        tokenizer, model)
+    return embeddings
+
+
+def embed_articles(article_metadata: list,
+                   text_col: str,
+                   tokenizer,
+                   model,
+                   batch_size: int = 32,
+                   max_length: int = 512,
+                   pool = None):
+    """_Embed the `text_col` field of a list of article records._
+
+    Args:
+        article_metadata (_list[dict]_): _Article records, each with a `doi` key and a `text_col` key._
+        text_col (_str_): _The key holding the text to embed._
+        tokenizer (_PreTrainedTokenizer_): _The tokenizer associated with `model`._
+        model (_PreTrainedModel_): _A loaded transformer model._
+        batch_size (_int_): _The number of records passed through the model at once._
+        max_length (_int_): _The maximum token length, longer texts are truncated._
+        pool (_EmbeddingWorkerPool_): _Worker processes to embed with instead of `model`._
+
+    Returns:
+        _tuple_: _A float32 array of shape (n, hidden_size) and the list of DOIs for each row._
+    """
+    dois = [i.get('doi') for i in article_metadata]
+    if pool is not None:
+        return pool.embed_texts([i.get(text_col) for i in article_metadata],
+                                batch_size = batch_size,
+                                max_length = max_length), dois
+    embeddings = embed_texts([i.get(text_col) for i in article_metadata],
+                             tokenizer = tokenizer,
+                             model = model,
+                             batch_size = batch_size,
+                             max_length = max_length)
+    return embeddings, dois
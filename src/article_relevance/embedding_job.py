@@ -0,0 +1,245 @@
+"""_Resumable, checkpointed embedding jobs._
+
+A job directory holds:
+
+    job.json          the embedding model and adapter the job was started with
+    journal.jsonl     an append-only log of completed work
+    shards/           `shard-00000.npz` ... each with the embeddings and DOIs of one batch
+
+Each batch of records is embedded, written to a new shard (to a temporary file
+that is then atomically renamed), and only then recorded in the journal with
+its DOIs. Registration with the database is journalled separately, with the
+DOIs the database accepted. A job that is restarted after a crash reads the
+journal, re-registers the DOIs of any shard that were written but not
+accepted, and embeds only the DOIs that are not yet in a shard.
+
+The journal is read once when the job is opened; after that its state is kept
+in memory and updated as entries are appended.
+"""
+import json
+import os
+from datetime import datetime
+import numpy as np
+from .check_apis import embeddings_exist
+from .register_apis import register_embeddings_bulk
+from .embedding_engine import embed_articles
+from .batching import chunked
+
+
+class EmbeddingJob:
+    """_A checkpointed embedding job backed by a local directory._
+
+    Args:
+        path (_str_): _The job directory. Created if needed; an existing job is resumed._
+        model_name (_str_): _Model name on hugging face model hub._
+        adapter_name (_str_): _Adapter name on hugging face model hub._
+
+    >>> import tempfile
+    >>> job = EmbeddingJob(tempfile.mkdtemp(), model_name = 'test/model', adapter_name = 'test/adapter')
+    >>> shard = job.write_shard(['10.1/a', '10.1/b'], np.ones((2, 3)))
+    >>> sorted(job.completed()), job.unregistered() == [shard]
+    (['10.1/a', '10.1/b'], True)
+    >>> job._log({'event': 'registered', 'shard': shard, 'dois': ['10.1/a']})
+    >>> job.unregistered() == [shard], job.pending(shard)
+    (True, ['10.1/b'])
+    """
+    def __init__(self, path: str, model_name: str = 'allenai/specter2_base',
+                 adapter_name: str = 'allenai/specter2_classification'):
+        self.path = path
+        self.model_name = model_name
+        self.adapter_name = adapter_name
+        self.shard_dir = os.path.join(path, 'shards')
+        self.journal_file = os.path.join(path, 'journal.jsonl')
+        os.makedirs(self.shard_dir, exist_ok = True)
+        job_file = os.path.join(path, 'job.json')
+        settings = {'model_name': model_name, 'adapter_name': adapter_name}
+        if os.path.exists(job_file):
+            with open(job_file, 'r', encoding = 'UTF-8') as f:
+                stored = json.load(f)
+            if {i: stored.get(i) for i in settings} != settings:
+                raise ValueError(f"The job in {path} was started with {stored.get('model_name')}/{stored.get('adapter_name')}, not {model_name}/{adapter_name}.")
+        else:
+            self._write_atomic(job_file, json.dumps(dict(settings, created = datetime.now().isoformat())).encode('utf-8'))
+        self._repair_journal()
+        self._shards = {}
+        self._registered = {}
+        self._completed = set()
+        for entry in self.journal():
+            self._apply(entry)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def _repair_journal(self):
+        # Drop a final line left incomplete by a crash, so new entries start on a line of their own.
+        if not os.path.exists(self.journal_file):
+            return None
+        with open(self.journal_file, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+        return None
+
+    def _apply(self, entry: dict):
+        # Update the in-memory state with one journal entry.
+        if entry.get('event') == 'shard':
+            self._shards[entry['shard']] = entry['dois']
+            self._completed.update(entry['dois'])
+        elif entry.get('event') == 'registered':
+            # Entries written before accepted DOIs were journalled cover the whole shard.
+            dois = entry.get('dois', self._shards.get(entry['shard'], []))
+            self._registered.setdefault(entry['shard'], set()).update(dois)
+
+    def _log(self, event: dict):
+        with open(self.journal_file, 'a', encoding = 'UTF-8') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(event)
+
+    def journal(self):
+        """_The journal entries, in the order they were written, read from the file._"""
+        if not os.path.exists(self.journal_file):
+            return []
+        entries = []
+        with open(self.journal_file, 'r', encoding = 'UTF-8') as f:
+            for line in f:
+                entries.append(json.loads(line))
+        return entries
+
+    def shards(self):
+        """_A dict of each journalled shard file name to its DOIs, in the order written._"""
+        return dict(self._shards)
+
+    def completed(self):
+        """_The set of DOIs that have been embedded and written to a shard._"""
+        return set(self._completed)
+
+    def pending(self, shard: str):
+        """_The DOIs of a shard that the database has not accepted yet._"""
+        registered = self._registered.get(shard, set())
+        return [i for i in self._shards[shard] if i not in registered]
+
+    def unregistered(self):
+        """_Shards with DOIs that were written but not yet accepted by the database._"""
+        return [i for i in self._shards if len(self.pending(i)) > 0]
+
+    def write_shard(self, dois: list, embeddings):
+        """_Atomically write a shard and record it in the journal. Returns the shard file name._"""
+        shard = f'shard-{len(self._shards):05d}.npz'
+        tmp_file = os.path.join(self.shard_dir, shard + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, embeddings = np.asarray(embeddings, dtype = np.float32), dois = np.array(dois, dtype = str))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, os.path.join(self.shard_dir, shard))
+        self._log({'event': 'shard', 'shard': shard, 'dois': list(dois), 'written_at': datetime.now().isoformat()})
+        return shard
+
+    def read_shard(self, shard: str):
+        """_The (embeddings, dois) stored in a shard._"""
+        with np.load(os.path.join(self.shard_dir, shard), allow_pickle = False) as stored:
+            return stored['embeddings'], stored['dois'].tolist()
+
+    def register_shard(self, shard: str, api_batch_size: int = 100, encoding: str = 'float32'):
+        """_Register the shard's pending DOIs and journal those the database accepted.
+
+        DOIs that failed stay pending, so the next run retries them. Returns the number of
+        (accepted, failed) embeddings._
+        """
+        pending = set(self.pending(shard))
+        embeddings, dois = self.read_shard(shard)
+        results = register_embeddings_bulk([{'embeddings': vector, 'doi': doi, 'date': datetime.now(), 'model': self.model_name}
+                                            for doi, vector in zip(dois, embeddings) if doi in pending],
+                                           batch_size = api_batch_size, encoding = encoding)
+        accepted = [i['doi'] for i in results if i['status'] != 'failed']
+        if len(accepted) > 0:
+            self._log({'event': 'registered', 'shard': shard, 'dois': accepted})
+        return len(accepted), len(results) - len(accepted)
+
+    def run(self,
+            article_metadata: list,
+            text_col: str,
+            tokenizer,
+            model,
+            check: bool = True,
+            register: bool = True,
+            batch_size: int = 32,
+            shard_size: int = 1024,
+            api_batch_size: int = 100,
+            encoding: str = 'float32',
+            store = None,
+            index = None,
+            pool = None,
+            return_embeddings: bool = False):
+        """_Embed `article_metadata`, resuming from the journal.
+
+        Args:
+            shard_size (_int_): _The number of records embedded and checkpointed together._
+            return_embeddings (_bool_): _Return every embedding, read back from the shards, rather than counts._
+            Other arguments are as for `add_embeddings()`.
+
+        Returns:
+            _dict_: _Counts of the records `resumed` (embedded by an earlier run), `present` (already in the
+                database), `embedded`, `registered` and `failed` (not accepted by the database; retried by the
+                next run). With `return_embeddings`, a list of entries in the form of `add_embeddings()` instead._
+        """
+        counts = {'resumed': 0, 'present': 0, 'embedded': 0, 'registered': 0, 'failed': 0}
+
+        def send(shard):
+            accepted, failed = self.register_shard(shard, api_batch_size = api_batch_size, encoding = encoding)
+            counts['registered'] += accepted
+            counts['failed'] += failed
+
+        if register:
+            # Finish registering shards left over from an interrupted run.
+            for shard in self.unregistered():
+                send(shard)
+        completed = self._completed
+        remaining = [i for i in article_metadata if i.get('doi') not in completed]
+        counts['resumed'] = len(article_metadata) - len(remaining)
+        print(f'{len(article_metadata) - len(remaining)} of {len(article_metadata)} objects were embedded by an earlier run.')
+        existing = {}
+        if check and len(remaining) > 0:
+            existing = embeddings_exist([i.get('doi') for i in remaining], model = self.model_name, batch_size = api_batch_size)
+        to_embed = [i for i in remaining if existing.get(i.get('doi')) is None]
+        counts['present'] = len(remaining) - len(to_embed)
+
+        for batch in chunked(to_embed, shard_size):
+            embeddings, dois = embed_articles(batch, text_col = text_col, tokenizer = tokenizer,
+                                              model = model, batch_size = batch_size, pool = pool)
+            shard = self.write_shard(dois, embeddings)
+            if store is not None:
+                store.add(dois, embeddings)
+            if index is not None:
+                index.add(dois, embeddings)
+            counts['embedded'] += len(dois)
+            if register:
+                send(shard)
+
+        if not return_embeddings:
+            return counts
+        wanted = set(i.get('doi') for i in article_metadata)
+        vectors = {}
+        for shard, dois in self._shards.items():
+            if wanted.isdisjoint(dois):
+                continue
+            embeddings, dois = self.read_shard(shard)
+            vectors.update((i, j) for i, j in zip(dois, embeddings) if i in wanted)
+        embedding_object = []
+        for i in article_metadata:
+            doi = i.get('doi')
+            if existing.get(doi) is not None:
+                embedding_object.append(existing.get(doi))
+            else:
+                embedding_object.append({'embeddings': vectors.get(doi),
+                                         'doi': doi,
+                                         'date': datetime.now(),
+                                         'model': self.model_name})
+        return embedding_object
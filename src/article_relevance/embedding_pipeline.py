@@ -0,0 +1,227 @@
+"""_A pipelined runner that overlaps fetching, cleaning, embedding and registering papers._
+
+Each stage runs in its own thread(s) and hands chunks of records to the next
+stage through a bounded queue:
+
+    fetch & check --> clean --> embed --> register
+
+so API calls and text cleaning overlap with model inference. Past the source,
+the memory in use is bounded by the queue sizes rather than by the size of the
+corpus; the source holds whatever its input holds (see `run_embedding_pipeline`).
+Text cleaning can run in worker processes, and the embedding stage runs in the
+calling thread.
+"""
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from .api_calls import get_pub_for_embedding
+from .batching import chunked
+from .check_apis import embeddings_exist
+from .data_preprocessing import _clean_chunk
+from .embedding_engine import embed_articles
+from .model_registry import get_embedding_model
+from .register_apis import register_embeddings_bulk
+
+_DONE = object()
+
+
+class _Pipeline:
+    """_Shared stop flag and error list for the stages of one run._"""
+    def __init__(self):
+        self.stop = threading.Event()
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def put(self, outbox: queue.Queue, item):
+        """_Put an item on a queue, giving up if the pipeline is stopped. Returns False if it gave up._"""
+        while not self.stop.is_set():
+            try:
+                outbox.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, inbox: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return inbox.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(self, stage: str, error: Exception):
+        with self.lock:
+            self.errors.append((stage, error))
+        self.stop.set()
+
+    def source(self, name: str, items, outbox: queue.Queue):
+        """_Start a thread that feeds `items` into `outbox`, followed by an end marker._"""
+        def run():
+            try:
+                for item in items:
+                    if not self.put(outbox, item):
+                        return
+                self.put(outbox, _DONE)
+            except Exception as e:
+                self.fail(name, e)
+        thread = threading.Thread(target = run, name = name, daemon = True)
+        thread.start()
+        return [thread]
+
+    def stage(self, name: str, work, inbox: queue.Queue, outbox: queue.Queue = None, workers: int = 1):
+        """_Start `workers` threads that apply `work` to items from `inbox`, passing non-empty results to `outbox`._"""
+        remaining = [workers]
+
+        def run():
+            try:
+                while True:
+                    item = self.get(inbox)
+                    if item is _DONE:
+                        # Let sibling workers see the end marker too.
+                        self.put(inbox, _DONE)
+                        break
+                    result = work(item)
+                    if outbox is not None and result:
+                        if not self.put(outbox, result):
+                            return
+            except Exception as e:
+                self.fail(name, e)
+                return
+            with self.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                self.put(outbox, _DONE)
+
+        threads = [threading.Thread(target = run, name = f'{name}-{i}', daemon = True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+
+def run_embedding_pipeline(records = None,
+                           model_name: str = 'allenai/specter2_base',
+                           adapter_name: str = 'allenai/specter2_classification',
+                           check: bool = True,
+                           register: bool = True,
+                           chunk_size: int = 256,
+                           queue_size: int = 4,
+                           batch_size: int = 32,
+                           api_batch_size: int = 100,
+                           processes: int = 1,
+                           register_workers: int = 2,
+                           device: str = 'cpu',
+                           encoding: str = 'float32',
+                           language_cache: str = 'data/cache/languages.sqlite',
+                           store = None,
+                           index = None):
+    """_Fetch, clean, embed and register papers as a pipeline with bounded queues between stages._
+
+    Args:
+        records (_iterable_): _Publication records (as from `get_pub_for_embedding()`), or an iterable of lists
+            of records such as a paginated generator. By default the records still needing embeddings are fetched
+            with `get_pub_for_embedding()`; that endpoint is not paginated, so the full list is held in memory for
+            the run. Pass a generator of pages to keep memory bounded by the queues._
+        model_name (_str_): _Model name on hugging face model hub. Also used to index embeddings within the database._
+        adapter_name (_str_): _Adapter name on hugging face model hub._
+        check (_bool_): _Skip papers that already have an embedding for `model_name` in the database._
+        register (_bool_): _Add the new embeddings to the database._
+        chunk_size (_int_): _The number of records passed between stages at once._
+        queue_size (_int_): _The number of chunks each queue holds before the stage feeding it waits._
+        batch_size (_int_): _The number of articles passed through the model at once._
+        api_batch_size (_int_): _The number of DOIs sent in each request when checking for and registering embeddings._
+        processes (_int_): _Worker processes for text cleaning. 1 cleans in a thread of this process._
+        register_workers (_int_): _The number of threads registering embeddings._
+        device (_str_): _The torch device used for the model._
+        encoding (_str_): _Embeddings are sent to the database as base64 `float32` or `float16` buffers._
+        language_cache (_str_): _The path of the persistent language cache, or None to disable it._
+        store (_EmbeddingStore_): _An optional local embedding store that new embeddings are appended to._
+        index (_ArticleIndex_): _An optional nearest-neighbour index that new embeddings are added to._
+
+    Returns:
+        _dict_: _Counts of the records `fetched`, `present` (already embedded), `embedded`, `registered` and
+            `failed` (embeddings the database did not accept)._
+    """
+    tokenizer, model = get_embedding_model(model_name, adapter_name, device)
+    sep_token = tokenizer.sep_token
+    counts = {'fetched': 0, 'present': 0, 'embedded': 0, 'registered': 0, 'failed': 0}
+    pipeline = _Pipeline()
+
+    def source_chunks():
+        # Accept a flat list of records or any iterable of record lists.
+        if records is None:
+            pages = [get_pub_for_embedding(model = model_name) or []]
+        elif isinstance(records, list) and (len(records) == 0 or isinstance(records[0], dict)):
+            pages = [records]
+        else:
+            pages = records
+        for page in pages:
+            yield from chunked(page, chunk_size)
+
+    def fetch(chunk):
+        with pipeline.lock:
+            counts['fetched'] += len(chunk)
+        if not check:
+            return chunk
+        existing = embeddings_exist([i.get('doi') for i in chunk], model = model_name, batch_size = api_batch_size)
+        new = [i for i in chunk if existing.get(i.get('doi')) is None]
+        with pipeline.lock:
+            counts['present'] += len(chunk) - len(new)
+        return new
+
+    # Spawn rather than fork: this process already runs the stage threads and holds the model.
+    pool = (ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn'))
+            if processes > 1 else None)
+
+    def clean(chunk):
+        if pool is not None:
+            return pool.submit(_clean_chunk, chunk, sep_token, language_cache).result()
+        return _clean_chunk(chunk, sep_token, language_cache)
+
+    def send(embedding_dicts):
+        if register:
+            results = register_embeddings_bulk(embedding_dicts, batch_size = api_batch_size, encoding = encoding)
+            failed = sum(i['status'] == 'failed' for i in results)
+            with pipeline.lock:
+                counts['registered'] += len(results) - failed
+                counts['failed'] += failed
+
+    fetched, cleaned, embedded = (queue.Queue(maxsize = queue_size) for _ in range(3))
+    raw = queue.Queue(maxsize = queue_size)
+    threads = (pipeline.source('source', source_chunks(), raw) +
+               pipeline.stage('fetch', fetch, raw, fetched) +
+               pipeline.stage('clean', clean, fetched, cleaned, workers = max(processes, 1)) +
+               pipeline.stage('register', send, embedded, workers = register_workers))
+    try:
+        # Model inference runs here, in the calling thread.
+        while True:
+            chunk = pipeline.get(cleaned)
+            if chunk is _DONE:
+                break
+            embeddings, dois = embed_articles(chunk, text_col = 'text', tokenizer = tokenizer,
+                                              model = model, batch_size = batch_size)
+            if store is not None:
+                store.add(dois, embeddings)
+            if index is not None:
+                index.add(dois, embeddings)
+            counts['embedded'] += len(dois)
+            embedding_dicts = [{'embeddings': vector, 'doi': doi, 'date': datetime.now(), 'model': model_name}
+                               for doi, vector in zip(dois, embeddings)]
+            if not pipeline.put(embedded, embedding_dicts):
+                break
+        pipeline.put(embedded, _DONE)
+    except BaseException as e:
+        pipeline.fail('embed', e)
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        if pool is not None:
+            pool.shutdown()
+    if pipeline.errors:
+        stage, error = pipeline.errors[0]
+        raise RuntimeError(f"The embedding pipeline failed in the {stage} stage: {error}") from error
+    return counts
@@ -0,0 +1,252 @@
+"""_A local, append-only store of embeddings backed by a memory-mapped file._
+
+Each embedding model has its own directory holding a raw little-endian float32
+matrix (`embeddings.f32`) that rows are appended to, and `index.sqlite`, which
+maps each DOI to its row. Re-adding a DOI with the vector it already has only
+updates its labels, so repeated syncs and locally added embeddings do not grow
+the file. A DOI whose vector changed gets a new row; `compact()`, run at the end
+of `sync()` or called directly, rewrites the matrix without the superseded rows,
+so `dataset()` can return the memory-mapped file itself. Reads never rewrite the
+store. The index also keeps `embedding_hashes()` of each
+row, computed once when the row is appended, so incremental scoring does not
+re-hash the whole store on every run. Reads open the matrix with `np.memmap`, so a scoring
+process can use 100k embeddings without first reading them into memory.
+
+The store expects a single writing process at a time.
+"""
+import os
+import re
+import sqlite3
+import uuid
+from datetime import datetime
+import numpy as np
+from .batching import chunked
+from .model_dataset import ModelDataset, embedding_hashes
+from .get_model_data import iter_model_data
+from .embedding_codec import decode_embeddings
+
+
+def _latest(*timestamps):
+    """_The latest of some ISO 8601 timestamps, ignoring missing ones._
+
+    >>> _latest(None, '2024-09-22T10:00:00Z', '2024-09-21T23:00:00+00:00', '')
+    '2024-09-22T10:00:00Z'
+    """
+    return max((i for i in timestamps if i), key = lambda i: datetime.fromisoformat(i.replace('Z', '+00:00')),
+               default = None)
+
+
+class EmbeddingStore:
+    """_A local embedding store for one embedding model._
+
+    Args:
+        path (_str_): _The root directory for all stores._
+        model (_str_): _The embedding model name, e.g., `allenai/specter2_base`._
+        dim (_int_): _The embedding length._
+
+    >>> import tempfile
+    >>> store = EmbeddingStore(tempfile.mkdtemp(), model = 'test/model', dim = 2)
+    >>> store.add(['10.1/a', '10.1/b'], np.array([[1, 2], [3, 4]]))
+    >>> store.add(['10.1/a', '10.1/b'], np.array([[5, 6], [3, 4]]))
+    >>> len(store), store.matrix().shape[0], store.get(['10.1/b', '10.1/a', '10.1/c']).tolist()
+    (2, 3, [[3.0, 4.0], [5.0, 6.0], [nan, nan]])
+    >>> data = store.dataset()
+    >>> type(data.embeddings).__name__, data.embeddings.tolist(), data.dois.tolist()
+    ('ndarray', [[3.0, 4.0], [5.0, 6.0]], ['10.1/b', '10.1/a'])
+    >>> store.compact()
+    >>> type(store.dataset().embeddings).__name__, store.matrix().shape[0]
+    ('memmap', 2)
+    """
+    def __init__(self, path: str = 'data/embeddings', model: str = 'allenai/specter2_base', dim: int = 768):
+        self.model = model
+        self.dim = dim
+        self.directory = os.path.join(path, re.sub(r'[^A-Za-z0-9._-]', '_', model))
+        os.makedirs(self.directory, exist_ok = True)
+        self._conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'))
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows (doi TEXT PRIMARY KEY, row INTEGER NOT NULL, hash TEXT)")
+            if 'hash' not in [i[1] for i in self._conn.execute("PRAGMA table_info(rows)")]:
+                # Stores created before hashes were kept get them filled in by `dataset()`.
+                self._conn.execute("ALTER TABLE rows ADD COLUMN hash TEXT")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS labels (project TEXT NOT NULL, doi TEXT NOT NULL, label TEXT, PRIMARY KEY (project, doi))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if self._meta('hash') != 'blake2b':
+                # Hashes from an earlier hash function are recomputed by `dataset()`.
+                self._conn.execute("UPDATE rows SET hash = NULL")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('hash', 'blake2b')")
+            stored_dim = self._meta('dim')
+            if stored_dim is None:
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+            elif int(stored_dim) != dim:
+                raise ValueError(f"The store at {self.directory} holds {stored_dim} dimensional embeddings, not {dim}.")
+        self.matrix_file = os.path.join(self.directory, self._meta('matrix') or 'embeddings.f32')
+
+    def _meta(self, key: str):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _file_rows(self):
+        if not os.path.exists(self.matrix_file):
+            return 0
+        return os.path.getsize(self.matrix_file) // (4 * self.dim)
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def __contains__(self, doi):
+        return self._conn.execute("SELECT 1 FROM rows WHERE doi = ?", (doi,)).fetchone() is not None
+
+    def superseded(self):
+        """_The number of rows in the matrix file that no DOI points to._"""
+        return self._file_rows() - len(self)
+
+    def matrix(self):
+        """_The full, read-only memory-mapped matrix, including any rows that have been superseded._"""
+        n_rows = self._file_rows()
+        if n_rows == 0:
+            return np.empty((0, self.dim), dtype = np.float32)
+        return np.memmap(self.matrix_file, dtype = '<f4', mode = 'r', shape = (n_rows, self.dim))
+
+    def add(self, dois: list, embeddings, labels: list = None, project: str = None):
+        """_Append embeddings for `dois` (and optionally their labels for `project`).
+
+        DOIs that are already stored with the same vector (to within float16 precision, as
+        embeddings may be sent to the API as float16) are not appended again._
+        """
+        dois = list(dois)
+        embeddings = np.ascontiguousarray(embeddings, dtype = '<f4')
+        if embeddings.shape != (len(dois), self.dim):
+            raise ValueError(f"Expected embeddings of shape ({len(dois)}, {self.dim}), not {embeddings.shape}.")
+        if len(dois) == 0:
+            return None
+        current = self.rows(dois)
+        changed = current < 0
+        if not changed.all():
+            stored = ~changed
+            same = np.isclose(self.matrix()[current[stored]], embeddings[stored], rtol = 1e-3, atol = 1e-6).all(axis = 1)
+            changed[stored] = ~same
+        new_rows = np.flatnonzero(changed)
+        if len(new_rows) > 0:
+            first_row = self._file_rows()
+            with open(self.matrix_file, 'ab') as f:
+                # Truncate any partial row left by an interrupted write before appending.
+                f.truncate(first_row * 4 * self.dim)
+                f.write(embeddings[new_rows].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        with self._conn:
+            if len(new_rows) > 0:
+                self._conn.executemany("INSERT OR REPLACE INTO rows (doi, row, hash) VALUES (?, ?, ?)",
+                                       zip([dois[i] for i in new_rows], range(first_row, first_row + len(new_rows)),
+                                           embedding_hashes(embeddings[new_rows])))
+            if labels is not None:
+                self._conn.executemany("INSERT OR REPLACE INTO labels (project, doi, label) VALUES (?, ?, ?)",
+                                       [(project or '', i, j) for i, j in zip(dois, labels)])
+        return None
+
+    def rows(self, dois: list):
+        """_The matrix row for each DOI, or -1 where the DOI is not stored._"""
+        lookup = {}
+        for batch in chunked(sorted(set(dois)), 500):
+            query = f"SELECT doi, row FROM rows WHERE doi IN ({','.join('?' * len(batch))})"
+            lookup.update(self._conn.execute(query, batch))
+        return np.array([lookup.get(i, -1) for i in dois], dtype = np.int64)
+
+    def get(self, dois: list):
+        """_A float32 copy of the embeddings for `dois`, with NaN rows for DOIs that are not stored._"""
+        rows = self.rows(dois)
+        result = np.full((len(dois), self.dim), np.nan, dtype = np.float32)
+        found = rows >= 0
+        if found.any():
+            result[found] = self.matrix()[rows[found]]
+        return result
+
+    def compact(self, chunk_rows: int = 65536):
+        """_Rewrite the matrix without superseded rows, keeping the remaining rows in order.
+
+        The rows are copied to a new file, and the index and file name are switched in a single
+        sqlite transaction, so a crash part way through leaves the store as it was._
+        """
+        records = self._conn.execute("SELECT doi, row FROM rows ORDER BY row").fetchall()
+        rows = np.array([i[1] for i in records], dtype = np.int64)
+        name = f'embeddings-{uuid.uuid4().hex}.f32'
+        new_file = os.path.join(self.directory, name)
+        matrix = self.matrix()
+        with open(new_file, 'wb') as f:
+            for start in range(0, len(rows), chunk_rows):
+                f.write(np.ascontiguousarray(matrix[rows[start:start + chunk_rows]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del matrix
+        with self._conn:
+            self._conn.executemany("UPDATE rows SET row = ? WHERE doi = ?", ((i, j[0]) for i, j in enumerate(records)))
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('matrix', ?)", (name,))
+        self.matrix_file = new_file
+        # Remove the old matrix and any left by an interrupted compaction.
+        for i in os.listdir(self.directory):
+            if i.startswith('embeddings') and i.endswith('.f32') and i != name:
+                os.remove(os.path.join(self.directory, i))
+        return None
+
+    def dataset(self, project: str = None):
+        """_All stored embeddings as a `ModelDataset`._
+
+        When the store is compacted the embeddings are the memory-mapped file itself (no
+        copy). Otherwise the current rows are copied out of it; the store is never rewritten
+        by a read, so call `compact()` (or `sync()`) to drop superseded rows.
+
+        Args:
+            project (_str_): _Attach labels stored for this project (unlabelled rows get `None`)._
+        """
+        records = self._conn.execute("""SELECT rows.doi, labels.label, rows.hash, rows.row FROM rows
+                                        LEFT JOIN labels ON labels.doi = rows.doi AND labels.project = ?
+                                        ORDER BY rows.row""", (project or '',)).fetchall()
+        matrix = self.matrix()
+        if self.superseded() != 0:
+            matrix = np.asarray(matrix[np.array([i[3] for i in records], dtype = np.int64)])
+        hashes = np.array([i[2] for i in records], dtype = object)
+        missing = np.flatnonzero(hashes == None)  # noqa: E711
+        if len(missing) > 0:
+            hashes[missing] = embedding_hashes(matrix[missing])
+            with self._conn:
+                self._conn.executemany("UPDATE rows SET hash = ? WHERE doi = ?",
+                                       zip(hashes[missing], [records[i][0] for i in missing]))
+        return ModelDataset(matrix, [i[0] for i in records], [i[1] for i in records], hashes = hashes)
+
+    def sync(self, project: str = None, page_size: int = 1000, encoding: str = 'float32'):
+        """_Pull embeddings added to the API since the last sync into the store, then compact it._
+
+        Rows the store already holds with the same vector (e.g., added locally by `add_embeddings()`,
+        or pulled for another project) only update their labels. The next sync starts from the
+        latest `modified` timestamp the API returned, so the local clock is never compared with
+        the server's. Rows without a `modified` timestamp leave the watermark where it was, and
+        are pulled again (without growing the store) by the next sync.
+
+        Args:
+            project (_str_): _The project whose labels are pulled, or `None` for all embedded papers._
+            page_size (_int_): _The number of rows requested per page._
+            encoding (_str_): _Embeddings are requested as base64 `float32` or `float16` buffers._
+
+        Returns:
+            _int_: _The number of rows pulled._
+        """
+        key = f'last_sync:{project}'
+        since = self._meta(key)
+        watermark = since
+        pulled = 0
+        for page in iter_model_data(self.model, project = project, page_size = page_size, encoding = encoding,
+                                    since = since):
+            embeddings = decode_embeddings([i['embeddings'] for i in page], encoding = encoding, dim = self.dim)
+            self.add([i.get('doi') for i in page], embeddings,
+                     labels = [i.get('label') for i in page], project = project)
+            watermark = _latest(watermark, *(i.get('modified') for i in page))
+            pulled += len(page)
+        if watermark != since:
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, watermark))
+        if self.superseded() != 0:
+            self.compact()
+        return pulled
+
+    def close(self):
+        self._conn.close()
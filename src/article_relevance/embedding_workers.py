@@ -0,0 +1,135 @@
+"""_Embedding across several CPU worker processes._
+
+A single PyTorch process does not keep every core of a large CPU busy: small
+batches leave intra-op threads idle. Here texts are tokenized once in the
+calling process, grouped into length-bucketed batches, and the batches are
+spread over N worker processes. Each worker loads the embedding model once when
+it starts and runs with `cores // N` torch threads, so the workers do not
+compete for cores. Results are gathered back into the original order.
+
+Workers are started with the `spawn` method, since forking a process after
+torch has started its thread pools can deadlock. Scripts using a pool should
+guard their entry point with `if __name__ == '__main__':`.
+
+Pools returned by `get_worker_pool()` are kept in a cache of their own rather
+than the model registry, so a pool is never dropped while its processes run.
+They are shut down by `shutdown_worker_pools()`, which also runs at exit.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from transformers import AutoConfig
+from .embedding_engine import embed_batch, length_batches
+from .model_registry import registry, get_embedding_model, get_tokenizer
+
+_worker_model = {}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _init_worker(model_name: str, adapter_name: str, threads: int):
+    torch.set_num_threads(threads)
+    _worker_model['args'] = (model_name, adapter_name, 'cpu')
+    # Load now, so the first batch does not pay for it.
+    get_embedding_model(*_worker_model['args'])
+
+
+def _embed_worker_batch(features: dict):
+    tokenizer, model = get_embedding_model(*_worker_model['args'])
+    return embed_batch(features, tokenizer, model)
+
+
+class EmbeddingWorkerPool:
+    """_A pool of CPU worker processes, each holding its own copy of the embedding model._
+
+    Args:
+        model_name (_str_): _Model name on hugging face model hub._
+        adapter_name (_str_): _Adapter name on hugging face model hub._
+        workers (_int_): _The number of worker processes._
+        threads (_int_): _Torch threads per worker. Defaults to the number of CPUs divided by `workers`._
+
+    Attributes:
+        last_run (_dict_): _The `texts`, `tokens`, `seconds` and `texts_per_second` of the last call to `embed_texts()`._
+    """
+    def __init__(self, model_name: str = 'allenai/specter2_base',
+                 adapter_name: str = 'allenai/specter2_classification',
+                 workers: int = 2,
+                 threads: int = None):
+        if workers < 1:
+            raise ValueError("workers must be a positive integer.")
+        self.model_name = model_name
+        self.adapter_name = adapter_name
+        self.workers = workers
+        self.threads = threads or max((os.cpu_count() or 1) // workers, 1)
+        self.last_run = {}
+        self._executor = ProcessPoolExecutor(max_workers = workers,
+                                             mp_context = multiprocessing.get_context('spawn'),
+                                             initializer = _init_worker,
+                                             initargs = (model_name, adapter_name, self.threads))
+
+    def embed_texts(self, texts: list, batch_size: int = 32, max_length: int = 512):
+        """_Embed texts over the worker processes, as `embedding_engine.embed_texts()`._
+
+        Returns:
+            _np.ndarray_: _A float32 array of shape (n, hidden_size), in the order of `texts`._
+        """
+        start = time.perf_counter()
+        tokenizer = get_tokenizer(self.model_name)
+        results = {}
+        lengths = []
+        if len(texts) > 0:
+            encoded = tokenizer(list(texts),
+                                truncation=True,
+                                max_length=max_length,
+                                return_token_type_ids=False)
+            lengths = [len(i) for i in encoded['input_ids']]
+            batches = length_batches(lengths, batch_size)
+            # Submit the longest batches first so no worker is left with a long batch at the end.
+            for batch in reversed(batches):
+                features = {key: [encoded[key][j] for j in batch] for key in encoded.keys()}
+                results[self._executor.submit(_embed_worker_batch, features)] = batch
+        embeddings = None
+        for future, batch in results.items():
+            vectors = future.result()
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+        if embeddings is None:
+            config = registry.get(('config', self.model_name), lambda: AutoConfig.from_pretrained(self.model_name))
+            embeddings = np.empty((0, config.hidden_size), dtype=np.float32)
+        seconds = time.perf_counter() - start
+        self.last_run = {'texts': len(texts),
+                         'tokens': int(sum(lengths)),
+                         'seconds': seconds,
+                         'texts_per_second': len(texts) / seconds if seconds > 0 else 0.0}
+        return embeddings
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+def get_worker_pool(model_name: str = 'allenai/specter2_base',
+                    adapter_name: str = 'allenai/specter2_classification',
+                    workers: int = 2,
+                    threads: int = None):
+    """_Return a (cached) `EmbeddingWorkerPool`, so repeated calls reuse the running workers and their loaded models._"""
+    key = (model_name, adapter_name, workers, threads)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = EmbeddingWorkerPool(model_name, adapter_name, workers = workers, threads = threads)
+        return _pools[key]
+
+
+@atexit.register
+def shutdown_worker_pools():
+    """_Shut down every pool started by `get_worker_pool()`._"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
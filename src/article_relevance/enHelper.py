@@ -1,8 +1,11 @@
-from langdetect import detect
+from .language_id import detect_language
 
 def enHelper(value: str):
     """_Test to see if a string has a detectable language._
 
+    The detector is seeded, so results are repeatable, and only the first 1000 characters are examined.
+    Use `detect_languages()` to test many strings with a persistent cache.
+
     Args:
         value (_str_): _A text string to be tested for language_
 
@@ -18,11 +21,9 @@ def enHelper(value: str):
     >>> enHelper(None)
     'error'
     """    
-    try:
-        detect_lang = detect(value)
-    except:
-        detect_lang = "error"
-    return detect_lang
+    if not isinstance(value, str):
+        return "error"
+    return detect_language(value)
 
 if __name__ == "__main__":
     import doctest
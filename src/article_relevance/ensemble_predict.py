@@ -0,0 +1,113 @@
+"""_Score papers with several relevance models at once and combine their predictions._
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .batch_scoring import _load_models, prediction_table
+from .model_dataset import ModelDataset
+
+METHODS = ['mean', 'vote', 'stack']
+
+
+def _model_label(name: str):
+    """_A short column label for a model, e.g. `data/models/lr_2024.joblib` becomes `lr_2024`._"""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def model_probabilities(data, models, workers: int = None):
+    """_The probability of relevance from each model, as an (n, n_models) matrix._
+
+    Models are loaded once (through the model registry) and run in parallel threads; most
+    scikit-learn `predict_proba` implementations spend their time in NumPy/BLAS code that
+    releases the GIL. Features are materialized once: the embedding matrix is shared by all
+    models, and the DataFrame layout is built once for all models trained on DataFrames.
+
+    Args:
+        data (_ModelDataset_ or _pd.DataFrame_): _The papers to score._
+        models (_list_ or _dict_): _Paths to joblib models, fitted estimators, or a dict of `{name: model}`._
+        workers (_int_): _The number of scoring threads. Defaults to one per model._
+
+    Returns:
+        _tuple_: _The model names and a float32 matrix with one column per model._
+    """
+    loaded = _load_models(models)
+    if isinstance(data, ModelDataset):
+        matrix = data.embeddings
+        frame = data.to_frame() if any(hasattr(i, 'feature_names_in_') for _, i in loaded) else None
+        inputs = [frame if hasattr(i, 'feature_names_in_') else matrix for _, i in loaded]
+    else:
+        inputs = [data] * len(loaded)
+
+    def score(i):
+        return loaded[i][1].predict_proba(inputs[i])[:, 1]
+
+    probabilities = np.empty((len(data), len(loaded)), dtype = np.float32)
+    with ThreadPoolExecutor(max_workers = workers or max(len(loaded), 1)) as executor:
+        for i, column in enumerate(executor.map(score, range(len(loaded)))):
+            probabilities[:, i] = column
+    return [i[0] for i in loaded], probabilities
+
+
+def fit_stacker(data, labels, models, workers: int = None):
+    """_Fit a logistic regression that combines the models' probabilities, for `method = 'stack'`._
+
+    Args:
+        data (_ModelDataset_ or _pd.DataFrame_): _Labelled papers that the models were not trained on._
+        labels (_array-like_): _The binary target for each paper._
+        models (_list_ or _dict_): _The models to combine, in the order later passed to `ensemble_predict()`._
+    """
+    from sklearn.linear_model import LogisticRegression
+    _, probabilities = model_probabilities(data, models, workers = workers)
+    return LogisticRegression().fit(probabilities, labels)
+
+
+def ensemble_predict(data,
+                     models,
+                     method: str = 'mean',
+                     predictThld: float = 0.5,
+                     stacker = None,
+                     workers: int = None):
+    """_Predict article relevance from an ensemble of models._
+
+    Args:
+        data (_ModelDataset_ or _pd.DataFrame_): _The papers to score, e.g. from `load_model_dataset()`._
+        models (_list_ or _dict_): _Paths to joblib models, fitted estimators, or a dict of `{name: model}`._
+        method (_str_): _How predictions are combined: `mean` (average probability), `vote`
+            (the share of models predicting relevance) or `stack` (a fitted `stacker`)._
+        predictThld (_float_): _The probability at or above which a paper is predicted relevant.
+            For `vote`, each model's prediction uses this threshold and a paper needs a majority._
+        stacker (_estimator_): _A classifier over the per-model probabilities, e.g. from `fit_stacker()`._
+        workers (_int_): _The number of scoring threads. Defaults to one per model._
+
+    Returns:
+        _pd.DataFrame_: _doi, one `predict_proba_<model>` column per model, the combined
+            `predict_proba` and `prediction`, `model_metadata` and `prediction_date`._
+
+    >>> from sklearn.linear_model import LogisticRegression
+    >>> from sklearn.tree import DecisionTreeClassifier
+    >>> X = np.array([[0.0, 1.0], [1.0, 0.0], [0.9, 0.2]], dtype = 'float32')
+    >>> models = {'lr': LogisticRegression(C = 100).fit(X, [0, 1, 1]), 'tree': DecisionTreeClassifier().fit(X, [0, 1, 0])}
+    >>> result = ensemble_predict(ModelDataset(X, ['a', 'b', 'c']), models, method = 'vote')
+    >>> result[['doi', 'predict_proba', 'prediction']].values.tolist()
+    [['a', 0.0, 0], ['b', 1.0, 1], ['c', 0.5, 0]]
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}.")
+    if method == 'stack' and stacker is None:
+        raise ValueError("A fitted stacker is required when method is 'stack', see fit_stacker().")
+    names, probabilities = model_probabilities(data, models, workers = workers)
+    if method == 'mean':
+        predict_proba = probabilities.mean(axis = 1)
+        prediction = predict_proba >= predictThld
+    elif method == 'vote':
+        predict_proba = (probabilities >= predictThld).mean(axis = 1)
+        prediction = predict_proba > 0.5
+    else:
+        predict_proba = stacker.predict_proba(probabilities)[:, 1]
+        prediction = predict_proba >= predictThld
+
+    dois = data.dois if isinstance(data, ModelDataset) else data['doi'].to_numpy()
+    return prediction_table(dois, predict_proba, prediction,
+                            f"{method}:" + ",".join(_model_label(i) for i in names),
+                            columns = {f'predict_proba_{_model_label(name)}': probabilities[:, i]
+                                       for i, name in enumerate(names)}).to_pandas()
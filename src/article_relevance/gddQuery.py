@@ -1,16 +1,78 @@
 import pandas as pd
+import random
 import re
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from .logs import get_logger
 
 logger = get_logger(__name__)
 
+def _get_gdd_page(session, url, max_retries = 5, backoff_factor = 1.0, timeout = 60):
+    """_Request one page from the xDD API, retrying failed requests with exponential backoff._"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(url, timeout = timeout)
+            if response.status_code == 200:
+                return response.json()
+            logger.warning(f'xDD returned status {response.status_code} for {url}.')
+        except requests.exceptions.RequestException as e:
+            logger.warning(f'xDD request failed: {e}')
+        if attempt < max_retries:
+            time.sleep(backoff_factor * 2 ** attempt + random.uniform(0, backoff_factor))
+    raise ConnectionError(f'Could not retrieve {url} from xDD after {max_retries + 1} attempts.')
+
+def iter_gdd_pages(api_call, session = None, max_retries = 5, backoff_factor = 1.0, timeout = 60, prefetch = True):
+    """
+    Stream the pages of an xDD API query.
+
+    Args:
+        api_call (str): The URL of the first page.
+        session (requests.Session): An optional session, reused for every page.
+        max_retries (int): Retries for each page before a `ConnectionError` is raised.
+        backoff_factor (float): The base, in seconds, of the exponential backoff between retries.
+        timeout (float): The request timeout, in seconds.
+        prefetch (bool): Request the next page in a background thread while the caller processes the current one.
+
+    Yields:
+        list The article records on each page.
+    """
+    if session is None:
+        session = requests.Session()
+    def fetch(url):
+        return _get_gdd_page(session, url, max_retries = max_retries, backoff_factor = backoff_factor, timeout = timeout)
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        pending = executor.submit(fetch, api_call) if prefetch else None
+        url = api_call
+        i = 0
+        while url:
+            response_dict = pending.result() if prefetch else fetch(url)
+            success = response_dict.get('success', {})
+            url = success.get('next_page', '')
+            if prefetch and url:
+                pending = executor.submit(fetch, url)
+            i += 1
+            data = success.get('data', [])
+            logger.info(f'{len(data)} articles queried from GeoDeepDive (page {i}).')
+            yield data
+
+def _article_fields(article):
+    """_The gddid, DOI and URL of an xDD article record._"""
+    identifier = (article.get('identifier') or [{}])[0]
+    if identifier.get('type') == 'doi':
+        doi = identifier.get('id')
+    else:
+        doi = 'Non-DOI Article ID type'
+    return article['_gddid'], doi, (article.get('link') or [{}])[0].get('url')
+
 def gddQuery(df = None,
              n_recent_articles = None, 
              min_date = None, 
              max_date = None, 
              term = None,
-             auto_check_dup = True): 
+             auto_check_dup = True,
+             prefetch = True,
+             seen_index = None): 
     """ 
     Get newly acquired articles from min_date to (optional) max_date. 
     Or get the most recent new articles added to GeoDeepDive.
@@ -23,6 +85,10 @@ def gddQuery(df = None,
         max_date (str)          Upper limit of GeoDeepDive acquired date.
         term (str)              Term to search for.
         auto_check_dup          Check parquet file to avoid duplication. Set up to True
+        prefetch (bool)         Request the next page while the current one is processed.
+        seen_index (SeenIDIndex) A persistent index of gddids already ingested. Used instead of `df` for
+                                duplicate checks. It is not updated here: once the returned articles have been
+                                stored, call `seen_index.mark_seen(result['gddid'])`.
     
     Return:
         pd.DataFrame with new DOIs
@@ -31,6 +97,10 @@ def gddQuery(df = None,
         get_new_gdd_articles(min_date='2023-06-07')
         get_new_gdd_articles(min_date='2023-06-01', max_date = '2023-06-08')
         get_new_gdd_articles(n_recent_articles = 1000)
+        seen = SeenIDIndex()
+        new_articles = gddQuery(min_date='2023-06-01', seen_index = seen)
+        ...  # store new_articles
+        seen.mark_seen(new_articles['gddid'])
     """
   
     # ======== Tests for input data type ==========
@@ -81,62 +151,34 @@ def gddQuery(df = None,
         api_call += api_extend
     
     # =========== Query xDD API to get data ==========
-    session = requests.Session()
-    response = session.get(api_call)
-    n_refresh = 0
-    
-    while response.status_code != 200 and n_refresh < 10:
-        response = requests.get(api_call)
-        n_refresh += 1
-    response_dict = response.json()
-    data = response_dict['success']['data']
-    i = 1
-    
-    logger.info(f'{len(data)} articles queried from GeoDeepDive (page {i}).')
-    
-    if 'next_page' in response_dict['success'].keys():
-        next_page = response_dict['success']['next_page']
-        n_refresh = 0
-        while (next_page != '') :
-            i += 1
-            logger.info(f"going to the next page: page{i}")
-            next_response = session.get(next_page)
-            while next_response.status_code != 200:
-                next_response = session.get(next_page)
-            next_response_dict = next_response.json()
-            new_data = next_response_dict['success']['data']
-            logger.info(f'{len(new_data)} articles queried from GeoDeepDive (page {i}).')
-            data.extend(new_data)
-            next_page = next_response_dict['success']['next_page']
-            n_refresh += 1
+    # Pages are streamed and only the columns we keep are accumulated.
+    gddids, dois, urls = [], [], []
+    for data in iter_gdd_pages(api_call, prefetch = prefetch):
+        for article in data:
+            gddid, doi, url = _article_fields(article)
+            gddids.append(gddid)
+            dois.append(doi)
+            urls.append(url)
     
     logger.info(f'GeoDeepDive query completed.')
     
     # ========= Convert gdd data to dataframe =========
-
-    gdd_df = pd.DataFrame()
-    for article in data:
-        one_article_dict = {}
-        one_article_dict['gddid'] = [article['_gddid']]
-        if article['identifier'][0]['type'] == 'doi':
-            one_article_dict['DOI'] = [article['identifier'][0]['id']]
-        else: 
-            one_article_dict['DOI'] = ['Non-DOI Article ID type']
-        one_article_dict['url'] = [article['link'][0]['url']]
-        one_article_dict['status'] = 'queried'
-        one_article = pd.DataFrame(one_article_dict)
-        gdd_df = pd.concat([gdd_df, one_article])
-    gdd_df = gdd_df.reset_index(drop=True)
+    gdd_df = pd.DataFrame({'gddid': gddids,
+                           'DOI': dois,
+                           'url': urls,
+                           'status': 'queried'})
     logger.info(f'{gdd_df.shape[0]} articles returned from GeoDeepDive.')
 
-    # # ========== Get list of existing gddids from the parquet files =========
+    # # ========== Drop articles whose gddids have already been seen =========
     if auto_check_dup == True:
-        if not isinstance(df, pd.DataFrame)  or 'gddid' not in df.columns:
-             raise KeyError('A data frame with gddids must be provided to check for duplicates. If you do not have a data frame, set up auto_check_dup to False')
-        gddids = df['gddid'].unique().tolist()
-
-        ## Filter from gdd_df all the values that already exist in the parquet:
-        result_df = gdd_df[~gdd_df['gddid'].isin(gddids)]
+        if seen_index is not None:
+            # The persistent index replaces loading the historical parquet.
+            result_df = gdd_df[~seen_index.contains(gdd_df['gddid'])].drop_duplicates('gddid').copy()
+        else:
+            if not isinstance(df, pd.DataFrame)  or 'gddid' not in df.columns:
+                 raise KeyError('A data frame with gddids, or a seen_index, must be provided to check for duplicates. If you have neither, set up auto_check_dup to False')
+            ## Filter from gdd_df all the values that already exist in the parquet:
+            result_df = gdd_df[~gdd_df['gddid'].isin(set(df['gddid']))].copy()
     
         logger.info(f'{result_df.shape[0]} articles are new addition for relevance prediction.')
         
@@ -149,6 +191,6 @@ def gddQuery(df = None,
     result_df['queryinfo_n_recent'] = n_recent_articles
     result_df['queryinfo_term'] = term
     
-    logger.info(f'{result_df.columns} metadata for {results_df.shape[0]} articles saved.')
+    logger.info(f'{result_df.columns} metadata for {result_df.shape[0]} articles saved.')
 
     return result_df
\ No newline at end of file
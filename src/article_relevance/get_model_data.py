@@ -1,23 +1,35 @@
 from io import BytesIO
 import pandas as pd
 from .clean_dois import clean_dois
-import requests
+from .api_client import get_client
 from requests.exceptions import ReadTimeout
-import os
 import json
+from .embedding_codec import decode_embeddings
+from .model_dataset import ModelDataset, RowBuffer
+import numpy as np
 
-def get_model_data(model:str, project = None):
+def get_model_data(model:str, project = None, encoding:str = 'float32'):
+    """_Get the embeddings and labels for a project and embedding model._
+
+    Args:
+        model (_str_): _The embedding model name._
+        project (_str_): _The project name, or `None` for all embedded papers._
+        encoding (_str_): _Embeddings are requested as base64 `float32` or `float16` buffers._
+
+    Returns:
+        _list_: _A list of dicts. Each `embeddings` value is a float32 row of a single (n, dim) matrix._
+    """
     try:
-        outcome = requests.get('http://' + os.environ['API_HOME'] + '/v0.1/modeldata',
-                            params = {'project': project, 'model': model},
-                            timeout = 10)
+        outcome = get_client().get('/v0.1/modeldata',
+                                   params = {'project': project, 'model': model, 'encoding': encoding})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
                 return None
             else:
-                for i in call_output:
-                    i['embeddings'] = json.loads(i['embeddings'])
+                embeddings = decode_embeddings([i['embeddings'] for i in call_output], encoding = encoding)
+                for i, row in zip(call_output, embeddings):
+                    i['embeddings'] = row
                 return call_output
     except ReadTimeout as e:
         print(f'Connection failed for project {project}:')
@@ -25,3 +37,71 @@ def get_model_data(model:str, project = None):
     except Exception as e:
         print(f'General exception for project {project}:')
         print(e)
+
+def iter_model_data(model:str, project = None, page_size:int = 1000, encoding:str = 'float32', cursor = None,
+                    since:str = None):
+    """_Stream model data from the API one page at a time._
+
+    Each request asks for at most `page_size` rows after `cursor`, and the API returns
+    the cursor for the next page in `next_cursor` (empty once all rows are returned).
+
+    Args:
+        model (_str_): _The embedding model name._
+        project (_str_): _The project name, or `None` for all embedded papers._
+        page_size (_int_): _The number of rows requested per page._
+        encoding (_str_): _Embeddings are requested as base64 `float32` or `float16` buffers._
+        cursor (_str_): _Resume from a cursor returned by an earlier page._
+        since (_str_): _Only return rows added or updated after this ISO 8601 timestamp._
+
+    Yields:
+        _list_: _The records (dicts with `doi`, `label` and encoded `embeddings`) of each page._
+    """
+    while True:
+        outcome = get_client().get('/v0.1/modeldata',
+                                   params = {'project': project, 'model': model, 'encoding': encoding,
+                                             'limit': page_size, 'cursor': cursor, 'since': since})
+        if outcome.status_code != 200:
+            raise ConnectionError(f'Model data request failed for project {project} (status {outcome.status_code}).')
+        content = json.loads(outcome.content)
+        page = content.get('data') or []
+        if len(page) > 0:
+            yield page
+        cursor = content.get('next_cursor')
+        if not cursor or len(page) == 0:
+            break
+
+def load_model_dataset(model:str, project = None, page_size:int = 1000, encoding:str = 'float32', store = None):
+    """_Load model data page by page into a `ModelDataset`._
+
+    Embeddings are decoded as each page arrives into a single growing float32 matrix, so
+    only one page of encoded records is held in memory at a time.
+
+    Args:
+        model (_str_): _The embedding model name._
+        project (_str_): _The project name, or `None` for all embedded papers._
+        page_size (_int_): _The number of rows requested per page._
+        encoding (_str_): _Embeddings are requested as base64 `float32` or `float16` buffers._
+        store (_EmbeddingStore_): _An optional local store for `model`. Only rows added since its last sync are
+                                   pulled, and the dataset is read from the memory-mapped store._
+
+    Returns:
+        _ModelDataset_: _The embeddings matrix with the DOI and label of each row._
+    """
+    if store is not None:
+        if store.model != model:
+            raise ValueError(f"The store holds embeddings for {store.model}, not {model}.")
+        store.sync(project = project, page_size = page_size, encoding = encoding)
+        return store.dataset(project = project)
+    buffer = None
+    dois = []
+    labels = []
+    for page in iter_model_data(model, project = project, page_size = page_size, encoding = encoding):
+        values = [i['embeddings'] for i in page]
+        if buffer is None:
+            first = decode_embeddings(values[:1], encoding = encoding)
+            buffer = RowBuffer(dim = first.shape[1], capacity = page_size)
+        decode_embeddings(values, encoding = encoding, out = buffer.reserve(len(values)))
+        dois.extend(i.get('doi') for i in page)
+        labels.extend(i.get('label') for i in page)
+    embeddings = buffer.array() if buffer is not None else np.empty((0, 0), dtype = np.float32)
+    return ModelDataset(embeddings, dois, labels)
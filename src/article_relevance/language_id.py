@@ -0,0 +1,103 @@
+"""_Deterministic, cached language identification._
+
+langdetect samples n-grams at random, so the same text can be labelled
+differently between runs unless the detector is seeded, and it is slow. Here
+only a bounded prefix of each text is examined, the detector is seeded, and
+results are memoized in a sqlite cache keyed by a hash of that prefix, so
+re-processing the same records skips detection entirely.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from langdetect import detect, DetectorFactory
+from .batching import chunked
+
+DetectorFactory.seed = 0
+
+PREFIX_CHARS = 1000
+
+
+def detect_language(value: str, prefix_chars: int = PREFIX_CHARS):
+    """_The language of the first `prefix_chars` characters of a string, or "error" if it can't be detected._
+
+    >>> detect_language('portez ce vieux whisky au juge blond qui fume')
+    'fr'
+    """
+    try:
+        return detect(value[:prefix_chars])
+    except Exception:
+        return "error"
+
+
+def text_key(value: str, prefix_chars: int = PREFIX_CHARS):
+    """_The cache key for a text: a BLAKE2b hash of the prefix that is passed to the detector._"""
+    return hashlib.blake2b(str(value)[:prefix_chars].encode('utf-8'), digest_size = 16).hexdigest()
+
+
+class LanguageCache:
+    """_A sqlite cache of detected languages, safe to share between threads and processes._
+
+    Args:
+        path (_str_): _The sqlite database file. Parent directories are created if needed._
+
+    >>> cache = LanguageCache(':memory:')
+    >>> cache.put({'abc': 'en'})
+    >>> cache.get(['abc', 'def'])
+    {'abc': 'en'}
+    """
+    def __init__(self, path: str = 'data/cache/languages.sqlite'):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS languages (key TEXT PRIMARY KEY, language TEXT NOT NULL) WITHOUT ROWID")
+
+    def get(self, keys: list):
+        """_A dict of the cached language for each key that is in the cache._"""
+        result = {}
+        with self._lock:
+            for batch in chunked(sorted(set(keys)), 500):
+                query = f"SELECT key, language FROM languages WHERE key IN ({','.join('?' * len(batch))})"
+                result.update(self._conn.execute(query, batch))
+        return result
+
+    def put(self, languages: dict):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO languages (key, language) VALUES (?, ?)", languages.items())
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM languages").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def detect_languages(texts: list, cache: LanguageCache = None, prefix_chars: int = PREFIX_CHARS):
+    """_Detect the language of many texts, detecting each distinct prefix once and reusing cached results._
+
+    Args:
+        texts (_list_): _The strings to test._
+        cache (_LanguageCache_): _An optional persistent cache of earlier results._
+        prefix_chars (_int_): _The number of leading characters examined._
+
+    Returns:
+        _list_: _The language of each text, or "error" where it can't be detected._
+
+    >>> detect_languages(['Hello friend, how are you?', '12345 - 023 - 232 12', 'Hello friend, how are you?'])
+    ['en', 'error', 'en']
+    """
+    keys = [text_key(i, prefix_chars) for i in texts]
+    languages = cache.get(keys) if cache is not None else {}
+    detected = {}
+    for key, text in zip(keys, texts):
+        if key not in languages and key not in detected:
+            detected[key] = detect_language(text, prefix_chars) if isinstance(text, str) else "error"
+    if cache is not None and len(detected) > 0:
+        cache.put(detected)
+    languages.update(detected)
+    return [languages[i] for i in keys]
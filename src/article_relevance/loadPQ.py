@@ -1,28 +1,144 @@
-
-import pandas as pd
 import os
-import boto3
-from io import BytesIO
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+from .prediction_dataset import PredictionDataset, FileSystemStorage, MANIFEST_DIR, LEGACY_MANIFEST
+from .batch_scoring import PREDICTION_SCHEMA
+
+LATEST_KEYS = ['doi', 'model_metadata']
+
+
+def latest_predictions(table):
+    """_Keep only the most recent row (by `prediction_date`) for each paper and model.
+
+    Re-scored papers are appended to the prediction dataset rather than rewritten, so older
+    predictions for the same (doi, model_metadata) are dropped here. Tables without those
+    columns are returned unchanged._
+    """
+    keys = [i for i in LATEST_KEYS if i in table.column_names]
+    if 'doi' not in keys or 'prediction_date' not in table.column_names or table.num_rows == 0:
+        return table
+    order = pc.sort_indices(table, sort_keys = [('prediction_date', 'descending')])
+    ordered = table.select(keys).take(order).append_column('_row', order)
+    first = ordered.group_by(keys, use_threads = False).aggregate([('_row', 'first')])
+    return table.take(np.sort(first.column('_row_first').to_numpy()))
+
+
+def manifest_files(source: str, filesystem):
+    """_The data files listed in the manifest of the dataset at `source`, or None if it has no manifest._
+
+    Files that are not in the manifest (e.g., the inputs of a compaction that was interrupted
+    before they were deleted, or a merged file that was never committed) are not returned.
+    """
+    if filesystem.get_file_info(source).type != fs.FileType.Directory:
+        return None
+    storage = FileSystemStorage(filesystem, source)
+    if len(storage.list(MANIFEST_DIR)) == 0 and storage.get(LEGACY_MANIFEST) is None:
+        return None
+    return [storage.path(i) for i in PredictionDataset(storage).files()]
+
+
+def unified_schema(dataset):
+    """_One schema for every file in `dataset`, starting from `PREDICTION_SCHEMA`.
 
-def loadPQ(AWS = True, parquetPath=None):
+    `pyarrow.dataset` otherwise takes the schema of the first file it finds, so columns that only
+    later files have (e.g., per-model ensemble probabilities) could not be read, and a file
+    written with wider types could fail the scan. Columns a file lacks are read as nulls._
+    """
+    return pa.unify_schemas([PREDICTION_SCHEMA, dataset.schema] + [i.physical_schema for i in dataset.get_fragments()],
+                            promote_options = 'permissive')
+
+
+def _select(table, columns: list = None):
+    # Requested columns that no file has (e.g., `gddid`) are returned as nulls rather than failing the read.
+    if columns is None:
+        return table
+    for name in columns:
+        if name not in table.column_names:
+            table = table.append_column(pa.field(name, pa.string()), pa.nulls(table.num_rows, pa.string()))
+    return table.select(list(columns))
+
+
+def loadPQ(AWS = True,
+           parquetPath = None,
+           columns = None,
+           filter = None,
+           bucket_name = 'metareview',
+           object_key = 'article-relevance-output',
+           filesystem = None,
+           as_table = False,
+           latest = True):
+    """
+    Load relevance predictions written by `predToPQ()`.
+    The files listed in the dataset's manifest (or, for data without one, every file
+    below the path) are scanned with `pyarrow.dataset`; only the
+    requested columns are read, and partitions and row groups that cannot match
+    `filter` are skipped. On S3 the files are read with ranged requests rather
+    than downloading whole objects.
+
+    Args:
+        AWS (bool): Read from S3, otherwise from `parquetPath`.
+        parquetPath (str): The local dataset directory (e.g., `<path>/prediction_parquet`) or a single parquet file.
+        columns (list): The columns to read. All columns by default.
+        filter (pyarrow.compute.Expression or list): A filter expression (e.g., `ds.field('model') == 'lr'`) or
+            pandas-style filters (e.g., `[('run_date', '>=', '2024-09-01')]`).
+        bucket_name (str): The S3 bucket.
+        object_key (str): The S3 prefix of the dataset, or the key of a single parquet file.
+        filesystem (pyarrow.fs.FileSystem): An optional filesystem, e.g. an `S3FileSystem` with custom credentials.
+        as_table (bool): Return a `pyarrow.Table` instead of a pandas DataFrame.
+        latest (bool): Return only the most recent prediction for each (doi, model_metadata), see `latest_predictions()`.
+
+    Returns:
+        pd DataFrame (or pa Table) of the matching rows, in the schema from `unified_schema()`. A requested column that
+        the data does not have is all null. When there is no dataset at the path or prefix, an empty frame (or table)
+        in `PREDICTION_SCHEMA` is returned.
+
+    Example:
+        loadPQ(columns = ['doi', 'predict_proba'])
+        loadPQ(AWS = False, parquetPath = 'data/prediction_parquet', filter = [('model', '=', 'lr')])
+    """
     if AWS == True:
-        extension = ".parquet"
-        s3 = boto3.client('s3')  
-        bucket_name = 'metareview' #load this as env variables
-        object_key = 'article-relevance-output-all.parquet' #load this as env variables
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        content = response['Body'].read()   
-        df = pd.read_parquet(BytesIO(content))
+        source = f"{bucket_name}/{object_key.strip('/')}"
+        if filesystem is None:
+            filesystem = fs.S3FileSystem()
     else:
         if parquetPath == None:
-            raise ValueError("When AWS is False, a path must be provided")  
-        if os.path.exists(parquetPath):
-            pqFiles = [file for file in os.listdir(parquetPath) if file.endswith(extension)]
-        if pqFiles:
-            latestPQFile = max(pqFiles, key=lambda file: os.path.getmtime(os.path.join(parquetPath, file)))
-            latestPQFilePath = os.path.join(parquetPath, latestPQFile)
-            try:
-                df = pd.read_parquet(latestPQFilePath)
-            except Exception as e:
-                print("Parquet file not available, querying all GDD.")
-    return df
\ No newline at end of file
+            raise ValueError("When AWS is False, a path must be provided")
+        source = os.path.abspath(parquetPath)
+        if filesystem is None:
+            filesystem = fs.LocalFileSystem()
+    if isinstance(filter, list):
+        filter = pq.filters_to_expression(filter)
+
+    dataset = None
+    # A missing local path or an S3 prefix with no objects is reported as NotFound.
+    if filesystem.get_file_info(source).type != fs.FileType.NotFound:
+        files = manifest_files(source, filesystem)
+        if files is None:
+            dataset = ds.dataset(source, format = 'parquet', partitioning = 'hive', filesystem = filesystem)
+        elif len(files) > 0:
+            dataset = ds.dataset(files, format = 'parquet', partitioning = ds.partitioning(flavor = 'hive'),
+                                 partition_base_dir = source, filesystem = filesystem)
+    if dataset is None:
+        print("Parquet file not available, querying all GDD.")
+        table = _select(PREDICTION_SCHEMA.empty_table(), columns)
+        return table if as_table else table.to_pandas()
+    dataset = dataset.replace_schema(unified_schema(dataset))
+    names = dataset.schema.names
+    if columns is None:
+        read = None
+    else:
+        read = [i for i in columns if i in names]
+        if latest:
+            # The de-duplication keys are read even when they were not asked for, then dropped.
+            read += [i for i in LATEST_KEYS + ['prediction_date'] if i in names and i not in read]
+    table = dataset.to_table(columns = read, filter = filter)
+    if latest:
+        table = latest_predictions(table)
+    table = _select(table, columns)
+    if as_table:
+        return table
+    return table.to_pandas()
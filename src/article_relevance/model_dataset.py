@@ -0,0 +1,104 @@
+"""_A lightweight, NumPy-backed container for model data._
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class RowBuffer:
+    """_A float32 matrix that grows by doubling as rows are appended._
+
+    >>> buffer = RowBuffer(dim = 2, capacity = 1)
+    >>> buffer.reserve(3)[:] = 1.0
+    >>> buffer.array().shape
+    (3, 2)
+    """
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.n = 0
+        self.data = np.empty((max(capacity, 1), dim), dtype = np.float32)
+
+    def reserve(self, rows: int):
+        """_Grow the buffer if needed and return a writable view of the next `rows` rows._"""
+        if self.n + rows > self.data.shape[0]:
+            grown = np.empty((max(2 * self.data.shape[0], self.n + rows), self.dim), dtype = np.float32)
+            grown[:self.n] = self.data[:self.n]
+            self.data = grown
+        view = self.data[self.n:self.n + rows]
+        self.n += rows
+        return view
+
+    def array(self):
+        """_The filled rows of the buffer._"""
+        return self.data[:self.n]
+
+
+def embedding_hashes(embeddings):
+    """_The 128-bit BLAKE2b hex digest of each float32 embedding row.
+
+    >>> hashes = embedding_hashes(np.array([[0.0, 1.0], [0.0, 1.0], [1.0, 0.0]]))
+    >>> hashes[0] == hashes[1], hashes[0] == hashes[2], len(hashes[0])
+    (True, False, 32)
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype = '<f4')
+    return np.array([hashlib.blake2b(i.tobytes(), digest_size = 16).hexdigest() for i in embeddings], dtype = object)
+
+
+class ModelDataset:
+    """_Embeddings, DOIs and labels for a set of papers, held as NumPy arrays._
+
+    Args:
+        embeddings (_np.ndarray_): _A float32 matrix of shape (n, dim)._
+        dois (_array-like_): _The DOI for each row._
+        labels (_array-like_): _The label for each row (`None` for unlabelled papers)._
+        hashes (_array-like_): _Optional `embedding_hashes()` of each row, when the source already knows them._
+
+    >>> data = ModelDataset(np.zeros((3, 2), dtype = 'float32'), ['a', 'b', 'c'], ['In Neotoma', None, 'Not Neotoma'])
+    >>> len(data), len(data.labelled())
+    (3, 2)
+    >>> data.to_frame().columns.tolist()
+    ['embedding_0', 'embedding_1', 'doi']
+    """
+    def __init__(self, embeddings, dois, labels = None, hashes = None):
+        self.embeddings = embeddings
+        self.dois = np.asarray(dois, dtype = object)
+        self.labels = np.asarray(labels if labels is not None else [None] * len(self.dois), dtype = object)
+        self.hashes = None if hashes is None else np.asarray(hashes, dtype = object)
+        if not (self.embeddings.shape[0] == len(self.dois) == len(self.labels)):
+            raise ValueError("embeddings, dois and labels must have the same number of rows.")
+        if self.hashes is not None and len(self.hashes) != len(self.dois):
+            raise ValueError("hashes must have one entry per row.")
+
+    def __len__(self):
+        return len(self.dois)
+
+    def take(self, indices):
+        """_A new dataset with the rows at `indices` (an integer or boolean index array)._"""
+        return ModelDataset(self.embeddings[indices], self.dois[indices], self.labels[indices],
+                            None if self.hashes is None else self.hashes[indices])
+
+    def labelled(self):
+        """_The rows that have a label._"""
+        return self.take(np.array([i is not None for i in self.labels], dtype = bool))
+
+    def feature_names(self):
+        return [f'embedding_{str(i)}' for i in range(self.embeddings.shape[1])]
+
+    def to_frame(self):
+        """_The DataFrame layout (`embedding_0`...`embedding_n`, `doi`) used by models trained on DataFrames._"""
+        frame = pd.DataFrame(self.embeddings, columns = self.feature_names(), copy = False)
+        return frame.assign(doi = self.dois)
+
+
+def model_input(model_object, data):
+    """_Present `data` to a model in the form it was trained on._
+
+    Models trained on DataFrames (e.g., pipelines from earlier `relevancePredictTrain()` runs)
+    record `feature_names_in_` and are given the DataFrame layout, other models get the
+    embedding matrix directly.
+    """
+    if isinstance(data, ModelDataset):
+        if hasattr(model_object, 'feature_names_in_'):
+            return data.to_frame()
+        return data.embeddings
+    return data
@@ -0,0 +1,177 @@
+"""_A process-wide registry of loaded models._
+
+Loading the SPECTER2 tokenizer, base model and adapter (or a joblib classifier)
+can take seconds to minutes. The registry keeps loaded objects keyed by what
+was loaded, so repeated calls within a long-lived process pay that cost once.
+
+Keys are tuples whose first element is the kind of object (`'tokenizer'`,
+`'embedding'`, `'classifier'`, ...). Each kind has its own capacity, so loading
+many classifiers for an ensemble does not evict the embedding model.
+"""
+import os
+import threading
+from collections import OrderedDict
+import joblib
+from transformers import AutoTokenizer
+from adapters import AutoAdapterModel
+
+
+class ModelRegistry:
+    """_A thread-safe, least-recently-used cache of loaded models, with a capacity for each kind of object._
+
+    Evicted objects that have a `close()` or `shutdown()` method are closed.
+
+    Args:
+        max_size (_int_): _The number of objects of each kind held before the least recently used is evicted._
+        capacities (_dict_): _Capacities for particular kinds (the first element of tuple keys), overriding `max_size`._
+
+    >>> reg = ModelRegistry(max_size = 2)
+    >>> reg.get('a', lambda: 1), reg.get('b', lambda: 2), reg.get('a', lambda: 10)
+    (1, 2, 1)
+    >>> reg.get('c', lambda: 3)
+    3
+    >>> reg.keys()
+    ['a', 'c']
+    >>> reg = ModelRegistry(max_size = 1, capacities = {'classifier': 2})
+    >>> for key in [('embedding', 'm'), ('classifier', 1), ('classifier', 2), ('classifier', 3)]:
+    ...     _ = reg.get(key, lambda: key)
+    >>> reg.keys()
+    [('embedding', 'm'), ('classifier', 2), ('classifier', 3)]
+    """
+    def __init__(self, max_size: int = 4, capacities: dict = None):
+        if max_size < 1 or any(i < 1 for i in (capacities or {}).values()):
+            raise ValueError("max_size and capacities must be positive integers.")
+        self.max_size = max_size
+        self.capacities = dict(capacities or {})
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def _kind(key):
+        return key[0] if isinstance(key, tuple) and len(key) > 0 else None
+
+    @staticmethod
+    def _close(objects):
+        for obj in objects:
+            close = getattr(obj, 'close', None) or getattr(obj, 'shutdown', None)
+            if callable(close):
+                close()
+
+    def get(self, key, loader):
+        """_Return the object stored under `key`, calling `loader()` to create it if needed._
+
+        Concurrent requests for the same key wait for a single load rather than
+        loading the model several times.
+        """
+        with self._lock:
+            if key in self._objects:
+                self._objects.move_to_end(key)
+                return self._objects[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._objects:
+                    self._objects.move_to_end(key)
+                    return self._objects[key]
+            loaded = loader()
+            with self._lock:
+                self._objects[key] = loaded
+                self._objects.move_to_end(key)
+                kind = self._kind(key)
+                same_kind = [i for i in self._objects if self._kind(i) == kind]
+                evicted = [self._objects.pop(i) for i in same_kind[:max(len(same_kind) - self.capacities.get(kind, self.max_size), 0)]]
+                self._key_locks.pop(key, None)
+        self._close(evicted)
+        return loaded
+
+    def evict(self, key):
+        """_Remove a single object from the registry, if present._"""
+        with self._lock:
+            evicted = [self._objects.pop(key)] if key in self._objects else []
+        self._close(evicted)
+
+    def clear(self):
+        """_Remove all objects from the registry._"""
+        with self._lock:
+            evicted = list(self._objects.values())
+            self._objects.clear()
+        self._close(evicted)
+
+    def keys(self):
+        """_The registry keys, least recently used first._"""
+        with self._lock:
+            return list(self._objects.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._objects
+
+    def __len__(self):
+        with self._lock:
+            return len(self._objects)
+
+
+registry = ModelRegistry(max_size = int(os.environ.get('MODEL_REGISTRY_SIZE', 4)),
+                         capacities = {'classifier': int(os.environ.get('MODEL_REGISTRY_CLASSIFIERS', 16))})
+
+
+def get_tokenizer(model_name: str = 'allenai/specter2_base'):
+    """_Return the (cached) tokenizer for a hugging face model._"""
+    return registry.get(('tokenizer', model_name),
+                        lambda: AutoTokenizer.from_pretrained(model_name))
+
+
+def get_embedding_model(model_name: str = 'allenai/specter2_base',
+                        adapter_name: str = 'allenai/specter2_classification',
+                        device: str = 'cpu'):
+    """_Return the (cached) tokenizer and adapter model used to build embeddings._
+
+    Args:
+        model_name (_str_): _Model name on hugging face model hub._
+        adapter_name (_str_): _Adapter name on hugging face model hub._
+        device (_str_): _The torch device the model should be placed on._
+
+    Returns:
+        _tuple_: _The tokenizer and the model, with the adapter loaded and active._
+    """
+    def loader():
+        model = AutoAdapterModel.from_pretrained(model_name)
+        # load the adapter(s) as per allenai/specter2 requirement.
+        model.load_adapter(adapter_name,
+                           source="hf",
+                           load_as="classification",
+                           set_active=True,
+                           device_map='gpu')
+        return model.to(device)
+    model = registry.get(('embedding', model_name, adapter_name, device), loader)
+    return get_tokenizer(model_name), model
+
+
+def get_classifier(path: str):
+    """_Return a (cached) joblib model. The file modification time is part of the key, so a retrained file is reloaded._"""
+    path = os.path.abspath(path)
+    return registry.get(('classifier', path, os.path.getmtime(path)),
+                        lambda: joblib.load(path))
+
+
+def warm_up(model_name: str = 'allenai/specter2_base',
+            adapter_name: str = 'allenai/specter2_classification',
+            device: str = 'cpu',
+            classifiers: list = None):
+    """_Load models ahead of time, e.g., when a worker process starts._
+
+    Args:
+        model_name (_str_): _Embedding model name on hugging face model hub, or None to skip._
+        adapter_name (_str_): _Adapter name on hugging face model hub._
+        device (_str_): _The torch device the embedding model should be placed on._
+        classifiers (_list_): _Paths to joblib classifiers to load._
+
+    Returns:
+        _list_: _The registry keys currently loaded._
+    """
+    if model_name is not None:
+        get_embedding_model(model_name, adapter_name, device)
+    for i in classifiers or []:
+        get_classifier(i)
+    return registry.keys()
@@ -1,84 +1,62 @@
 import os
-import pyarrow as pa
-import pyarrow.parquet as pq
-import pandas as pd
 import datetime
-import boto3
-from io import BytesIO
+from .prediction_dataset import PredictionDataset, LocalStorage, S3Storage
 from .logs import get_logger
 
 logger = get_logger(__name__)
 
 def predToPQ(input_df,
              AWS = True,
-             object_key =  'article-relevance-output-all_00_trial_up.parquet',
+             object_key = 'article-relevance-output',
              inplace = True,
-             parquetPath = None):
+             parquetPath = None,
+             bucket_name = 'metareview',
+             compact = None,
+             s3 = None):
     """
-    Store prediction on article relevance in a parquet file. 
-    Add prediction and predict_proba to predictionsDF
-    Save resulting dataframe with all information in output_path directory.
-    Return the resulting dataframe.
+    Store predictions on article relevance in an append-only Parquet dataset.
+    Each call writes the batch as new files partitioned by run date and model
+    (`run_date=YYYY-MM-DD/model=<model>/part-<uuid>.parquet`) and records them in
+    a new fragment of the dataset's manifest (`_manifest/`). Earlier files, and the
+    manifest fragments of earlier batches, are not read or rewritten.
 
     Args:
-        input_df (pd DataFrame): Input data frame to save as PQ. 
-        model_path (str): Directory to trained model object.
+        input_df (pd DataFrame or pa Table): Predictions to save, e.g. from `relevancePredict()`.
+        AWS (bool): Write to S3, otherwise below `parquetPath`.
+        object_key (str): The S3 prefix of the dataset.
+        inplace (bool): Append to the shared dataset. If False the batch is written to a new, timestamped dataset.
+        parquetPath (str): The local directory used when `AWS` is False.
+        bucket_name (str): The S3 bucket.
+        compact (int): If set, merge any partition that has reached this many files.
+        s3 (boto3.client): An optional S3 client.
 
     Returns:
-        pd DataFrame with prediction and predict_proba added.
+        list The keys of the files written, relative to the dataset root.
     """
+    if inplace != True:
+        object_key = f"{object_key}_{datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')}"
     if AWS == True:
-
-        ## Todo: if inplace, true, then append the new df to the old one. If false, create a new file in AWS with a timestamp
-
-        parquet_buffer = BytesIO()
-        table = pa.Table.from_pandas(input_df)
-        pq.write_table(table, parquet_buffer)
-
-        s3 = boto3.client('s3')   
-        bucket_name = 'metareview'
-        object_key = object_key
-
-        parquet_buffer.seek(0)
-        if inplace == True:
-            # Read the existing data from S3 if it exists
-            try:
-                existing_data = pd.read_parquet(f's3://{bucket_name}/{object_key}')
-                combined_data = pd.concat([existing_data, input_df], ignore_index=True)
-                pq_buffer = BytesIO()
-                table = pa.Table.from_pandas(combined_data)
-                pq.write_table(table, pq_buffer)
-                pq_buffer.seek(0)
-                s3.upload_fileobj(pq_buffer, bucket_name, object_key)
-            except:
-                # If the file doesn't exist, simply upload the new data
-                s3.upload_fileobj(parquet_buffer, bucket_name, object_key)
-    
+        storage = S3Storage(bucket_name, object_key, s3 = s3)
     else:
         if parquetPath == None:
-            raise ValueError("When AWS is False, a path must be provided")  
-
-        # ==== Save result to output_path directory =====
+            raise ValueError("When AWS is False, a path must be provided")
         parquetFolder = os.path.join(parquetPath, 'prediction_parquet')
-        if not os.path.exists(parquetFolder):
-            os.makedirs(parquetFolder)
-        
-        # Generate file name based on run date and batch
-        now = datetime.datetime.now()
-        formatted_datetime = now.strftime("%Y-%m-%dT%H-%M-%S")
-
-        # Check if a file with the current batch number already exists
-        parquet_file_name = os.path.join(parquetFolder, f"article-relevance-prediction_{formatted_datetime}.parquet")
-        while os.path.isfile(parquet_file_name):
-            parquet_file_name = os.path.join(parquetFolder, f"article-relevance-prediction_{formatted_datetime}.parquet")
+        if inplace != True:
+            parquetFolder = os.path.join(parquetFolder, os.path.basename(object_key))
+        storage = LocalStorage(parquetFolder)
 
-        # Write the Parquet file
-        input_df.to_parquet(parquet_file_name)
+    dataset = PredictionDataset(storage)
+    written = dataset.append(input_df)
+    if compact is not None:
+        dataset.compact(min_files = compact)
 
     # ===== log important information ======
-    logger.info(f'Total number of DOI processed: {input_df.shape[0]}')
-    logger.info(f"Number of valid articles: {input_df.query('validForPrediction == 1').shape[0]}")
-    logger.info(f"Number of invalid articles: {input_df.query('validForPrediction != 1').shape[0]}")
-    logger.info(f"Number of relevant articles: {input_df.query('prediction == 1').shape[0]}")
-
-    return None
\ No newline at end of file
+    logger.info(f'Total number of DOI processed: {input_df.shape[0] if hasattr(input_df, "shape") else input_df.num_rows}')
+    logger.info(f'Files written: {len(written)}')
+    if hasattr(input_df, 'columns') and 'validForPrediction' in input_df.columns:
+        logger.info(f"Number of valid articles: {input_df.query('validForPrediction == 1').shape[0]}")
+        logger.info(f"Number of invalid articles: {input_df.query('validForPrediction != 1').shape[0]}")
+    if hasattr(input_df, 'columns') and 'prediction' in input_df.columns:
+        logger.info(f"Number of relevant articles: {input_df.query('prediction == 1').shape[0]}")
+
+    return written
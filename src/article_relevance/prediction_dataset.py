@@ -0,0 +1,290 @@
+"""_An append-only, partitioned Parquet dataset of relevance predictions._
+
+Each batch of predictions is written as new files, one per partition, under
+hive-style paths:
+
+    <root>/run_date=2024-09-22/model=<model>/part-<uuid>.parquet
+
+Existing files are never read or rewritten when appending, so a write costs
+O(batch) rather than O(history). Each append also writes one manifest fragment,
+
+    <root>/_manifest/<timestamp>-<id>.json
+
+listing the files it added (with their partition and row count), so the
+manifest is never read back and rewritten by a writer. The current file list is
+the fragments replayed in name order, starting from the latest checkpoint.
+
+`compact()` merges partitions that have accumulated many small files. The
+merged files are committed by a fragment that adds them and removes the files
+they replace, and only then are the old files deleted; `loadPQ()` reads the
+files the manifest lists, so a reader never sees both (or neither), even if
+compaction is interrupted. Compaction also folds the fragments into a single
+checkpoint.
+
+The dataset expects a single writer at a time.
+"""
+import json
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import fs
+from .batching import chunked
+
+MANIFEST_DIR = '_manifest'
+# The single manifest file written by earlier versions; read as the starting state when present.
+LEGACY_MANIFEST = '_manifest.json'
+
+
+class LocalStorage:
+    """_Read and write dataset files below a local directory._"""
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+
+    def get(self, key: str):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix: str):
+        """_The keys of the files directly below `prefix`._"""
+        try:
+            names = os.listdir(self.path(prefix))
+        except FileNotFoundError:
+            return []
+        return [f'{prefix}/{i}' for i in names if not i.endswith('.tmp')]
+
+    def delete(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class S3Storage:
+    """_Read and write dataset files below an S3 prefix using boto3._"""
+    def __init__(self, bucket: str, prefix: str, s3 = None):
+        if s3 is None:
+            import boto3
+            s3 = boto3.client('s3')
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def path(self, key: str):
+        return f'{self.prefix}/{key}'
+
+    def put(self, key: str, data: bytes):
+        self.s3.put_object(Bucket = self.bucket, Key = self.path(key), Body = data)
+
+    def get(self, key: str):
+        try:
+            return self.s3.get_object(Bucket = self.bucket, Key = self.path(key))['Body'].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def list(self, prefix: str):
+        """_The keys of the objects directly below `prefix`._"""
+        keys = []
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket = self.bucket, Prefix = self.path(prefix) + '/',
+                                                                      Delimiter = '/'):
+            keys.extend(i['Key'][len(self.prefix) + 1:] for i in page.get('Contents', []))
+        return keys
+
+    def delete(self, keys: list):
+        for batch in chunked(keys, 1000):
+            self.s3.delete_objects(Bucket = self.bucket,
+                                   Delete = {'Objects': [{'Key': self.path(i)} for i in batch]})
+
+
+class FileSystemStorage:
+    """_Read and write dataset files below a directory of a `pyarrow.fs` filesystem (e.g., `S3FileSystem`)._"""
+    def __init__(self, filesystem, root: str):
+        self.filesystem = filesystem
+        self.root = root.rstrip('/')
+
+    def path(self, key: str):
+        return f'{self.root}/{key}'
+
+    def put(self, key: str, data: bytes):
+        with self.filesystem.open_output_stream(self.path(key)) as f:
+            f.write(data)
+
+    def get(self, key: str):
+        try:
+            with self.filesystem.open_input_stream(self.path(key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix: str):
+        """_The keys of the files directly below `prefix`._"""
+        infos = self.filesystem.get_file_info(fs.FileSelector(self.path(prefix), allow_not_found = True))
+        return [f'{prefix}/{i.base_name}' for i in infos if i.type == fs.FileType.File and not i.base_name.endswith('.tmp')]
+
+    def delete(self, keys: list):
+        for key in keys:
+            try:
+                self.filesystem.delete_file(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+def partition_value(value):
+    """_A path-safe partition value, e.g. a model path becomes its file name without the extension._
+
+    >>> partition_value('data/models/logistic_regression_model.joblib')
+    'logistic_regression_model'
+    >>> partition_value('mean:lr,tree')
+    'mean_lr_tree'
+    """
+    value = os.path.splitext(os.path.basename(str(value)))[0] if str(value).endswith('.joblib') else str(value)
+    return re.sub(r'[^A-Za-z0-9._-]', '_', value) or 'unknown'
+
+
+def _portable(table: pa.Table):
+    """_Cast dictionary and large string columns to plain strings so every file shares one schema._"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), pa.string()))
+    return table
+
+
+class PredictionDataset:
+    """_An append-only Parquet dataset partitioned by run date and model._
+
+    Args:
+        storage (_LocalStorage_ or _S3Storage_): _Where the dataset files are kept._
+
+    >>> import tempfile, pandas as pd
+    >>> dataset = PredictionDataset(LocalStorage(tempfile.mkdtemp()))
+    >>> batch = pd.DataFrame({'doi': ['10.1/a', '10.1/b'], 'predict_proba': [0.9, 0.2], 'prediction': [1, 0],
+    ...                       'model_metadata': 'lr.joblib', 'prediction_date': pd.Timestamp('2024-09-22 10:00')})
+    >>> dataset.append(batch)[0].rsplit('/', 1)[0]
+    'run_date=2024-09-22/model=lr'
+    >>> dataset.num_rows()
+    2
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _fragments(self):
+        return sorted(i for i in self.storage.list(MANIFEST_DIR) if i.endswith('.json'))
+
+    def _commit(self, added: list, removed: list = (), checkpoint: bool = False):
+        """_Write one manifest fragment. Returns its key._"""
+        key = f"{MANIFEST_DIR}/{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}.json"
+        fragment = {'files': list(added), 'removed': list(removed), 'checkpoint': checkpoint,
+                    'written_at': datetime.now(timezone.utc).isoformat()}
+        self.storage.put(key, json.dumps(fragment, indent = 1).encode('utf-8'))
+        return key
+
+    def manifest(self, fragments: list = None):
+        """_The manifest: a dict with a `files` list of `{key, run_date, model, rows, written_at}` entries._"""
+        fragments = self._fragments() if fragments is None else fragments
+        loaded = [json.loads(self.storage.get(i)) for i in fragments]
+        start = max([n for n, i in enumerate(loaded) if i.get('checkpoint')], default = None)
+        files = {}
+        if start is None:
+            legacy = self.storage.get(LEGACY_MANIFEST)
+            files = {i['key']: i for i in (json.loads(legacy)['files'] if legacy is not None else [])}
+            start = 0
+        for fragment in loaded[start:]:
+            for key in fragment['removed']:
+                files.pop(key, None)
+            files.update((i['key'], i) for i in fragment['files'])
+        return {'files': list(files.values())}
+
+    def files(self):
+        """_The keys of every data file, relative to the dataset root._"""
+        return [i['key'] for i in self.manifest()['files']]
+
+    def num_rows(self):
+        return sum(i['rows'] for i in self.manifest()['files'])
+
+    def _write(self, table: pa.Table, run_date: str, model: str):
+        key = f'run_date={run_date}/model={model}/part-{uuid.uuid4().hex}.parquet'
+        buffer = BytesIO()
+        pq.write_table(table, buffer)
+        self.storage.put(key, buffer.getvalue())
+        return {'key': key, 'run_date': run_date, 'model': model, 'rows': table.num_rows,
+                'written_at': datetime.now(timezone.utc).isoformat()}
+
+    def append(self, input_df):
+        """_Write a batch of predictions as new files, one per (run date, model) partition._
+
+        Args:
+            input_df (_pd.DataFrame_ or _pa.Table_): _Predictions with a `model_metadata` and `prediction_date` column._
+
+        Returns:
+            _list_: _The keys of the new files._
+        """
+        table = input_df if isinstance(input_df, pa.Table) else pa.Table.from_pandas(input_df, preserve_index = False)
+        table = _portable(table)
+        if table.num_rows == 0:
+            return []
+        if 'prediction_date' in table.column_names:
+            run_dates = pc.strftime(table.column('prediction_date'), format = '%Y-%m-%d').to_pylist()
+        else:
+            run_dates = [datetime.now().strftime('%Y-%m-%d')] * table.num_rows
+        if 'model_metadata' in table.column_names:
+            values = table.column('model_metadata').to_pylist()
+            labels = {i: partition_value(i) for i in set(values)}
+            models = [labels[i] for i in values]
+        else:
+            models = ['unknown'] * table.num_rows
+        partitions = {}
+        for row, key in enumerate(zip(run_dates, models)):
+            partitions.setdefault(key, []).append(row)
+        written = [self._write(table.take(rows), run_date, model) for (run_date, model), rows in partitions.items()]
+        self._commit(written)
+        return [i['key'] for i in written]
+
+    def compact(self, min_files: int = 8):
+        """_Merge every partition holding at least `min_files` files into a single file, and fold
+        the manifest fragments into one checkpoint.
+
+        The merged files are committed to the manifest before the old files are deleted, and the
+        checkpoint is written before the fragments it replaces are deleted.
+
+        Returns:
+            _int_: _The number of partitions compacted._
+        """
+        fragments = self._fragments()
+        manifest = self.manifest(fragments)
+        partitions = {}
+        for entry in manifest['files']:
+            partitions.setdefault((entry['run_date'], entry['model']), []).append(entry)
+        merged = []
+        removed = []
+        for (run_date, model), entries in partitions.items():
+            if len(entries) < min_files:
+                continue
+            tables = [pq.read_table(BytesIO(self.storage.get(i['key']))) for i in entries]
+            merged.append(self._write(pa.concat_tables(tables, promote_options = 'default'), run_date, model))
+            removed.extend(i['key'] for i in entries)
+        if len(merged) > 0:
+            fragments.append(self._commit(merged, removed))
+            self.storage.delete(sorted(removed))
+        if len(fragments) > 1 or self.storage.get(LEGACY_MANIFEST) is not None:
+            self._commit(self.manifest(fragments)['files'], checkpoint = True)
+            self.storage.delete(fragments + [LEGACY_MANIFEST])
+        return len(merged)
@@ -0,0 +1,140 @@
+"""_Incremental relevance scoring backed by a persistent ledger of predictions._
+
+The ledger records, for every DOI and model, hashes of the model file and of the
+embedding that was scored. A scoring run only predicts rows whose DOI is new,
+whose embedding has changed or that a new (or retrained) model has not scored, so
+a daily run costs time proportional to the new papers rather than the archive.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import joblib
+import numpy as np
+import pandas as pd
+from .batching import chunked
+from .batch_scoring import _load_models, score_embeddings, prediction_table
+from .model_dataset import ModelDataset, embedding_hashes
+
+
+def file_hash(path: str, block_size: int = 1 << 20):
+    """_The SHA-256 hex digest of a file._"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PredictionLedger:
+    """_A sqlite ledger of (doi, model hash, embedding hash) to prediction._
+
+    Args:
+        path (_str_): _The sqlite database file. Parent directories are created if needed._
+
+    >>> ledger = PredictionLedger(':memory:')
+    >>> ledger.record('m1', ['10.1/a'], ['e1'], [0.9], [1], model_metadata = 'model.joblib')
+    >>> ledger.stale('m1', ['10.1/a', '10.1/a', '10.1/b'], ['e1', 'e2', 'e1']).tolist()
+    [False, True, True]
+    """
+    def __init__(self, path: str = 'data/cache/predictions.sqlite'):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS predictions (
+                                  doi TEXT NOT NULL,
+                                  model_hash TEXT NOT NULL,
+                                  embedding_hash TEXT NOT NULL,
+                                  model_metadata TEXT,
+                                  predict_proba REAL NOT NULL,
+                                  prediction INTEGER NOT NULL,
+                                  prediction_date TEXT NOT NULL,
+                                  PRIMARY KEY (doi, model_hash))""")
+
+    def stale(self, model_hash: str, dois: list, hashes: list):
+        """_A boolean mask of the rows that `model_hash` has not scored with the given embedding._"""
+        dois = np.asarray(dois, dtype = object)
+        previous = {}
+        with self._lock:
+            # Only look up the DOIs being scored, not every row the model has scored.
+            for batch in chunked(sorted(set(dois)), 500):
+                query = f"SELECT doi, embedding_hash FROM predictions WHERE model_hash = ? AND doi IN ({','.join('?' * len(batch))})"
+                previous.update(self._conn.execute(query, [model_hash, *batch]))
+        return np.array([previous.get(i) for i in dois], dtype = object) != np.asarray(hashes, dtype = object)
+
+    def record(self, model_hash: str, dois: list, hashes: list, predict_proba: list, prediction: list,
+               model_metadata: str = None, prediction_date = None):
+        """_Store (or replace) predictions made by `model_hash`._"""
+        prediction_date = str(pd.Timestamp.now() if prediction_date is None else pd.Timestamp(prediction_date))
+        with self._lock, self._conn:
+            self._conn.executemany("""INSERT OR REPLACE INTO predictions
+                                      (doi, model_hash, embedding_hash, model_metadata, predict_proba, prediction, prediction_date)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                   zip(dois, [model_hash] * len(dois), hashes, [model_metadata] * len(dois),
+                                       map(float, predict_proba), map(int, prediction), [prediction_date] * len(dois)))
+
+    def results(self, model_hash: str = None):
+        """_The current predictions, for one model or all of them, as a DataFrame._"""
+        query = "SELECT doi, predict_proba, prediction, model_metadata, prediction_date, model_hash FROM predictions"
+        params = ()
+        if model_hash is not None:
+            query, params = query + " WHERE model_hash = ?", (model_hash,)
+        with self._lock:
+            result = pd.read_sql_query(query, self._conn, params = params)
+        return result.assign(prediction_date = pd.to_datetime(result['prediction_date']))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def incremental_predict(data: ModelDataset,
+                        models,
+                        ledger: PredictionLedger = None,
+                        predictThld: float = 0.5,
+                        chunk_size: int = 4096):
+    """_Score only the papers whose embedding, or model, has changed since the last run._
+
+    Args:
+        data (_ModelDataset_): _The papers to score, e.g. from `load_model_dataset()`._
+        models (_str_, _list_ or _dict_): _Paths to joblib models, fitted estimators, or a dict of `{name: model}`._
+        ledger (_PredictionLedger_): _The ledger of earlier predictions. Defaults to `data/cache/predictions.sqlite`._
+        predictThld (_float_): _The probability at or above which a paper is predicted relevant._
+        chunk_size (_int_): _The number of rows passed to `predict_proba` at once._
+
+    Returns:
+        _pd.DataFrame_: _The new predictions only, in `batch_scoring.PREDICTION_SCHEMA`, ready to be
+            appended to the prediction dataset with `predToPQ()`. A paper that is re-scored gets a newer
+            `prediction_date`, and `loadPQ()` returns only the latest prediction for each paper and model.
+            `ledger.results()` holds the full, current set._
+    """
+    if ledger is None:
+        ledger = PredictionLedger()
+    if isinstance(models, str) or not isinstance(models, (list, tuple, dict)):
+        models = [models]
+    sources = list(models.values()) if isinstance(models, dict) else models
+    loaded = _load_models(models)
+    # Datasets from an EmbeddingStore carry the hashes computed when each row was stored.
+    hashes = data.hashes if data.hashes is not None else embedding_hashes(data.embeddings)
+    results = []
+    for source, (name, model_object) in zip(sources, loaded):
+        model_hash = file_hash(source) if isinstance(source, str) and os.path.isfile(source) else joblib.hash(model_object)
+        stale = np.flatnonzero(ledger.stale(model_hash, data.dois, hashes))
+        if len(stale) == 0:
+            continue
+        scored = score_embeddings(data.embeddings[stale], data.dois[stale], {name: model_object},
+                                  chunk_size = chunk_size, predictThld = predictThld).to_pandas()
+        ledger.record(model_hash, data.dois[stale], hashes[stale],
+                      scored['predict_proba'], scored['prediction'],
+                      model_metadata = name, prediction_date = scored['prediction_date'].iloc[0])
+        results.append(scored)
+    if len(results) == 0:
+        return prediction_table([], [], [], []).to_pandas()
+    return pd.concat(results, ignore_index = True)
@@ -0,0 +1,60 @@
+"""_A thread-safe token bucket for rate limiting calls to external APIs._
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """_Allow at most `rate` calls per second, with bursts of up to `capacity` calls._
+
+    Args:
+        rate (_float_): _Tokens added to the bucket per second._
+        capacity (_float_): _The maximum number of tokens held. Defaults to `rate`, and is never
+            less than one token, so rates below one call per second still hand out tokens._
+
+    >>> bucket = TokenBucket(rate = 100, capacity = 2)
+    >>> bucket.acquire(), bucket.acquire()
+    (0.0, 0.0)
+    >>> bucket.acquire() > 0
+    True
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """_Take a token, blocking until one is available. Returns the time spent waiting, in seconds._"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate: float, capacity: float = None):
+        """_Change the rate (e.g., from server rate limit headers) without discarding the tokens already held._"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = max(capacity or rate, 1)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds: float):
+        """_Stop handing out tokens for `seconds` seconds (e.g., after a `Retry-After` response)._"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
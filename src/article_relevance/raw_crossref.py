@@ -1,46 +1,234 @@
 """_Management of CrossRef inputs and outputs._
 """
 
-from itertools import chain
 import json
+import os
+import threading
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+import time
 import unicodedata
 import boto3
 import requests
-import re
-from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
 import base64
+from .rate_limit import TokenBucket
+from .crossref_cache import CrossRefCache
 
-def pull_crossref(doi):
+CROSSREF_HEADERS = {
+    'User-Agent': 'Neotoma Publication Checker [https://github.com/NeotomaDB/article-relevance]',
+    'From': 'goring@wisc.edu'}
+
+def normalize_doi(doi: str):
+    """_Normalize a DOI's unicode representation and strip trailing whitespace._
+
+    >>> normalize_doi('10.1000/abc ')
+    '10.1000/abc'
+    """
+    return unicodedata.normalize('NFKD', doi).rstrip()
+
+def doi_to_key(doi: str, prefix: str = 'dois/'):
+    """_The S3 object key used to store the CrossRef record for a DOI._
+
+    >>> doi_to_key('10.1000/abc ')
+    'dois/MTAuMTAwMC9hYmM=.json'
+    """
+    return prefix + base64.urlsafe_b64encode(str.encode(normalize_doi(doi))).decode('utf-8') + '.json'
+
+class S3KeyIndex:
+    """_A set of the object keys stored under an S3 prefix, optionally persisted as a local manifest._
+
+    Listing the `dois/` prefix pages through every object in the bucket. When a `manifest`
+    path is given the key set is written to disk, along with the time of the last full listing.
+    Later runs load the manifest and only re-list the bucket once it is older than `max_age`
+    seconds; keys uploaded in the meantime are added to the index as they are written.
+
+    Args:
+        s3 (_boto3.client_): _An S3 client._
+        bucket (_str_): _The bucket name._
+        prefix (_str_): _The key prefix to index._
+        manifest (_str_): _An optional path for the local manifest file._
+        max_age (_float_): _The age, in seconds, after which the manifest is refreshed with a full listing._
+    """
+    def __init__(self, s3, bucket: str, prefix: str = 'dois', manifest: str = None, max_age: float = 86400):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.manifest = manifest
+        self.max_age = max_age
+        self.keys = set()
+        self.listed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """_Rebuild the index from a full listing of the bucket prefix._"""
+        keys = set()
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket = self.bucket, Prefix = self.prefix):
+            if page.get('KeyCount', 0) > 0:
+                keys.update(i.get('Key') for i in page.get('Contents'))
+        with self._lock:
+            self.keys = keys
+            self.listed_at = time.time()
+        return self
+
+    def load(self):
+        """_Load the index from the manifest, re-listing the bucket if the manifest is missing, stale or for another bucket._"""
+        if self.manifest is not None and os.path.exists(self.manifest):
+            with open(self.manifest, 'r', encoding = 'UTF-8') as f:
+                stored = json.load(f)
+            if (stored.get('bucket') == self.bucket and stored.get('prefix') == self.prefix
+                    and time.time() - stored.get('listed_at', 0) < self.max_age):
+                self.keys = set(stored.get('keys', []))
+                self.listed_at = stored.get('listed_at')
+                return self
+        self.refresh()
+        self.save()
+        return self
+
+    def save(self):
+        """_Write the index to the manifest file (if one was given), replacing it atomically._"""
+        if self.manifest is None:
+            return None
+        with self._lock:
+            stored = {'bucket': self.bucket,
+                      'prefix': self.prefix,
+                      'listed_at': self.listed_at,
+                      'keys': sorted(self.keys)}
+        tmp_file = self.manifest + '.tmp'
+        with open(tmp_file, 'w', encoding = 'UTF-8') as f:
+            json.dump(stored, f)
+        os.replace(tmp_file, self.manifest)
+        return None
+
+    def add(self, key: str):
+        with self._lock:
+            self.keys.add(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+def retry_after(headers, default: float = 1.0):
+    """_The number of seconds to wait from a `Retry-After` header, given in seconds or as an HTTP date._
+
+    >>> retry_after({'Retry-After': '3'})
+    3.0
+    >>> retry_after({}, default = 2)
+    2
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max((retry_at - datetime.now(tz = retry_at.tzinfo)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return default
+
+def update_rate_limit(limiter: TokenBucket, headers):
+    """_Match a token bucket to CrossRef's `X-Rate-Limit-Limit` and `X-Rate-Limit-Interval` headers._
+
+    >>> bucket = TokenBucket(rate = 5)
+    >>> update_rate_limit(bucket, {'X-Rate-Limit-Limit': '50', 'X-Rate-Limit-Interval': '1s'})
+    >>> bucket.rate
+    50.0
+    """
+    limit = headers.get('X-Rate-Limit-Limit')
+    interval = headers.get('X-Rate-Limit-Interval')
+    if limit is None or interval is None:
+        return None
+    try:
+        rate = float(limit) / float(interval.rstrip('s'))
+    except ValueError:
+        return None
+    if rate > 0 and rate != limiter.rate:
+        limiter.set_rate(rate)
+    return None
+
+def pull_crossref(doi, session = None, limiter: TokenBucket = None, max_retries: int = 3,
+                  cache: CrossRefCache = None):
     """_Pull a record from the CrossRef API and return the unstructured JSON,_
     Args:
         doi (_string_): _A DOI object._
+        session (_requests.Session_): _An optional session, so connections can be reused between calls._
+        limiter (_TokenBucket_): _An optional rate limiter shared by all threads calling CrossRef._
+        max_retries (_int_): _The number of retries for connection errors, timeouts, rate limited (429) and server error (5xx) responses._
+        cache (_CrossRefCache_): _An optional local cache, checked before calling CrossRef. Records that parse as JSON and
+                                  DOIs CrossRef does not know (404) are added to the cache; failures are not._
     Returns:
         _object_: _The JSON response from CrossRef, or an smaller JSON object
                    with the exception embedded._
     """
-    try:
-        response = requests.get(f"https://api.crossref.org/works/{doi}",
-                                            timeout = (10,10),
-                                            headers = {
-                        'User-Agent': 'Neotoma Publication Checker [https://github.com/NeotomaDB/article-relevance]',
-                        'From': 'goring@wisc.edu'})
-        response_json = response.json()
-    except Exception as e:
-        response_json = {'status': 'failure',
-                         'message': {'DOI': doi, 
-                                     'exception': str(e), 
-                                     'date': str(datetime.now())}}
-    return response_json
-
-
-def raw_crossref(doi_list, metadata_store, verbose = False):
+    if cache is not None:
+        cached = cache.get(doi)
+        if cached is not None:
+            return cached
+    http = session or requests
+
+    def failure(e):
+        return {'status': 'failure',
+                'message': {'DOI': doi,
+                            'exception': str(e),
+                            'date': str(datetime.now())}}
+
+    def backoff(wait):
+        if limiter is not None:
+            limiter.pause(wait)
+        else:
+            time.sleep(wait)
+
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = http.get(f"https://api.crossref.org/works/{doi}",
+                                timeout = (10,10),
+                                headers = CROSSREF_HEADERS)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Transport errors are retried like rate limits and server errors, but never cached.
+            if attempt < max_retries:
+                backoff(2 ** attempt)
+                continue
+            return failure(e)
+        except Exception as e:
+            return failure(e)
+        if limiter is not None:
+            update_rate_limit(limiter, response.headers)
+        if (response.status_code == 429 or response.status_code >= 500) and attempt < max_retries:
+            backoff(retry_after(response.headers, default = 2 ** attempt))
+            continue
+        try:
+            response_json = response.json()
+        except ValueError as e:
+            response_json = failure(e)
+            # Only a parsed record or a definite 404 is worth keeping; anything else is retried on the next run.
+            if cache is not None and response.status_code == 404:
+                cache.put(doi, response_json, status = 404)
+            return response_json
+        if cache is not None and response.status_code in (200, 404):
+            cache.put(doi, response_json, status = response.status_code)
+        return response_json
+
+def raw_crossref(doi_list, metadata_store, verbose = False, workers: int = 8, rate: float = 10,
+                 manifest: str = None, max_age: float = 86400, cache: CrossRefCache = None):
     """
     Extract raw Crossref JSON responses from the CrossRef API and push them to an S3 bucket
     If a DOI is not found on CrossRef, the DOI will be stored as a file with an empty JSON response.
     Args:
         doi_list (list): A list of DOIs
         metadata_bucket (s3_object): The bucket into which all DOI JSON outputs should go.
+        workers (int): The number of DOIs fetched from CrossRef and uploaded to S3 concurrently.
+        rate (float): The initial limit on CrossRef requests per second, updated from CrossRef's rate limit headers.
+        manifest (str): An optional local file used to persist the index of DOI objects already in S3.
+        max_age (float): The age, in seconds, after which the manifest is refreshed from a full S3 listing.
+        cache (CrossRefCache): An optional local cache of CrossRef responses. Cached DOIs missing from S3 are uploaded without calling CrossRef.
     Return:
         pandas Dataframe containing CrossRef metadata.
     """
@@ -49,41 +237,40 @@ def raw_crossref(doi_list, metadata_store, verbose = False):
     # Third, for those that don't exist, pull the CrossRef metadata.
     s3 = boto3.client('s3')
     # First find what DOIs we have in S3 as raw metadata:
-    doi_stores = []
-    doi_processed = []
-    paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket = metadata_store['Bucket'], Prefix='dois')
-    for page in pages:
-        if page.get('KeyCount') > 0:
-        # These are the DOIs that are already uploaded.
-            doi_stores.append([i.get('Key') for i in page.get('Contents')])
-    recovered_dois = list(chain(*doi_stores))
-    print(f'DOI metadata exists for {len(recovered_dois)} records.')
-    to_process = [i
-                  for i in doi_list
-                  if 'dois/' + base64.urlsafe_b64encode(str.encode(i)).decode('utf-8') + '.json'
-                  not in recovered_dois]
+    index = S3KeyIndex(s3, metadata_store['Bucket'], prefix = 'dois', manifest = manifest, max_age = max_age).load()
+    print(f'DOI metadata exists for {len(index)} records.')
+    # One DOI per object key, so duplicate DOIs are only fetched once.
+    requested = {doi_to_key(i): i for i in doi_list if i is not None}
+    to_process = [doi for key, doi in requested.items() if key not in index]
     print(f'Fetching DOI metadata for {len(to_process)} records.')
-    for doi in to_process:
-        # Look for a file, if it's not there then poll the CrossRef API
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections = workers, pool_maxsize = workers))
+    limiter = TokenBucket(rate = rate)
+
+    def harvest(doi):
+        # Poll the CrossRef API for a DOI with no file in the index.
         # If the API returns a valid response then write out the JSON response
         # If the API does not return a valid response then return an empty object
-        if doi is not None:
-            doi_processed.append(doi)
-            doi = unicodedata.normalize('NFKD', doi).rstrip()
-            filename = 'dois/' + base64.urlsafe_b64encode(str.encode(doi)).decode('utf-8') + '.json'
-            newlist = [i for i in recovered_dois if i == filename]
-            if len(newlist) == 0:
-                if verbose:
-                    print('Upload')
-                    print('Polling CrossRef for object metadata.')
-                response_json = pull_crossref(doi)
-                if verbose:
-                    if response_json['status'] == 'failure':
-                        print(f'No findable DOI data for {doi}.')
-                    else:
-                        print(f'Recovered DOI metadata for {doi}.')
-                s3.put_object(Body=json.dumps(response_json),
-                            Bucket = metadata_store['Bucket'],
-                            Key = filename)
-    return doi_processed
+        filename = doi_to_key(doi)
+        doi = normalize_doi(doi)
+        if verbose:
+            print('Upload')
+            print('Polling CrossRef for object metadata.')
+        response_json = pull_crossref(doi, session = session, limiter = limiter, cache = cache)
+        if verbose:
+            if response_json['status'] == 'failure':
+                print(f'No findable DOI data for {doi}.')
+            else:
+                print(f'Recovered DOI metadata for {doi}.')
+        s3.put_object(Body=json.dumps(response_json),
+                    Bucket = metadata_store['Bucket'],
+                    Key = filename)
+        index.add(filename)
+
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            # list() re-raises any exception from the worker threads.
+            list(executor.map(harvest, to_process))
+    finally:
+        index.save()
+    return to_process
@@ -1,27 +1,27 @@
 from io import BytesIO
 import pandas as pd
 from .clean_dois import clean_dois
+from .batching import chunked
 from .logs import get_logger
 from .raw_crossref import pull_crossref
-import requests
+from .api_client import get_client
+from .embedding_codec import embedding_to_wire
 from requests.exceptions import ReadTimeout
-import os
 import json
 
-def register_embedding(embedding_dict):
+def register_embedding(embedding_dict, encoding: str = 'float32'):
     try:
-        outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/doi/embeddings',
-                    data = {'data': json.dumps(embedding_dict, default=str)},
-                    timeout = 10)
+        outcome = get_client().post('/v0.1/doi/embeddings',
+                                    data = {'data': json.dumps(embedding_to_wire(embedding_dict, encoding), default=str)})
         if json.loads(outcome.content).get('status', 0) == 'success':
-            print(f'Added {embedding_dict.get('model')} embeddings for doi: {embedding_dict.get('doi')}')
+            print(f"Added {embedding_dict.get('model')} embeddings for doi: {embedding_dict.get('doi')}")
         else:
-            print(f'Failed for: {embedding_dict.get('doi')}\n{json.loads(outcome.content).get('message',None)}')
+            print(f"Failed for: {embedding_dict.get('doi')}\n{json.loads(outcome.content).get('message',None)}")
     except ReadTimeout as e:
-        print(f'Connection failed for DOI {embedding_dict.get('doi')}:')
+        print(f"Connection failed for DOI {embedding_dict.get('doi')}:")
         print(e)
     except Exception as e:
-        print(f'General failure for DOI {embedding_dict.get('doi')}:')
+        print(f"General failure for DOI {embedding_dict.get('doi')}:")
         print(e)
 
 def register_project(project:str, notes:str):
@@ -36,9 +36,8 @@ def register_project(project:str, notes:str):
     >>> test_register = ar.register_project("A test project", "An attempt to test.")
     """    
     try:
-        outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/projects',
-                            data = {'data': json.dumps({'project': project, 'projectnotes': notes})},
-                            timeout = 10)
+        outcome = get_client().post('/v0.1/projects',
+                                    data = {'data': json.dumps({'project': project, 'projectnotes': notes})})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -62,9 +61,8 @@ def register_person(orcid:str):
         _type_: _description_
     """    
     try:
-        outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/people',
-                            data = {'data': json.dumps({'person': orcid})},
-                            timeout = 10)
+        outcome = get_client().post('/v0.1/people',
+                                    data = {'data': json.dumps({'person': orcid})})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -81,9 +79,8 @@ def register_person(orcid:str):
 
 def register_label(label, project):
     try:
-        outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/labels',
-                            data = {'data': json.dumps({'project': project, 'label': label})},
-                            timeout = 10)
+        outcome = get_client().post('/v0.1/labels',
+                                    data = {'data': json.dumps({'project': project, 'label': label})})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -99,9 +96,8 @@ def register_label(label, project):
 
 def register_paper_label(doi, label, project, orcid):
     try:
-        outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/doi/labels',
-                            data = {'data': json.dumps({'project': project.strip(), 'label': label.strip(), 'doi': doi.strip(), 'orcid': orcid.strip()})},
-                            timeout = 10)
+        outcome = get_client().post('/v0.1/doi/labels',
+                                    data = {'data': json.dumps({'project': project.strip(), 'label': label.strip(), 'doi': doi.strip(), 'orcid': orcid.strip()})})
         if outcome.status_code == 200:
             call_output = json.loads(outcome.content).get('data')
             if call_output is None:
@@ -151,7 +147,7 @@ def register_dois(dois: list, verbose: bool = True):
         return valid_doi
     else:
         if verbose:
-            print(f'{len(cleaned_entries.get('clean')) + len(cleaned_entries.get('removed'))} unique DOIs submitted.')
+            print(f"{len(cleaned_entries.get('clean')) + len(cleaned_entries.get('removed'))} unique DOIs submitted.")
             print(f'{len(valid_doi)} DOIs valid.')
         bodydata = [{'doi': i} for i in valid_doi]
         badapi = []
@@ -160,20 +156,19 @@ def register_dois(dois: list, verbose: bool = True):
         
     for i in bodydata:
         try:
-            outcome = requests.post('http://' + os.environ['API_HOME'] + '/v0.1/doi',
-                        data = {'data': [json.dumps(i)]},
-                        timeout = 10)
+            outcome = get_client().post('/v0.1/doi',
+                                        data = {'data': [json.dumps(i)]})
             if json.loads(outcome.content).get('data', 0) != 0:
                 if verbose:
-                    print(f'Added doi: {i.get('doi')}')
+                    print(f"Added doi: {i.get('doi')}")
                 goodapi.append(i)
             elif json.loads(outcome.content).get('message', 'oops') == "DOI already present.":
                 if verbose:
-                    print(f'doi was present: {i.get('doi')}')
+                    print(f"doi was present: {i.get('doi')}")
                 presentapi.append(i)
             else:
                 if verbose:
-                    print(f'Failed for: {i.get('doi')}\n{json.loads(outcome.content).get('message',None)}')
+                    print(f"Failed for: {i.get('doi')}\n{json.loads(outcome.content).get('message',None)}")
         except ReadTimeout as e:
             print(f'Connection failed for DOI {i}:')
             print(e)
@@ -190,6 +185,98 @@ def register_dois(dois: list, verbose: bool = True):
             'inserted': goodapi,
             'present': presentapi}
 
+def _register_bulk(endpoint: str, records: list, batch_size: int):
+    """_POST records to an endpoint in batches, returning one result per record, in order._
+
+    The API returns a list in `data` with a `status` (`inserted`, `present` or `failed`) and
+    `message` for each submitted record. If a batch fails as a whole every record in it is `failed`,
+    as is every record the response has no status for (a missing or short `data` list).
+    """
+    results = []
+    for batch in chunked(records, batch_size):
+        try:
+            outcome = get_client().post(endpoint,
+                                        data = {'data': json.dumps(batch, default=str)})
+            content = json.loads(outcome.content)
+            item_status = content.get('data')
+            if not isinstance(item_status, list):
+                item_status = []
+            item_status = [{'status': j.get('status', 'failed'), 'message': j.get('message')} for j in item_status[:len(batch)]]
+            message = content.get('message') or 'The API returned no status for this record.'
+            results.extend(item_status + [{'status': 'failed', 'message': message} for _ in batch[len(item_status):]])
+        except ReadTimeout as e:
+            print(f'Connection failed for a batch of {len(batch)} records:')
+            print(e)
+            results.extend([{'status': 'failed', 'message': str(e)} for _ in batch])
+        except Exception as e:
+            print(f'General exception for a batch of {len(batch)} records:')
+            print(e)
+            results.extend([{'status': 'failed', 'message': str(e)} for _ in batch])
+    return [dict(j, doi = i.get('doi')) for i, j in zip(records, results)]
+
+def register_dois_bulk(dois: list, batch_size: int = 500, verbose: bool = True):
+    """_Insert each unique DOI, sending `batch_size` DOIs per request. Do not replace existing DOIs._
+
+    Args:
+        dois (_list_): _A list of DOIs_
+        batch_size (_int_): _The number of DOIs sent in each request._
+        verbose (_bool_): _Print a summary of the submission._
+
+    Returns:
+        _obj_: _An object with properties `submitted`, `rejected`, `inserted` and `present`, as for `register_dois()`._
+    """
+    cleaned_entries = clean_dois(dois)
+    valid_doi = cleaned_entries.get('clean')
+    if len(valid_doi) == 0:
+        if verbose:
+            print("No valid DOIs in the submitted set of values.")
+        return valid_doi
+    bodydata = [{'doi': i} for i in valid_doi]
+    results = _register_bulk('/v0.1/doi', bodydata, batch_size)
+    outcome = {'submitted': bodydata,
+               'rejected': [{'doi': i['doi']} for i in results if i['status'] == 'failed'],
+               'inserted': [{'doi': i['doi']} for i in results if i['status'] == 'inserted'],
+               'present': [{'doi': i['doi']} for i in results if i['status'] == 'present']}
+    if verbose:
+        print(f"{len(valid_doi) + len(cleaned_entries.get('removed'))} unique DOIs submitted.")
+        print(f"{len(valid_doi)} DOIs valid.")
+        print(f"{len(outcome['inserted'])} DOIs added, {len(outcome['present'])} already present, {len(outcome['rejected'])} failed.")
+    return outcome
+
+def register_paper_labels_bulk(labellist: list, project: str, batch_size: int = 500):
+    """_Label many papers, sending `batch_size` labels per request._
+
+    Args:
+        labellist (_list_): _A list of dict objects containing the keys `label`, `person` and `doi`._
+        project (_str_): _A valid project name in the database._
+        batch_size (_int_): _The number of labels sent in each request._
+
+    Returns:
+        _list_: _One dict per label with the keys `doi`, `status` and `message`._
+    """
+    records = [{'project': project.strip(),
+                'label': i.get('label').strip(),
+                'doi': i.get('doi').strip(),
+                'orcid': i.get('person').strip()} for i in labellist]
+    return _register_bulk('/v0.1/doi/labels', records, batch_size)
+
+def register_embeddings_bulk(embedding_dicts: list, batch_size: int = 100, encoding: str = 'float32'):
+    """_Register many embeddings, sending `batch_size` embeddings per request._
+
+    Args:
+        embedding_dicts (_list_): _A list of embedding dicts, as returned by `add_embeddings()`._
+        batch_size (_int_): _The number of embeddings sent in each request._
+        encoding (_str_): _Embeddings are sent as base64 `float32` or `float16` buffers._
+
+    Returns:
+        _list_: _One dict per embedding with the keys `doi`, `status` and `message`._
+    """
+    records = [embedding_to_wire(i, encoding) for i in embedding_dicts]
+    results = _register_bulk('/v0.1/doi/embeddings', records, batch_size)
+    failed = [i for i in results if i['status'] == 'failed']
+    print(f'Added embeddings for {len(results) - len(failed)} of {len(results)} DOIs.')
+    return results
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
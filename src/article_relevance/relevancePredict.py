@@ -1,7 +1,7 @@
-import pandas as pd
-import joblib
 from .logs import get_logger
-from datetime import datetime
+from .model_registry import get_classifier
+from .model_dataset import ModelDataset
+from .batch_scoring import score_embeddings, prediction_table
 
 logger = get_logger(__name__)
 
@@ -15,26 +15,31 @@ def relevancePredict(processedDF,
     Return the resulting dataframe.
 
     Args:
-        processedDF (pd DataFrame): Input data frame. 
-        modelPath (str): Directory to trained model object.
+        processedDF (pd DataFrame or ModelDataset): Input data frame, or a dataset from `load_model_dataset()`.
+        model (str): Path to the trained joblib model object. Models are loaded once per process and reused between calls.
+        predictThld (float): The probability at or above which a paper is predicted relevant.
 
     Returns:
-        pd DataFrame with prediction and predict_proba added.
+        pd DataFrame of doi, predict_proba (float32), prediction (int8), model_metadata and prediction_date, the same
+        for either input (see `batch_scoring.PREDICTION_SCHEMA`). The input is not modified.
     """
     #logger.info(f'Prediction start.')
     try:
-        model_object = joblib.load(model)
+        model_object = get_classifier(model)
     except OSError:
         #logger.error("Model for article relevance not found.")
         raise(FileNotFoundError)
     model_name = model
     #logger.info(f"Running prediction for {processedDF.shape[0]} articles.")
     # Use the loaded model for prediction on a new dataset
-    processedDF.loc[:, 'predict_proba'] = model_object.predict_proba(processedDF)[:, 1]
-    processedDF.loc[(processedDF['predict_proba']>= predictThld), 'prediction'] = 1
-    processedDF.loc[(processedDF['predict_proba']< predictThld), 'prediction'] = 0
-    predictionsDF = processedDF[['doi', 'predict_proba', 'prediction']]
-    predictionsDF = predictionsDF.assign(model_metadata = model_name)
-    predictionsDF = predictionsDF.assign(prediction_date = datetime.now())
+    if isinstance(processedDF, ModelDataset):
+        return score_embeddings(processedDF.embeddings, processedDF.dois,
+                                models = {model_name: model_object},
+                                predictThld = predictThld).to_pandas()
+    # Build a new frame rather than writing back into the caller's data.
+    predict_proba = model_object.predict_proba(processedDF)[:, 1]
+    predictionsDF = prediction_table(processedDF['doi'].to_numpy(), predict_proba,
+                                     predict_proba >= predictThld, model_name).to_pandas()
+    predictionsDF.index = processedDF.index
     #logger.info(f'Prediction completed.')
     return predictionsDF
@@ -5,27 +5,34 @@ from sklearn.pipeline import make_pipeline
 from sklearn.impute import SimpleImputer
 from sklearn.model_selection import RandomizedSearchCV
 from sklearn.metrics import make_scorer, recall_score, f1_score, precision_score, accuracy_score
+from .model_dataset import ModelDataset
 
 def relevancePredictTrain(x_train, y_train, classifiers):
     """
-    x_train
+    x_train                         pd.DataFrame with embedding_* and doi columns, or a ModelDataset
     y_train
     classifiers (list of tuples)    List of tuples with the classifiers to try and their param grids
     """
 
-    # Making sure x_train contains only required columns
-    selected_columns = [col for col in x_train.columns if col.startswith('embedding')]
-    selected_columns = selected_columns + ['doi']
+    print("Setting up features")
+    if isinstance(x_train, ModelDataset):
+        # The embedding matrix is passed to the model directly, there is no DOI column to drop.
+        x_train = x_train.embeddings
+        preprocessing = []
+    else:
+        # Making sure x_train contains only required columns
+        selected_columns = [col for col in x_train.columns if col.startswith('embedding')]
+        selected_columns = selected_columns + ['doi']
 
-    x_train = x_train[selected_columns]
+        x_train = x_train[selected_columns]
 
-    # Processing of Elements that need fit-transform
-    print("Setting up features")
-    preprocessor = ColumnTransformer(
-        transformers = [
-            ('doi', 'drop', ['doi'])],
-        remainder = "passthrough"
-    )
+        # Processing of Elements that need fit-transform
+        preprocessor = ColumnTransformer(
+            transformers = [
+                ('doi', 'drop', ['doi'])],
+            remainder = "passthrough"
+        )
+        preprocessing = [preprocessor]
     # Define the metrics you want to capture
     classification_metrics = {
         'recall': make_scorer(recall_score),
@@ -47,7 +54,7 @@ def relevancePredictTrain(x_train, y_train, classifiers):
         print(f"Training {classifier_name}.")
         # Define the preprocessing pipeline
         pipeline = make_pipeline(
-            preprocessor,
+            *preprocessing,
             SimpleImputer(strategy='constant', fill_value=0), # In case there's NaNs
             classifier
         )
@@ -0,0 +1,172 @@
+"""_A persistent index of article IDs (e.g., xDD gddids) that have already been ingested._
+
+IDs are stored in a sqlite table. A Bloom filter, kept as a NumPy bit array and
+saved in the same database, sits in front of it: an ID the filter has never
+seen is known to be new without touching the table, so checking a page of
+mostly-new articles costs a few hashes per ID. Only the rare filter hits are
+confirmed against sqlite.
+
+The filter is saved to the database by `flush()` (and `close()`), not on every
+`add()`, so recording IDs page by page does not rewrite the whole bit array each
+time. A filter that was not saved is rebuilt from the table on the next open.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import numpy as np
+from .batching import chunked
+
+
+class BloomFilter:
+    """_A Bloom filter over strings backed by a NumPy bit array._
+
+    Args:
+        capacity (_int_): _The number of items the filter is sized for._
+        error_rate (_float_): _The false positive rate at `capacity` items._
+
+    >>> bloom = BloomFilter(capacity = 100)
+    >>> bloom.add(['a', 'b'])
+    >>> bloom.contains(['a', 'c']).tolist()
+    [True, False]
+    """
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001, bits = None):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.n_bits = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.n_hashes = max(int(round(self.n_bits / self.capacity * math.log(2))), 1)
+        if bits is None:
+            bits = np.zeros((self.n_bits + 7) // 8, dtype = np.uint8)
+        self.bits = bits
+
+    def _positions(self, keys):
+        """_The bit positions for each key, using double hashing of a 128-bit BLAKE2b digest._"""
+        digests = b''.join(hashlib.blake2b(str(i).encode('utf-8'), digest_size = 16).digest() for i in keys)
+        hashes = np.frombuffer(digests, dtype = '<u8').reshape(-1, 2)
+        steps = np.arange(self.n_hashes, dtype = np.uint64)
+        return (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.n_bits)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def contains(self, keys):
+        """_A boolean array: False means the key was never added, True means it probably was._"""
+        if len(keys) == 0:
+            return np.zeros(0, dtype = bool)
+        positions = self._positions(keys)
+        found = self.bits[positions >> np.uint64(3)] & np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return found.all(axis = 1)
+
+
+class SeenIDIndex:
+    """_A sqlite-backed set of IDs with a Bloom filter front._
+
+    Args:
+        path (_str_): _The sqlite database file. Parent directories are created if needed._
+        capacity (_int_): _The initial Bloom filter size; the filter is rebuilt at twice the size when exceeded._
+        error_rate (_float_): _The Bloom filter false positive rate._
+
+    >>> index = SeenIDIndex(':memory:')
+    >>> index.mark_seen(['gdd1', 'gdd2'])
+    >>> index.contains(['gdd2', 'gdd3']).tolist(), len(index)
+    ([True, False], 2)
+    """
+    def __init__(self, path: str = 'data/cache/seen_gddids.sqlite', capacity: int = 1_000_000, error_rate: float = 0.001):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS bloom (id INTEGER PRIMARY KEY CHECK (id = 0), capacity INTEGER, items INTEGER, bits BLOB)")
+            stored = self._conn.execute("SELECT capacity, items, bits FROM bloom").fetchone()
+            count = self._conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+        self._count = count
+        self._dirty = False
+        if stored is not None and stored[1] == count:
+            self.bloom = BloomFilter(stored[0], error_rate, bits = np.frombuffer(stored[2], dtype = np.uint8).copy())
+        else:
+            # The saved filter is missing or out of date, rebuild it from the table.
+            self._rebuild(max(capacity, 2 * count))
+
+    def _rebuild(self, capacity: int):
+        self.bloom = BloomFilter(capacity, self.error_rate)
+        cursor = self._conn.execute("SELECT id FROM seen")
+        while True:
+            rows = cursor.fetchmany(100_000)
+            if not rows:
+                break
+            self.bloom.add([i[0] for i in rows])
+        self._dirty = True
+
+    def _save_bloom(self):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO bloom (id, capacity, items, bits) VALUES (0, ?, ?, ?)",
+                               (self.bloom.capacity, self._count, self.bloom.bits.tobytes()))
+        self._dirty = False
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return bool(self.contains([key])[0])
+
+    def contains(self, ids):
+        """_A boolean array marking the IDs that have been seen._"""
+        ids = [str(i) for i in ids]
+        result = self.bloom.contains(ids)
+        candidates = [ids[i] for i in np.flatnonzero(result)]
+        if len(candidates) == 0:
+            return result
+        confirmed = set()
+        with self._lock:
+            for batch in chunked(sorted(set(candidates)), 500):
+                query = f"SELECT id FROM seen WHERE id IN ({','.join('?' * len(batch))})"
+                confirmed.update(i[0] for i in self._conn.execute(query, batch))
+        result[result] = [i in confirmed for i in candidates]
+        return result
+
+    def filter_new(self, ids):
+        """_The IDs that have not been seen, in their original order._"""
+        ids = list(ids)
+        return [i for i, seen in zip(ids, self.contains(ids)) if not seen]
+
+    def add(self, ids):
+        """_Record IDs as seen. The Bloom filter is updated in memory and saved by `flush()`._"""
+        ids = [str(i) for i in ids]
+        if len(ids) == 0:
+            return None
+        with self._lock:
+            changes = self._conn.total_changes
+            with self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO seen (id) VALUES (?)", ((i,) for i in ids))
+            self._count += self._conn.total_changes - changes
+            if self._count > self.bloom.capacity:
+                self._rebuild(2 * self._count)
+            else:
+                self.bloom.add(ids)
+                self._dirty = True
+        return None
+
+    def flush(self):
+        """_Save the Bloom filter if IDs were added since it was last saved._"""
+        with self._lock:
+            if self._dirty:
+                self._save_bloom()
+        return None
+
+    def mark_seen(self, ids):
+        """_Record IDs as seen and save the filter. Call once the articles they belong to have been stored,
+        e.g. with the `gddid` column returned by `gddQuery()`._"""
+        self.add(ids)
+        self.flush()
+        return None
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,77 @@
+"""Shared fixtures: a local stub of the Neotoma relevance API.
+
+The stub is a real `http.server` running in a thread, so requests go through
+the package's pooled client, retries and timeouts exactly as they would
+against the live API.
+"""
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from article_relevance.api_client import configure_client
+
+
+class StubAPI:
+    """_Routes requests to handlers and records every request it receives._
+
+    A handler takes the parsed query (GET) or the decoded `data` field (POST) and
+    returns a `(status_code, json_body)` pair.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    def calls(self, method: str = None, path: str = None):
+        with self.lock:
+            return [i for i in self.requests
+                    if (method is None or i[0] == method) and (path is None or i[1] == path)]
+
+
+def _handler(api: StubAPI):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, method: str, payload):
+            path = urllib.parse.urlparse(self.path).path
+            with api.lock:
+                api.requests.append((method, path, payload))
+            handler = api.routes.get((method, path))
+            status, body = (404, {'status': 'failure', 'message': 'No route.'}) if handler is None else handler(payload)
+            content = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._respond('GET', urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8'))
+            self._respond('POST', json.loads(form['data'][0]) if 'data' in form else form)
+    return Handler
+
+
+@pytest.fixture
+def api():
+    """_A running stub API, with the shared client pointed at it and retries without waiting._"""
+    stub = StubAPI()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(stub))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    configure_client(api_home = f'127.0.0.1:{server.server_port}', retries = 2,
+                     backoff_factor = 0, backoff_jitter = 0)
+    yield stub
+    server.shutdown()
+    server.server_close()
+    configure_client()
@@ -0,0 +1,111 @@
+"""Batched existence checks and bulk registration against the stub API."""
+from datetime import datetime
+
+import numpy as np
+
+from article_relevance.check_apis import embeddings_exist
+from article_relevance.register_apis import register_dois_bulk, register_embeddings_bulk
+from article_relevance.embedding_codec import decode_embedding
+
+
+def test_embeddings_exist_sends_one_request_per_batch(api):
+    def lookup(query):
+        # Only DOIs ending in 0 have an embedding.
+        return 200, {'data': [{'doi': i, 'model': query['model'][0]} for i in query['doi'] if i.endswith('0')]}
+    api.route('GET', '/v0.1/doi/embeddings', lookup)
+    dois = [f'10.1000/x{i}' for i in range(250)]
+
+    found = embeddings_exist(dois, model = 'test/model', batch_size = 100)
+
+    assert len(api.calls('GET', '/v0.1/doi/embeddings')) == 3
+    assert list(found) == dois
+    assert sum(i is not None for i in found.values()) == 25
+    assert found['10.1000/x10'] == {'doi': '10.1000/x10', 'model': 'test/model'}
+
+
+def test_embeddings_exist_marks_a_failed_batch_unknown(api):
+    def lookup(query):
+        if '10.1000/x0' in query['doi']:
+            return 500, {'message': 'down'}
+        return 200, {'data': [{'doi': i} for i in query['doi']]}
+    api.route('GET', '/v0.1/doi/embeddings', lookup)
+
+    found = embeddings_exist([f'10.1000/x{i}' for i in range(4)], model = 'm', batch_size = 2)
+
+    # The failing batch is retried by the client, then reported as not found.
+    assert len(api.calls('GET', '/v0.1/doi/embeddings')) == 3 + 1
+    assert found == {'10.1000/x0': None, '10.1000/x1': None,
+                     '10.1000/x2': {'doi': '10.1000/x2'}, '10.1000/x3': {'doi': '10.1000/x3'}}
+
+
+def test_server_errors_are_retried(api):
+    attempts = []
+
+    def flaky(query):
+        attempts.append(1)
+        return (503, {}) if len(attempts) == 1 else (200, {'data': [{'doi': '10.1000/a'}]})
+    api.route('GET', '/v0.1/doi/embeddings', flaky)
+
+    assert embeddings_exist(['10.1000/a'], model = 'm')['10.1000/a'] == {'doi': '10.1000/a'}
+    assert len(attempts) == 2
+
+
+def test_register_dois_bulk_reports_each_status(api):
+    def insert(records):
+        return 200, {'status': 'success',
+                     'data': [{'status': 'present' if i['doi'].endswith('1') else 'inserted'} for i in records]}
+    api.route('POST', '/v0.1/doi', insert)
+    dois = [f'10.1000/x{i}' for i in range(12)] + ['not a doi']
+
+    outcome = register_dois_bulk(dois, batch_size = 5, verbose = False)
+
+    assert len(api.calls('POST', '/v0.1/doi')) == 3
+    assert len(outcome['submitted']) == 12
+    assert sorted(i['doi'] for i in outcome['present']) == ['10.1000/x1', '10.1000/x11']
+    assert len(outcome['inserted']) == 10
+    assert outcome['rejected'] == []
+
+
+def test_register_embeddings_bulk_fails_a_rejected_batch_only(api):
+    def insert(records):
+        if any(i['doi'] == '10.1000/bad' for i in records):
+            return 400, {'status': 'failure', 'message': 'Bad record.'}
+        return 200, {'status': 'success', 'data': [{'status': 'inserted'} for _ in records]}
+    api.route('POST', '/v0.1/doi/embeddings', insert)
+    vectors = np.arange(12, dtype = np.float32).reshape(4, 3)
+    records = [{'doi': doi, 'embeddings': vector, 'date': datetime(2024, 9, 22), 'model': 'm'}
+               for doi, vector in zip(['10.1000/a', '10.1000/b', '10.1000/bad', '10.1000/c'], vectors)]
+
+    results = register_embeddings_bulk(records, batch_size = 2, encoding = 'float32')
+
+    assert [i['status'] for i in results] == ['inserted', 'inserted', 'failed', 'failed']
+    assert results[2]['message'] == 'Bad record.'
+    sent = api.calls('POST', '/v0.1/doi/embeddings')[0][2]
+    assert np.array_equal(decode_embedding(sent[1]['embeddings'], 'float32'), vectors[1])
+
+
+def test_server_errors_are_not_retried_for_inserts(api):
+    api.route('POST', '/v0.1/doi', lambda records: (503, {'status': 'failure', 'message': 'down'}))
+
+    outcome = register_dois_bulk(['10.1000/a'], verbose = False)
+
+    # The insert may have been committed before the error, so it is not sent again.
+    assert len(api.calls('POST', '/v0.1/doi')) == 1
+    assert outcome['inserted'] == [] and outcome['rejected'] == [{'doi': '10.1000/a'}]
+
+
+def test_records_without_a_status_are_failed(api):
+    def insert(records):
+        if len(records) == 2:
+            return 200, {'status': 'success'}
+        return 200, {'status': 'success', 'data': [{'status': 'inserted'}]}
+    api.route('POST', '/v0.1/doi', insert)
+
+    outcome = register_dois_bulk([f'10.1000/x{i}' for i in range(5)], batch_size = 2, verbose = False)
+
+    # Neither full batch listed a status per DOI, and the last batch of one did.
+    assert outcome['inserted'] == outcome['submitted'][-1:]
+    assert outcome['rejected'] == outcome['submitted'][:4]
+    api.route('POST', '/v0.1/doi', lambda records: (200, {'status': 'success', 'data': [{'status': 'inserted'}]}))
+    short = register_dois_bulk(['10.1000/y0', '10.1000/y1'], batch_size = 2, verbose = False)
+    assert short['inserted'] == short['submitted'][:1] and short['rejected'] == short['submitted'][1:]
@@ -0,0 +1,124 @@
+"""CrossRef harvesting: retries, rate limit handling, caching and S3 uploads."""
+import json
+import re
+
+import boto3
+import pytest
+import requests
+import responses
+from moto import mock_aws
+
+from article_relevance import raw_crossref as rc
+from article_relevance.crossref_cache import CrossRefCache
+from article_relevance.rate_limit import TokenBucket
+
+WORKS = 'https://api.crossref.org/works/'
+
+
+@pytest.fixture(autouse = True)
+def no_sleep(monkeypatch):
+    """_Record backoff waits instead of sleeping._"""
+    waits = []
+    monkeypatch.setattr(rc.time, 'sleep', waits.append)
+    return waits
+
+
+def record(doi):
+    return {'status': 'ok', 'message': {'DOI': doi, 'title': [f'Title of {doi}']}}
+
+
+@responses.activate
+def test_rate_limited_requests_are_retried_after_the_server_wait(no_sleep):
+    responses.get(WORKS + '10.1000/a', status = 429, headers = {'Retry-After': '3'}, json = {})
+    responses.get(WORKS + '10.1000/a', json = record('10.1000/a'))
+
+    assert rc.pull_crossref('10.1000/a') == record('10.1000/a')
+    assert len(responses.calls) == 2
+    assert no_sleep == [3.0]
+
+
+@responses.activate
+def test_rate_limit_headers_set_the_shared_limiter():
+    responses.get(WORKS + '10.1000/a', json = record('10.1000/a'),
+                  headers = {'X-Rate-Limit-Limit': '50', 'X-Rate-Limit-Interval': '1s'})
+    limiter = TokenBucket(rate = 5)
+
+    rc.pull_crossref('10.1000/a', limiter = limiter)
+
+    assert limiter.rate == 50.0
+
+
+@responses.activate
+def test_rate_limits_below_one_call_per_second_still_hand_out_tokens():
+    responses.get(WORKS + '10.1000/a', json = record('10.1000/a'),
+                  headers = {'X-Rate-Limit-Limit': '5', 'X-Rate-Limit-Interval': '10s'})
+    limiter = TokenBucket(rate = 5)
+
+    rc.pull_crossref('10.1000/a', limiter = limiter)
+
+    assert limiter.rate == 0.5 and limiter.capacity == 1
+    assert limiter.acquire() == 0.0
+    assert TokenBucket(rate = 0.5).acquire() == 0.0
+
+
+@responses.activate
+def test_transport_errors_are_retried_then_reported(no_sleep):
+    responses.get(WORKS + '10.1000/a', body = requests.exceptions.ConnectionError('refused'))
+    cache = CrossRefCache(':memory:')
+
+    result = rc.pull_crossref('10.1000/a', max_retries = 2, cache = cache)
+
+    assert result['status'] == 'failure'
+    assert len(responses.calls) == 3
+    assert no_sleep == [1, 2]
+    assert len(cache) == 0
+
+
+@responses.activate
+def test_records_are_cached_and_failures_are_not():
+    responses.get(WORKS + '10.1000/a', json = record('10.1000/a'))
+    responses.get(WORKS + '10.1000/down', status = 503, body = 'unavailable')
+    responses.get(WORKS + '10.1000/missing', status = 404, body = 'Resource not found.')
+    cache = CrossRefCache(':memory:')
+
+    for _ in range(2):
+        assert rc.pull_crossref('10.1000/a', cache = cache) == record('10.1000/a')
+        assert rc.pull_crossref('10.1000/missing', cache = cache)['status'] == 'failure'
+        assert rc.pull_crossref('10.1000/down', max_retries = 1, cache = cache)['status'] == 'failure'
+
+    calls = [i.request.url.rsplit('/', 1)[1] for i in responses.calls]
+    # The record and the 404 are served from the cache the second time; the 503 is asked for again.
+    assert calls.count('a') == 1
+    assert calls.count('missing') == 1
+    assert calls.count('down') == 4
+    assert rc.pull_crossref('10.1000/A ', cache = cache) == record('10.1000/a')
+
+
+@responses.activate
+@mock_aws
+def test_raw_crossref_uploads_each_new_doi_once(monkeypatch, tmp_path):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    s3 = boto3.client('s3', region_name = 'us-east-1')
+    s3.create_bucket(Bucket = 'crossref-test')
+    s3.put_object(Bucket = 'crossref-test', Key = rc.doi_to_key('10.1000/old'), Body = b'{}')
+    requested = []
+
+    def works(request):
+        # moto also patches requests, so count calls here rather than with `responses.calls`.
+        doi = request.url[len(WORKS):]
+        requested.append(doi)
+        return 200, {}, json.dumps(record(doi))
+    responses.add_callback(responses.GET, re.compile(re.escape(WORKS) + '.*'), callback = works)
+
+    fetched = rc.raw_crossref(['10.1000/a', '10.1000/b', '10.1000/b ', '10.1000/c', '10.1000/old', None],
+                              {'Bucket': 'crossref-test'}, workers = 3, rate = 1000,
+                              manifest = str(tmp_path / 'manifest.json'))
+
+    assert sorted(rc.normalize_doi(i) for i in fetched) == ['10.1000/a', '10.1000/b', '10.1000/c']
+    assert len(requested) == 3
+    stored = s3.get_object(Bucket = 'crossref-test', Key = rc.doi_to_key('10.1000/b'))['Body'].read()
+    assert json.loads(stored) == record('10.1000/b')
+    # The manifest now lists the uploads, so a second run fetches nothing.
+    assert rc.raw_crossref(['10.1000/a', '10.1000/old'], {'Bucket': 'crossref-test'},
+                           manifest = str(tmp_path / 'manifest.json')) == []
+    assert len(requested) == 3
@@ -0,0 +1,115 @@
+"""The partitioned prediction dataset, on local disk and on (moto) S3, read back with loadPQ."""
+import os
+import shutil
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pytest
+from moto import mock_aws
+
+from article_relevance.batch_scoring import PREDICTION_SCHEMA, prediction_table
+from article_relevance.loadPQ import loadPQ
+from article_relevance.predToPQ import predToPQ
+from article_relevance.prediction_dataset import LocalStorage, PredictionDataset, S3Storage, MANIFEST_DIR
+
+
+def predictions(dois, proba = 0.9, model = 'models/lr.joblib', date = '2024-09-22 10:00'):
+    return prediction_table(dois, [proba] * len(dois), [proba >= 0.5] * len(dois), model,
+                            prediction_date = pd.Timestamp(date).to_pydatetime())
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name = 'us-east-1')
+        client.create_bucket(Bucket = 'predictions-test')
+        yield client
+
+
+def test_append_writes_one_file_and_fragment_per_partition(tmp_path):
+    dataset = PredictionDataset(LocalStorage(str(tmp_path)))
+    batch = pa.concat_tables([predictions(['10.1/a', '10.1/b']), predictions(['10.1/a'], model = 'tree.joblib')])
+
+    keys = dataset.append(batch)
+
+    assert sorted(i.rsplit('/', 1)[0] for i in keys) == ['run_date=2024-09-22/model=lr', 'run_date=2024-09-22/model=tree']
+    assert len(os.listdir(tmp_path / MANIFEST_DIR)) == 1
+    assert dataset.num_rows() == 3
+
+
+def test_appends_do_not_rewrite_the_manifest(tmp_path):
+    dataset = PredictionDataset(LocalStorage(str(tmp_path)))
+    dataset.append(predictions(['10.1/a']))
+    first = sorted(os.listdir(tmp_path / MANIFEST_DIR))
+    dataset.append(predictions(['10.1/b']))
+
+    fragments = sorted(os.listdir(tmp_path / MANIFEST_DIR))
+    assert len(fragments) == 2 and fragments[0] == first[0]
+    assert sorted(loadPQ(AWS = False, parquetPath = str(tmp_path))['doi']) == ['10.1/a', '10.1/b']
+
+
+def test_compact_merges_partitions_and_folds_the_manifest(tmp_path):
+    dataset = PredictionDataset(LocalStorage(str(tmp_path)))
+    for i in range(5):
+        dataset.append(predictions([f'10.1/{i}']))
+
+    assert dataset.compact(min_files = 4) == 1
+    assert len(dataset.files()) == 1
+    assert len(os.listdir(tmp_path / MANIFEST_DIR)) == 1
+    assert len(os.listdir(tmp_path / 'run_date=2024-09-22' / 'model=lr')) == 1
+    assert sorted(loadPQ(AWS = False, parquetPath = str(tmp_path))['doi']) == [f'10.1/{i}' for i in range(5)]
+
+
+def test_loadpq_ignores_files_outside_the_manifest(tmp_path):
+    dataset = PredictionDataset(LocalStorage(str(tmp_path)))
+    key = dataset.append(predictions(['10.1/a']))[0]
+    # A file a compaction wrote but never committed, as after a crash.
+    orphan = tmp_path / 'run_date=2024-09-22' / 'model=lr' / 'part-orphan.parquet'
+    shutil.copy(dataset.storage.path(key), orphan)
+
+    assert len(loadPQ(AWS = False, parquetPath = str(tmp_path), latest = False)) == 1
+
+
+def test_loadpq_keeps_the_latest_prediction(tmp_path):
+    predToPQ(predictions(['10.1/a', '10.1/b'], proba = 0.2), AWS = False, parquetPath = str(tmp_path))
+    predToPQ(predictions(['10.1/a'], proba = 0.8, date = '2024-09-23 10:00'), AWS = False, parquetPath = str(tmp_path))
+    path = str(tmp_path / 'prediction_parquet')
+
+    latest = loadPQ(AWS = False, parquetPath = path).set_index('doi')
+    assert latest['predict_proba'].to_dict() == pytest.approx({'10.1/a': 0.8, '10.1/b': 0.2})
+    assert len(loadPQ(AWS = False, parquetPath = path, latest = False)) == 3
+    filtered = loadPQ(AWS = False, parquetPath = path, filter = [('run_date', '=', '2024-09-23')], columns = ['doi'])
+    assert filtered['doi'].tolist() == ['10.1/a']
+
+
+def test_loadpq_unifies_schemas_and_missing_columns(tmp_path):
+    dataset = PredictionDataset(LocalStorage(str(tmp_path)))
+    dataset.append(predictions(['10.1/a']))
+    dataset.append(prediction_table(['10.1/b'], [0.7], [1], 'mean:lr,tree', columns = {'predict_proba_lr': [0.7]},
+                                    prediction_date = pd.Timestamp('2024-09-22').to_pydatetime()))
+
+    table = loadPQ(AWS = False, parquetPath = str(tmp_path), as_table = True)
+    assert table.schema.field('predict_proba_lr').type == PREDICTION_SCHEMA.field('predict_proba').type
+    frame = loadPQ(AWS = False, parquetPath = str(tmp_path), columns = ['doi', 'gddid'])
+    assert frame['gddid'].isna().all() and len(frame) == 2
+
+
+def test_loadpq_returns_an_empty_table_for_a_missing_dataset(tmp_path):
+    table = loadPQ(AWS = False, parquetPath = str(tmp_path / 'missing'), as_table = True)
+
+    assert table.num_rows == 0 and table.schema == PREDICTION_SCHEMA
+
+
+def test_s3_dataset_appends_and_compacts(s3):
+    dataset = PredictionDataset(S3Storage('predictions-test', 'output', s3 = s3))
+    for i in range(3):
+        predToPQ(predictions([f'10.1/{i}']), object_key = 'output', bucket_name = 'predictions-test', s3 = s3)
+
+    assert dataset.num_rows() == 3
+    assert dataset.compact(min_files = 2) == 1
+    keys = [i['Key'] for i in s3.list_objects_v2(Bucket = 'predictions-test')['Contents']]
+    assert len([i for i in keys if i.endswith('.parquet')]) == 1
+    assert len([i for i in keys if i.startswith(f'output/{MANIFEST_DIR}/')]) == 1
+    assert dataset.num_rows() == 3
+